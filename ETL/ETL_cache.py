@@ -0,0 +1,164 @@
+import os
+import json
+import datetime
+import logging
+import threading
+import time
+from . import config
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """On-disk cache of API responses for one source, keyed by endpoint and date.
+
+    Responses written at least the policy's immutable_after_days after the
+    day they describe never expire; others are refetched once older than
+    recent_ttl seconds.
+    Entries are stored as JSON under <cache_dir>/<source>/<endpoint>/<key>.json.
+
+    Args:
+        source (str): Source name, selects the policy in config.CACHE_POLICIES
+        cache_dir (str): Root cache directory
+        policy (dict, optional): Overrides the configured policy
+    """
+    def __init__(self, source, cache_dir=config.CACHE_DIR, policy=None):
+        self.source = source
+        self.cache_dir = os.path.join(cache_dir, source)
+        self.policy = policy or config.CACHE_POLICIES.get(source, config.CACHE_POLICIES['default'])
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def is_fresh(self, path, date):
+        """Check whether a cached entry for the given date can still be used.
+
+        An entry only becomes immutable if it was written immutable_after_days
+        after its date, when the day's data has settled. Entries written
+        earlier, such as a response for a day still in progress, keep
+        expiring after recent_ttl however old their date gets.
+        """
+        if not os.path.exists(path):
+            return False
+        mtime = os.path.getmtime(path)
+        written = datetime.date.fromtimestamp(mtime)
+        if (written - date).days >= self.policy['immutable_after_days']:
+            return True
+        return time.time() - mtime < self.policy['recent_ttl']
+
+    def get(self, endpoint, date, fetch, key=None):
+        """Return the cached response, or call fetch() and cache its result.
+
+        Args:
+            endpoint (str): Endpoint name, used as a sub-directory
+            date (datetime.date or str): Day the response describes (the last
+                day for range requests), used for the expiry policy
+            fetch (callable): Function without arguments doing the API call
+            key (str, optional): File name of the entry, defaults to the date
+
+        Returns:
+            The (JSON-serializable) response
+        """
+        if isinstance(date, str):
+            date = datetime.datetime.strptime(date[:10], '%Y-%m-%d').date()
+        elif isinstance(date, datetime.datetime):
+            date = date.date()
+        path = os.path.join(self.cache_dir, endpoint, f"{key or date.strftime('%Y-%m-%d')}.json")
+
+        if self.is_fresh(path, date):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    response = json.load(f)
+                with self.lock:
+                    self.hits += 1
+                return response
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable cache entry {path}: {str(e)}")
+
+        response = fetch()
+        with self.lock:
+            self.misses += 1
+
+        # Write to a temporary file first so readers never see partial entries
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(response, f, default=str)
+            os.replace(temp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not cache {self.source} {endpoint} for {date}: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        return response
+
+    def get_range(self, endpoint, start_date, end_date, fetch):
+        """Return a cached range response, or call fetch() and cache its result.
+
+        Entries are keyed by start_end and follow the policy of their last
+        day: ranges ending recently are reused within recent_ttl, so a rerun
+        shortly after a run does not refetch them. As their key changes when
+        the range end moves, expired entries are left to prune().
+
+        Args:
+            endpoint (str): Endpoint name, used as a sub-directory
+            start_date, end_date (datetime.date): First and last day of the range
+            fetch (callable): Function without arguments doing the API call
+
+        Returns:
+            The (JSON-serializable) response
+        """
+        return self.get(endpoint, end_date, fetch, key=f"{start_date}_{end_date}")
+
+    def prune(self):
+        """Delete the entries that can no longer be served, and leftover temporary files.
+
+        Returns:
+            int: Number of files deleted
+        """
+        removed = 0
+        for directory, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(directory, name)
+                if name.endswith('.json'):
+                    # Keys are a date or a start_end range, dated by their last day
+                    try:
+                        date = datetime.datetime.strptime(name[:-5][-10:], '%Y-%m-%d').date()
+                    except ValueError:
+                        continue
+                    stale = not self.is_fresh(path, date)
+                else:
+                    stale = name.endswith('.tmp') and time.time() - os.path.getmtime(path) > self.policy['recent_ttl']
+                if stale:
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except OSError as e:
+                        logger.warning(f"Could not remove cache entry {path}: {str(e)}")
+        return removed
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(source):
+    """Get the process-wide ResponseCache of a source."""
+    with _caches_lock:
+        if source not in _caches:
+            _caches[source] = ResponseCache(source)
+        return _caches[source]
+
+def log_cache_stats():
+    """Log cache hits and misses per source."""
+    for source, cache in sorted(_caches.items()):
+        total = cache.hits + cache.misses
+        hit_rate = cache.hits / total * 100 if total else 0
+        logger.info(f"Response cache {source}: {cache.hits} hits, {cache.misses} misses ({hit_rate:.0f}% hit rate)")
+
+def prune_caches():
+    """Delete the stale entries of every source cache (see ResponseCache.prune)."""
+    for source in config.CACHE_POLICIES:
+        if source == 'default':
+            continue
+        removed = get_cache(source).prune()
+        if removed:
+            logger.info(f"Response cache {source}: pruned {removed} stale entries")
@@ -7,6 +7,8 @@ import logging
 import sys
 from datetime import datetime
 from . import config
+from .ETL_storage import load_dataset, save_dataset
+from .ETL_schema import apply_metrics_schema
 
 # Configure logging
 logging.basicConfig(
@@ -39,8 +41,7 @@ def create_dashboard_data():
     
     # Load integrated data
     try:
-        df = pd.read_csv(config.INTEGRATED_DATA_PATH)
-        df['date'] = pd.to_datetime(df['date'])
+        df = load_dataset('integrated')
         logger.info(f"Loaded data from {df['date'].min()} to {df['date'].max()}")
     except Exception as e:
         logger.error(f"Error loading integrated data: {str(e)}")
@@ -49,65 +50,6 @@ def create_dashboard_data():
     # Calculate derived metrics
     df = calculate_derived_metrics(df)
     
-    # Apply rounding to metrics
-    rounding_rules = {
-        # Sleep metrics (0 decimals for scores, 2 for durations)
-        'sleep_score_performance': 0,
-        'sleep_score_consistency': 0,
-        'sleep_score_efficiency': 0,
-        'sleep_duration': 2,
-        'sleep_rem': 2,
-        'sleep_deep': 2,
-        'sleep_light': 2,
-        'sleep_awake': 2,
-        
-        # Recovery metrics (0 decimals for scores and HR, 1 for TSB)
-        'recovery_score': 0,
-        'resting_hr': 0,
-        'hrv': 0,
-        'TSB': 1,
-        'averageStressLevel': 0,
-        'bodyBatteryHighestValue': 0,
-        'bodyBatteryLowestValue': 0,
-        
-        # Glucose metrics (0 decimals)
-        'wake_up_glucose': 0,
-        'mean_glucose': 0,
-        'max_glucose': 0,
-        'std_glucose': 0,
-        'time_in_range': 0,
-        
-        # Body composition (1 decimal)
-        'weight': 1,
-        'body_fat': 1,
-        'bmi': 1,
-        'fat_weight': 1,
-        
-        # Training metrics (1 decimal for load metrics, 0 for others)
-        'CTL': 1,
-        'ATL': 1,
-        'TSS': 1,
-        'training_load': 0,
-        'distance': 0,
-        'elevationGain': 0,
-        'strength_minutes': 0,
-        
-        # Nutrition metrics (0 decimals)
-        'calories_net': 0,
-        'calories_consumed': 0,
-        'protein': 0,
-        'carbs': 0,
-        'fat': 0,
-        'sugar': 0,
-        
-        # New Garmin metrics
-        'vo2max': 1,              # 1 decimal for VO2max
-        'predicted_5k': 0,        # 0 decimals for race times (in minutes)
-        'predicted_10k': 0,
-        'predicted_half': 0,
-        'predicted_marathon': 0
-    }
-    
     # Define all required columns in order
     required_columns = [
         # Date
@@ -153,10 +95,8 @@ def create_dashboard_data():
         if col in df.columns:
             dashboard_df[col] = df[col]
     
-    # Apply rounding rules
-    for col, decimals in rounding_rules.items():
-        if col in dashboard_df.columns:
-            dashboard_df[col] = dashboard_df[col].round(decimals)
+    # Round the derived metrics; the integrated ones were rounded by integrate_data
+    dashboard_df = apply_metrics_schema(dashboard_df, source='dashboard')
     
     # Ensure date is in correct format
     dashboard_df['date'] = pd.to_datetime(dashboard_df['date']).dt.strftime('%Y-%m-%d')
@@ -176,7 +116,7 @@ def main():
     if df is not None:
         # Save to CSV
         output_file = config.DASHBOARD_DATA_PATH
-        df.to_csv(output_file, index=False)
+        save_dataset('dashboard', df)
         logger.info(f"Dashboard data saved to {output_file}")
         
         # Print summary
@@ -12,6 +12,7 @@ import time
 import base64
 import fitbit
 from ETL import config
+from ETL.ETL_cache import get_cache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -174,8 +175,17 @@ def refresh_token_cb(token_dict):
         json.dump(token_dict, f)
     return token_dict
 
-def get_body_measurements(tokens):
-    """Get weight data from Fitbit."""
+def get_body_measurements(tokens, start_date=None):
+    """Get weight data from Fitbit.
+    
+    Args:
+        tokens (dict): Fitbit OAuth tokens
+        start_date (datetime.date, optional): First day pulled, the start of the
+            refresh window from get_refresh_window. Defaults to config.DATA_START_DATE
+    
+    Returns:
+        pd.DataFrame: Weight and body fat per day from start_date (empty on errors)
+    """
     try:
         client = fitbit.Fitbit(
             os.getenv("FITBIT_CLIENT_ID"),
@@ -185,23 +195,29 @@ def get_body_measurements(tokens):
             refresh_cb=refresh_token_cb
         )
         
-        # Use config start date and current date
         end_date = datetime.now().date()
-        start_date = config.DATA_START_DATE
+        if start_date is None:
+            start_date = config.DATA_START_DATE
         logger.info(f"Fetching weight data from {start_date} to {end_date}")
         
         # Get weight data using time series API
         weight_data = []
         
         # Get weight time series
-        data = client.time_series('body/weight', base_date=start_date.strftime('%Y-%m-%d'),
-                                end_date=end_date.strftime('%Y-%m-%d'))
+        data = get_cache('fitbit').get_range(
+            'body-weight', start_date, end_date,
+            lambda: client.time_series('body/weight', base_date=start_date.strftime('%Y-%m-%d'),
+                                       end_date=end_date.strftime('%Y-%m-%d'))
+        )
         entries = data.get('body-weight', [])
         logger.info(f"Retrieved {len(entries)} weight entries")
         
         # Get body fat time series
-        fat_data = client.time_series('body/fat', base_date=start_date.strftime('%Y-%m-%d'),
-                                    end_date=end_date.strftime('%Y-%m-%d'))
+        fat_data = get_cache('fitbit').get_range(
+            'body-fat', start_date, end_date,
+            lambda: client.time_series('body/fat', base_date=start_date.strftime('%Y-%m-%d'),
+                                       end_date=end_date.strftime('%Y-%m-%d'))
+        )
         fat_entries = fat_data.get('body-fat', [])
         logger.info(f"Retrieved {len(fat_entries)} body fat entries")
         
@@ -7,6 +7,8 @@ import json
 import logging
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from getpass import getpass
 
 import readchar
@@ -19,6 +21,10 @@ from garminconnect import (
     GarminConnectConnectionError,
     GarminConnectTooManyRequestsError,
 )
+from ETL import config
+from ETL.ETL_general import TokenBucket, rate_limited_call
+from ETL.ETL_cache import get_cache
+from ETL.ETL_storage import get_refresh_window, write_dataset_from
 # Configure debug logging
 # logging.basicConfig(level=logging.DEBUG)
 logging.basicConfig(level=logging.INFO)
@@ -102,116 +108,157 @@ def process_vo2max(all_data):
             
     return all_data
 
-def get_garmin_data(garmin_client, start_date=datetime.date(2024, 3, 16)):
-    """Get Garmin data from start_date to today.
-    If the existing data file is mostly empty, it will pull all data since March 16, 2024.
-    Otherwise, it will pull the last week of data and merge it with existing data."""
-    api = garmin_client
-    end_date = datetime.date.today()
-    data_file = 'Data/Cleaned/Garmin_daily.csv'
-    
-    # Check existing data
-    if os.path.exists(data_file):
-        existing_data = pd.read_csv(data_file)
-        if len(existing_data) > 0:
-            # If we have data, start from the last date minus 7 days
-            last_date = pd.to_datetime(existing_data['date'].max()).date()
-            start_date = last_date - datetime.timedelta(days=7)
-            logger.info(f"Found existing data, pulling from {start_date} onwards")
-            
-            # Remove the last week of data from existing_data to avoid duplicates
-            cutoff_date = start_date.strftime('%Y-%m-%d')
-            existing_data = existing_data[existing_data['date'] < cutoff_date]
-        else:
-            logger.info("Existing data is empty, pulling all data since March 16, 2024")
-            start_date = datetime.date(2024, 3, 16)
-            existing_data = None
-    else:
-        logger.info("No existing data found, pulling all data since March 16, 2024")
-        start_date = datetime.date(2024, 3, 16)
-        existing_data = None
-    
-    logger.info(f"Getting Garmin data from {start_date} to {end_date}")
-    total_days = (end_date - start_date).days + 1
-    processed_days = 0
-    
-    # Initialize empty list to store data
-    data_list = []
+def garmin_call(bucket, func, *args, **kwargs):
+    """Call the Garmin API through the rate limiter, backing off when throttled."""
+    return rate_limited_call(bucket, func, *args, retry_on=(GarminConnectTooManyRequestsError,), **kwargs)
+
+def date_chunks(start_date, end_date, max_days):
+    """Split a date range into consecutive (start, end) ranges of at most max_days days."""
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + datetime.timedelta(days=max_days - 1), end_date)
+        yield chunk_start, chunk_end
+        chunk_start = chunk_end + datetime.timedelta(days=1)
+
+def fetch_race_predictions(api, start_date, end_date, bucket):
+    """Get daily race predictions for a date range with a few range requests.
     
-    # Loop through dates
-    current_date = start_date
-    while current_date <= end_date:
+    Returns:
+        dict: date string -> predicted_5k/10k/half/marathon values
+    """
+    predictions = {}
+    for chunk_start, chunk_end in date_chunks(start_date, end_date, config.GARMIN_RANGE_DAYS):
         try:
-            # Get data for current date
-            stats = api.get_stats(current_date)
-            
-            # Create dictionary with date and stats data
-            data_dict = {'date': current_date.strftime('%Y-%m-%d')}
-            data_dict.update(stats)
-            
-            # Get race predictions
-            try:
-                race_predictions = api.get_race_predictions(
-                    startdate=current_date,
-                    enddate=current_date,
+            race_predictions = get_cache('garmin').get_range(
+                'race_predictions', chunk_start, chunk_end,
+                lambda: garmin_call(
+                    bucket,
+                    api.get_race_predictions,
+                    startdate=chunk_start,
+                    enddate=chunk_end,
                     _type='daily'
                 )
-                if race_predictions:
-                    data_dict.update({
-                        'predicted_5k': race_predictions[0].get('time5K', 0),
-                        'predicted_10k': race_predictions[0].get('time10K', 0),
-                        'predicted_half': race_predictions[0].get('timeHalfMarathon', 0),
-                        'predicted_marathon': race_predictions[0].get('timeMarathon', 0)
-                    })
-            except Exception as e:
-                logger.warning(f"Failed to get race predictions for {current_date}: {str(e)}")
-            
-            # Get VO2max
+            )
+        except Exception as e:
+            logger.warning(f"Failed to get race predictions for {chunk_start} to {chunk_end}: {str(e)}")
+            continue
+        for prediction in race_predictions or []:
+            predictions[prediction.get('calendarDate')] = {
+                'predicted_5k': prediction.get('time5K', 0),
+                'predicted_10k': prediction.get('time10K', 0),
+                'predicted_half': prediction.get('timeHalfMarathon', 0),
+                'predicted_marathon': prediction.get('timeMarathon', 0)
+            }
+    return predictions
+
+def fetch_vo2max(api, start_date, end_date, bucket):
+    """Get daily VO2max for a date range from the max metrics range endpoint.
+    
+    Returns:
+        dict: date string -> VO2max value (only days with a value)
+    """
+    vo2max = {}
+    for chunk_start, chunk_end in date_chunks(start_date, end_date, config.GARMIN_RANGE_DAYS):
+        url = f"{api.garmin_connect_metrics_url}/{chunk_start.strftime('%Y-%m-%d')}/{chunk_end.strftime('%Y-%m-%d')}"
+        try:
+            max_metrics = get_cache('garmin').get_range(
+                'max_metrics', chunk_start, chunk_end,
+                lambda: garmin_call(bucket, api.connectapi, url)
+            )
+        except Exception as e:
+            logger.warning(f"Failed to get max metrics for {chunk_start} to {chunk_end}: {str(e)}")
+            continue
+        for metrics in max_metrics or []:
+            generic = metrics.get('generic') or {}
+            if generic.get('vo2MaxValue'):
+                vo2max[generic.get('calendarDate')] = generic['vo2MaxValue']
+    return vo2max
+
+def fetch_garmin_day(api, current_date, bucket):
+    """Get stats for one day, through the response cache and the rate limiter."""
+    # Get data for current date
+    stats = get_cache('garmin').get('stats', current_date, lambda: garmin_call(bucket, api.get_stats, current_date))
+    
+    # Create dictionary with date and stats data
+    data_dict = {'date': current_date.strftime('%Y-%m-%d')}
+    data_dict.update(stats)
+    return data_dict
+
+def fetch_garmin_days(api, start_date, end_date, max_workers=None, requests_per_second=None):
+    """Fetch daily Garmin data for a date range with a bounded worker pool.
+    
+    Daily stats are fetched one request per day in the worker pool; race
+    predictions and VO2max are fetched as ranges and joined onto the days.
+    All requests share one token bucket, and a GarminConnectTooManyRequestsError
+    pauses every worker with exponential backoff before retrying.
+    
+    Args:
+        api: Garmin client
+        start_date (datetime.date): First day to fetch
+        end_date (datetime.date): Last day to fetch
+        max_workers (int, optional): Defaults to config.GARMIN_MAX_WORKERS
+        requests_per_second (float, optional): Defaults to config.GARMIN_REQUESTS_PER_SECOND
+    
+    Returns:
+        list: One dict per successfully fetched day, in date order
+    """
+    max_workers = max_workers or config.GARMIN_MAX_WORKERS
+    requests_per_second = requests_per_second or config.GARMIN_REQUESTS_PER_SECOND
+    bucket = TokenBucket(requests_per_second)
+    
+    days = [start_date + datetime.timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    total_days = len(days)
+    processed_days = 0
+    data_list = []
+    start = time.perf_counter()
+    
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='garmin') as executor:
+        # Range requests run alongside the per-day stats
+        predictions_future = executor.submit(fetch_race_predictions, api, start_date, end_date, bucket)
+        vo2max_future = executor.submit(fetch_vo2max, api, start_date, end_date, bucket)
+        
+        futures = {executor.submit(fetch_garmin_day, api, day, bucket): day for day in days}
+        for future in as_completed(futures):
             try:
-                max_metrics = api.get_max_metrics(current_date.strftime('%Y-%m-%d'))
-                if max_metrics and max_metrics[0].get('generic', {}).get('vo2MaxValue'):
-                    data_dict['vo2max'] = max_metrics[0]['generic']['vo2MaxValue']
+                data_list.append(future.result())
             except Exception as e:
-                logger.warning(f"Failed to get max metrics for {current_date}: {str(e)}")
-            
-            # Append data to list
-            data_list.append(data_dict)
+                logger.warning(f"Failed to get data for {futures[future]}: {str(e)}")
             
             # Update progress
             processed_days += 1
-            if processed_days % 10 == 0:  # Log every 10 days
-                logger.info(f"Processed {processed_days}/{total_days} days ({(processed_days/total_days)*100:.1f}%)")
-            
-        except Exception as e:
-            logger.warning(f"Failed to get data for {current_date}: {str(e)}")
+            if processed_days % 10 == 0 or processed_days == total_days:  # Log every 10 days
+                elapsed = time.perf_counter() - start
+                logger.info(f"Processed {processed_days}/{total_days} days ({(processed_days/total_days)*100:.1f}%), "
+                            f"{processed_days / elapsed:.1f} days/s")
         
-        # Move to next date
-        current_date += datetime.timedelta(days=1)
+        predictions = predictions_future.result()
+        vo2max = vo2max_future.result()
     
-    if not data_list:
-        logger.warning("No Garmin data found for the specified date range")
-        return None
+    # Join the range series onto the daily stats
+    for data_dict in data_list:
+        data_dict.update(predictions.get(data_dict['date'], {}))
+        if data_dict['date'] in vo2max:
+            data_dict['vo2max'] = vo2max[data_dict['date']]
     
-    logger.info("Processing daily metrics...")
-    
-    # Convert list of dictionaries to DataFrame
-    df = pd.DataFrame(data_list)
-    
-    # Keep daily metrics
-    df = df[['date',
-            'averageStressLevel','restStressPercentage', 'lowStressPercentage', 
-            'mediumStressPercentage', 'highStressPercentage', 'stressQualifier',
-            'bodyBatteryHighestValue', 'bodyBatteryLowestValue', 'bodyBatteryDuringSleep',
-            'predicted_5k', 'predicted_10k', 'predicted_half', 'predicted_marathon',
-            'vo2max'
-            ]]
-    
-    logger.info("Getting activities for the same date range...")
+    return sorted(data_list, key=lambda d: d['date'])
+
+# Columns written to garmin_activities.csv
+ACTIVITY_COLUMNS = ['date', 'type', 'duration', 'training_load', 'aerobic_te', 'anaerobic_te',
+                    'avg_hr', 'max_hr', 'avg_power', 'norm_power', 'intensity_factor', 'tss']
+
+def fetch_activities(api, start_date, end_date):
+    """Get and normalize Garmin activities for a date range in one request.
     
-    # Get activities for the same date range
-    activities = api.get_activities_by_date(start_date, end_date)
+    Returns:
+        pd.DataFrame: One row per activity, with the garmin_activities.csv
+            columns plus distance and elevation_gain for the daily totals
+    """
+    logger.info(f"Getting Garmin activities from {start_date} to {end_date}")
+    activities = get_cache('garmin').get_range(
+        'activities', start_date, end_date,
+        lambda: api.get_activities_by_date(start_date, end_date)
+    )
     
-    # Process activities
     activity_data = []
     total_activities = len(activities)
     for i, activity in enumerate(activities, 1):
@@ -238,12 +285,53 @@ def get_garmin_data(garmin_client, start_date=datetime.date(2024, 3, 16)):
         if i % 10 == 0:  # Log every 10 activities
             logger.info(f"Processed {i}/{total_activities} activities ({(i/total_activities)*100:.1f}%)")
     
+    return pd.DataFrame(activity_data, columns=ACTIVITY_COLUMNS + ['distance', 'elevation_gain'])
+
+def get_garmin_data(garmin_client, start_date=datetime.date(2024, 3, 16), activities=None):
+    """Get Garmin daily data from start_date to today.
+    
+    Args:
+        garmin_client: Garmin client
+        start_date (datetime.date): First day pulled, the start of the refresh
+            window from get_refresh_window
+        activities (pd.DataFrame, optional): Activities from fetch_activities covering
+            the refresh window. If None, they are fetched here.
+    
+    Returns:
+        pd.DataFrame: One row per day from start_date, or None without data
+    """
+    api = garmin_client
+    end_date = datetime.date.today()
+    
+    if activities is None:
+        activities = fetch_activities(api, start_date, end_date)
+    
+    logger.info(f"Getting Garmin data from {start_date} to {end_date}")
+    data_list = fetch_garmin_days(api, start_date, end_date)
+    
+    if not data_list:
+        logger.warning("No Garmin data found for the specified date range")
+        return None
+    
+    logger.info("Processing daily metrics...")
+    
+    # Convert list of dictionaries to DataFrame
+    df = pd.DataFrame(data_list)
+    
+    # Keep daily metrics (columns of a failed range request are left empty)
+    df = df.reindex(columns=['date',
+            'averageStressLevel','restStressPercentage', 'lowStressPercentage', 
+            'mediumStressPercentage', 'highStressPercentage', 'stressQualifier',
+            'bodyBatteryHighestValue', 'bodyBatteryLowestValue', 'bodyBatteryDuringSleep',
+            'predicted_5k', 'predicted_10k', 'predicted_half', 'predicted_marathon',
+            'vo2max'
+            ])
+    
     logger.info("Processing activity data...")
     
-    # Save detailed activity data and merge daily totals
-    if activity_data:
-        activity_df = pd.DataFrame(activity_data)
-        
+    # Merge daily totals of the activities in the same date range
+    activity_df = activities[activities['date'] >= start_date.strftime('%Y-%m-%d')]
+    if not activity_df.empty:
         # Calculate daily totals
         daily_totals = activity_df.groupby('date').agg({
             'training_load': 'sum',
@@ -272,10 +360,6 @@ def get_garmin_data(garmin_client, start_date=datetime.date(2024, 3, 16)):
     # Fill NaN values with 0
     df = df.fillna(0)
     
-    # If we have existing data, append the new data
-    if existing_data is not None:
-        df = pd.concat([existing_data, df], ignore_index=True)
-    
     # Convert date to datetime for proper sorting and deduplication
     df['date'] = pd.to_datetime(df['date'])
     df = df.sort_values('date').drop_duplicates(subset=['date'], keep='last')
@@ -285,77 +369,34 @@ def get_garmin_data(garmin_client, start_date=datetime.date(2024, 3, 16)):
     logger.info("Completed Garmin data retrieval and processing")
     return df
 
-def get_garmin_activities(garmin_client, start_date=datetime.date(2024, 3, 16)):
+def get_garmin_activities(garmin_client, start_date=datetime.date(2024, 3, 16), activities=None):
     """Get detailed activity data for analysis from start_date to today.
-    If the existing data file is mostly empty, it will pull all data since March 16, 2024.
-    Otherwise, it will pull the last week of data and merge it with existing data."""
-    api = garmin_client
-    end_date = datetime.date.today()
-    data_file = 'Data/Cleaned/garmin_activities.csv'
-    
-    # Check existing data
-    if os.path.exists(data_file):
-        existing_data = pd.read_csv(data_file)
-        if len(existing_data) > 0:
-            # If we have data, start from the last date minus 7 days
-            last_date = pd.to_datetime(existing_data['date'].max()).date()
-            start_date = last_date - datetime.timedelta(days=7)
-            logger.info(f"Found existing data, pulling from {start_date} onwards")
-            
-            # Remove the last week of data from existing_data to avoid duplicates
-            cutoff_date = start_date.strftime('%Y-%m-%d')
-            existing_data = existing_data[existing_data['date'] < cutoff_date]
-        else:
-            logger.info("Existing data is empty, pulling all data since March 16, 2024")
-            start_date = datetime.date(2024, 3, 16)
-            existing_data = None
-    else:
-        logger.info("No existing data found, pulling all data since March 16, 2024")
-        start_date = datetime.date(2024, 3, 16)
-        existing_data = None
     
-    logger.info(f"Getting Garmin activities from {start_date} to {end_date}")
+    Args:
+        garmin_client: Garmin client
+        start_date (datetime.date): First day pulled, the start of the refresh
+            window from get_refresh_window
+        activities (pd.DataFrame, optional): Activities from fetch_activities covering
+            the refresh window. If None, they are fetched here.
     
-    try:
-        activities = api.get_activities_by_date(start_date, end_date)
-    except Exception as e:
-        logger.error(f"Failed to get activities: {str(e)}")
-        return None
+    Returns:
+        pd.DataFrame: Activities from start_date, or None without activities
+    """
+    api = garmin_client
+    end_date = datetime.date.today()
     
-    activity_data = []
-    total_activities = len(activities)
-    for i, activity in enumerate(activities, 1):
-        activity_date = pd.to_datetime(activity['startTimeLocal']).date().strftime('%Y-%m-%d')
-        
-        activity_dict = {
-            'date': activity_date,
-            'type': activity.get('activityType', {}).get('typeKey', 'unknown'),
-            'duration': activity.get('duration', 0),
-            'training_load': activity.get('activityTrainingLoad', 0),
-            'aerobic_te': activity.get('aerobicTrainingEffect', 0),
-            'anaerobic_te': activity.get('anaerobicTrainingEffect', 0),
-            'avg_hr': activity.get('averageHR', 0),
-            'max_hr': activity.get('maxHR', 0),
-            'avg_power': activity.get('avgPower', 0),
-            'norm_power': activity.get('normPower', 0),
-            'intensity_factor': activity.get('intensityFactor', 0),
-            'tss': activity.get('trainingStressScore', 0)
-        }
-        activity_data.append(activity_dict)
-        
-        if i % 10 == 0:  # Log every 10 activities
-            logger.info(f"Processed {i}/{total_activities} activities ({(i/total_activities)*100:.1f}%)")
+    if activities is None:
+        try:
+            activities = fetch_activities(api, start_date, end_date)
+        except Exception as e:
+            logger.error(f"Failed to get activities: {str(e)}")
+            return None
     
-    if not activity_data:
+    df = activities.loc[activities['date'] >= start_date.strftime('%Y-%m-%d'), ACTIVITY_COLUMNS].copy()
+    if df.empty:
         logger.warning("No activities found for the specified date range")
         return None
     
-    df = pd.DataFrame(activity_data)
-    
-    # If we have existing data, append the new data
-    if existing_data is not None:
-        df = pd.concat([existing_data, df], ignore_index=True)
-    
     # Convert date to datetime for proper sorting and deduplication
     df['date'] = pd.to_datetime(df['date'])
     df = df.sort_values('date').drop_duplicates(subset=['date', 'type', 'duration'], keep='last')
@@ -364,11 +405,38 @@ def get_garmin_activities(garmin_client, start_date=datetime.date(2024, 3, 16)):
     
     return df
 
+def get_garmin_daily_and_activities(garmin_client, daily_start, activities_start):
+    """Get Garmin daily data and detailed activities with a single activities request.
+    
+    Activities are fetched once over the union of both refresh windows and
+    shared by get_garmin_data (daily totals) and get_garmin_activities.
+    
+    Args:
+        garmin_client: Garmin client
+        daily_start (datetime.date): Start of the refresh window of the daily data
+        activities_start (datetime.date): Start of the refresh window of the activities
+    
+    Returns:
+        tuple: (daily DataFrame or None, activities DataFrame or None), with
+            the rows of their refresh windows only
+    """
+    end_date = datetime.date.today()
+    try:
+        activities = fetch_activities(garmin_client, min(daily_start, activities_start), end_date)
+    except Exception as e:
+        logger.error(f"Failed to get activities: {str(e)}")
+        return None, None
+    
+    df_daily = get_garmin_data(garmin_client, daily_start, activities=activities)
+    df_activities = get_garmin_activities(garmin_client, activities_start, activities=activities)
+    return df_daily, df_activities
+
 if __name__ == "__main__":
-    garmin_client = init_garmin(email, password)
-    df = get_garmin_data(garmin_client)
+    garmin_client = init_garmin(os.getenv("USERNAME_G"), os.getenv("PASSWORD_G"))
+    start_date, since = get_refresh_window('garmin_daily', datetime.date(2024, 3, 16))
+    df = get_garmin_data(garmin_client, start_date)
     if df is not None:
-        df.to_csv('Data/Cleaned/Garmin_daily.csv', index=False)
-        logger.info('Garmin data saved to Data/Cleaned/Garmin_daily.csv')
+        write_dataset_from('garmin_daily', df, since)
+        logger.info(f'Garmin data saved to {config.GARMIN_DAILY_FILE}')
     else:
-        logger.error('Failed to get Garmin data')
\ No newline at end of file
+        logger.error('Failed to get Garmin data')
@@ -2,27 +2,227 @@
 import pandas as pd
 import os
 import csv
+import re
+import json
 import datetime
 import logging
+import threading
+import time
+from . import config
 
 logger = logging.getLogger(__name__)
 
+class TokenBucket:
+    """Thread-safe token bucket limiting how often API calls are made.
+    
+    Args:
+        rate (float): Tokens added per second (sustained requests per second)
+        capacity (int, optional): Maximum burst size, defaults to one second of tokens
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.paused_until - now
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Stop handing out tokens to every caller for the given time."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.paused_until
+
+def rate_limited_call(bucket, func, *args, retry_on=(), max_retries=4, base_delay=2.0, pause_all=True, **kwargs):
+    """Call func through a token bucket, backing off exponentially on retry_on errors.
+    
+    By default the backoff pauses the whole bucket, so concurrent workers
+    sharing it slow down together instead of each hitting the rate limit again.
+    
+    Args:
+        bucket (TokenBucket): Rate limiter shared by all workers of a source,
+            or None to only retry
+        func (callable): Function doing the API call
+        retry_on (tuple): Exception types that trigger a retry
+        max_retries (int): Retries before the exception is re-raised
+        base_delay (float): Delay in seconds before the first retry, doubled each time
+        pause_all (bool): Pause every worker of the bucket (rate limiting), or
+            only the calling one (errors specific to this call)
+    """
+    for attempt in range(max_retries + 1):
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            return func(*args, **kwargs)
+        except retry_on as e:
+            if attempt == max_retries:
+                raise
+            delay = base_delay * 2 ** attempt
+            logger.warning(f"{type(e).__name__} in {getattr(func, '__name__', 'call')}, retrying in {delay:.0f}s")
+            if pause_all and bucket is not None:
+                bucket.pause(delay)
+            else:
+                time.sleep(delay)
+
+def parse_timezone_offsets(offsets):
+    """Convert a column of UTC offsets ('+02:00', '-05:30' or 'Z') to timedeltas.
+    
+    Args:
+        offsets (pd.Series): Offset strings
+        
+    Returns:
+        pd.Series: Timedeltas with the same index
+    """
+    offsets = offsets.astype(str).replace('Z', '+00:00')
+    sign = offsets.str[0].map({'-': -1}).fillna(1)
+    parts = offsets.str.lstrip('+-').str.split(':', expand=True).astype(int)
+    minutes = sign * (parts[0] * 60 + parts[1])
+    return pd.to_timedelta(minutes, unit='m')
+
+# Dates at the start of a CSV row (YYYY-MM-DD, optionally quoted)
+ROW_DATE_PATTERN = re.compile(rb'"?(\d{4}-\d{2}-\d{2}[^,"]*)')
+
+def get_date_index_file(filename):
+    """Path of the sidecar file caching the most recent date of a CSV file."""
+    return f"{filename}.index.json"
+
+def load_date_index(filename):
+    """Load the date index of a CSV file: max date, rows, sorted flag, mtime, size and tail."""
+    try:
+        with open(get_date_index_file(filename), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def read_end_bytes(filename, size, length=64):
+    """Hex of the length bytes of a file ending at offset size, to recognize appends."""
+    with open(filename, 'rb') as f:
+        f.seek(max(0, size - length))
+        return f.read(min(size, length)).hex()
+
+def save_date_index(filename, stat, max_date, rows, is_sorted):
+    """Save the date index of a CSV file for its current mtime and size.
+    
+    rows is None when only the tail of the file was read. The last bytes of
+    the file are kept, so that a later call can check the file was only
+    appended to.
+    """
+    index = {
+        'max_date': max_date.strftime('%Y-%m-%d') if max_date else None,
+        'rows': rows,
+        'sorted': is_sorted,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'tail': read_end_bytes(filename, stat.st_size)
+    }
+    try:
+        with open(get_date_index_file(filename), 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+    except OSError as e:
+        logger.warning(f"Could not save the date index of {filename}: {str(e)}")
+
+def save_truncated_date_index(filename):
+    """Update the date index of a date-sorted CSV file after truncating it in place.
+    
+    The last kept row holds the most recent date, so the next lookup does
+    not have to scan the file again. The index is left as is (and the next
+    lookup scans the file) if it did not record the file as sorted.
+    """
+    index = load_date_index(filename)
+    if index is None or not index['sorted']:
+        return
+    dates = read_tail_dates(filename)
+    if dates is None:
+        return
+    max_date = datetime.datetime.strptime(dates[-1], '%Y-%m-%d').date() if dates else None
+    save_date_index(filename, os.stat(filename), max_date, None, True)
+
+def read_tail_dates(filename, tail_bytes=8192):
+    """Dates of the complete rows in the last bytes of a CSV file.
+    
+    Returns:
+        list: Dates (YYYY-MM-DD) in file order, or None if a row does not start
+            with a date or no complete row fits in tail_bytes
+    """
+    with open(filename, 'rb') as f:
+        header_end = len(f.readline())
+        end = f.seek(0, os.SEEK_END)
+        start = max(header_end, end - tail_bytes)
+        f.seek(start)
+        lines = f.read().split(b'\n')
+
+    # Unless the header was reached, the first line may be partial
+    if start > header_end:
+        lines = lines[1:]
+    dates = []
+    for line in lines:
+        if line.strip():
+            match = ROW_DATE_PATTERN.match(line)
+            if not match:
+                return None
+            dates.append(match.group(1)[:10].decode())
+    if not dates and end > header_end:
+        return None
+    return dates
+
 # Function to get the most recent date from a CSV file
 def get_most_recent_date(filename):
+    """Get the most recent date of a CSV file with a 'date' first column.
+    
+    A sidecar index (<file>.index.json) caches the answer for the file's
+    mtime and size. When the file was sorted by date at the last full scan
+    and has only been appended to since (it did not shrink and still holds
+    the indexed last bytes at the indexed size), only its last few KB are
+    read; otherwise the whole date column is parsed. Other files return the
+    date of their last modification.
+    """
     if filename.endswith('.csv'):
         try:
+            stat = os.stat(filename)
+            index = load_date_index(filename)
+            if index is not None and index['mtime_ns'] == stat.st_mtime_ns and index['size'] == stat.st_size:
+                return datetime.datetime.strptime(index['max_date'], '%Y-%m-%d').date() if index['max_date'] else None
+
+            # Append-ordered files: the last row holds the most recent date
+            if (index is not None and index['sorted'] and stat.st_size >= index['size']
+                    and index.get('tail') == read_end_bytes(filename, index['size'])):
+                # Read the appended rows and the last rows before them
+                dates = read_tail_dates(filename, stat.st_size - index['size'] + 8192)
+                if dates is not None and dates == sorted(dates):
+                    most_recent_date = datetime.datetime.strptime(dates[-1], '%Y-%m-%d').date() if dates else None
+                    save_date_index(filename, stat, most_recent_date, None, True)
+                    return most_recent_date
+
             # Using pandas to handle headers and date parsing more robustly
             df = pd.read_csv(filename, nrows=0)  # Read only headers
             first_column_name = df.columns[0]
             if first_column_name.lower() == 'date':
                 # If first column is indeed called 'date', read dates from this column
                 df = pd.read_csv(filename, usecols=[first_column_name])
-                df[first_column_name] = pd.to_datetime(df[first_column_name], errors='coerce')
-                most_recent_date = df[first_column_name].dropna().max()
-                return most_recent_date.date() if most_recent_date else None
+                dates = pd.to_datetime(df[first_column_name], errors='coerce').dropna()
+                most_recent_date = dates.max().date() if not dates.empty else None
+                save_date_index(filename, stat, most_recent_date, len(df), bool(dates.is_monotonic_increasing))
+                return most_recent_date
             else:
                 # If not, use the file's last modification time
-                return datetime.datetime.fromtimestamp(os.path.getmtime(filename)).date()
+                return datetime.datetime.fromtimestamp(stat.st_mtime).date()
         except (FileNotFoundError, pd.errors.EmptyDataError):
             return None
     else:
@@ -32,6 +232,64 @@ def get_most_recent_date(filename):
         except OSError:
             return None
 
+def find_tail_offset(filename, date_str, chunk_size=64 * 1024):
+    """Find where the rows on or after a date start in a date-sorted CSV file.
+    
+    Reads the file backwards in chunks until it reaches a row before the
+    date and the row preceding it, so only the tail being deleted (plus one
+    or two chunks) is read.
+    
+    Args:
+        filename (str): CSV file with a header and the date in the first column
+        date_str (str): Date in YYYY-MM-DD format
+        chunk_size (int): Bytes read per step
+    
+    Returns:
+        int: Byte offset of the first row on or after the date (the file size
+            if there is none), or None if the rows read are not sorted by date
+            or do not start with a date
+    """
+    with open(filename, 'rb') as f:
+        header_end = len(f.readline())
+        end = pos = f.seek(0, os.SEEK_END)
+        carry = b''
+        blocks = []
+        boundary_found = False
+        while pos > header_end:
+            step = min(chunk_size, pos - header_end)
+            pos -= step
+            f.seek(pos)
+            lines = (f.read(step) + carry).split(b'\n')
+
+            # Unless the header was reached, the first line may be partial
+            carry = lines.pop(0) if pos > header_end else b''
+            line_start = pos + len(carry) + (1 if pos > header_end else 0)
+            block = []
+            for line in lines:
+                if line.strip():
+                    match = ROW_DATE_PATTERN.match(line)
+                    if not match:
+                        return None
+                    block.append((match.group(1).decode(), line_start))
+                line_start += len(line) + 1
+            blocks.insert(0, block)
+
+            # Once a row before the date is found, read on until the row
+            # preceding it (the partial carry line) is complete, so the
+            # order check below also covers it
+            if boundary_found and block:
+                break
+            if block and block[0][0] < date_str:
+                boundary_found = True
+
+    dates = [row for block in blocks for row in block]
+    if any(later < earlier for (earlier, _), (later, _) in zip(dates, dates[1:])):
+        return None
+    for row_date, offset in dates:
+        if row_date >= date_str:
+            return offset
+    return end
+
 # Function to delete all data from that date onwards
 def delete_data_from_date(filename, date):
     """Delete all data from the given date onwards in a CSV file.
@@ -46,6 +304,28 @@ def delete_data_from_date(filename, date):
     date_str = date.strftime('%Y-%m-%d')
     logger.info(f"Deleting data from {date_str} onwards in {filename}")
     
+    # Files known to be sorted by date (flagged by a full scan of the date
+    # index, and only appended to since) are truncated in place after a
+    # backwards scan of the tail
+    try:
+        get_most_recent_date(filename)
+        index = load_date_index(filename)
+        stat = os.stat(filename)
+        offset = None
+        if index is not None and index['sorted'] and index['size'] == stat.st_size and index['mtime_ns'] == stat.st_mtime_ns:
+            offset = find_tail_offset(filename, date_str)
+    except OSError as e:
+        logger.error(f"Error deleting data: {str(e)}")
+        return
+    if offset is not None:
+        with open(filename, 'rb+') as f:
+            f.truncate(offset)
+        save_truncated_date_index(filename)
+        logger.info(f"Successfully deleted data from {date_str} onwards")
+        return
+    
+    # Otherwise rewrite the rows before the date to a new file
+    logger.info(f"{filename} is not known to be sorted by date, rewriting the whole file")
     temp_filename = filename + '.tmp'
     try:
         with open(filename, 'r', newline='', encoding='utf-8') as csvfile, \
@@ -88,6 +368,36 @@ def get_incremental_data(input_file, output_file, get_data_function):
         return df
 
     
+# Function to merge new rows into existing data, one row per date
+def upsert_by_date(df_existing, df_new):
+    """Merge new rows into existing data keyed by date.
+    
+    Rows of df_new replace the existing rows with the same date (the last
+    one wins if df_new repeats a date). Only the new slice is sorted: it is
+    appended when it starts after the existing data, and otherwise merged
+    into it with a stable sort of the two sorted runs.
+    
+    Args:
+        df_existing (pd.DataFrame): Existing data, normally sorted by date
+        df_new (pd.DataFrame): New data
+        
+    Returns:
+        pd.DataFrame: Combined data sorted by date, with dates as YYYY-MM-DD
+    """
+    df_new = df_new.assign(date=pd.to_datetime(df_new['date']))
+    df_new = df_new.sort_values('date', kind='stable').drop_duplicates(subset=['date'], keep='last')
+    
+    df_existing = df_existing.assign(date=pd.to_datetime(df_existing['date']))
+    if not df_existing['date'].is_monotonic_increasing:
+        df_existing = df_existing.sort_values('date', kind='stable')
+    df_existing = df_existing[~df_existing['date'].isin(df_new['date'])]
+    
+    df = pd.concat([df_existing, df_new], ignore_index=True)
+    if not df_existing.empty and not df_new.empty and df_new['date'].iloc[0] < df_existing['date'].iloc[-1]:
+        df = df.sort_values('date', kind='stable', ignore_index=True)
+    df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+    return df
+
 # Function to obtain incremental data since the timestamps, from API
 def get_incremental_data_api(client, output_file, get_data_function):
     """Get incremental data from API since last update.
@@ -98,7 +408,9 @@ def get_incremental_data_api(client, output_file, get_data_function):
         get_data_function: Function to get data from API
         
     Returns:
-        DataFrame with new data, or None if no new data
+        DataFrame with the new data merged into the existing file's data
+        (see upsert_by_date), the new data if there is no file yet, or None
+        if no new data
     """
     try:
         # Let the data function handle the start date logic
@@ -108,13 +420,7 @@ def get_incremental_data_api(client, output_file, get_data_function):
             
             # If we have existing data, merge with it
             if os.path.exists(output_file):
-                df_existing = pd.read_csv(output_file)
-                df_combined = pd.concat([df_existing, df], ignore_index=True)
-                # Sort by date and remove duplicates, keeping latest version
-                df_combined['date'] = pd.to_datetime(df_combined['date'])
-                df_combined = df_combined.sort_values('date').drop_duplicates(subset=['date'], keep='last')
-                df_combined['date'] = df_combined['date'].dt.strftime('%Y-%m-%d')
-                df = df_combined
+                df = upsert_by_date(pd.read_csv(output_file), df)
         else:
             logger.info("No new data found")
         return df
@@ -123,6 +429,33 @@ def get_incremental_data_api(client, output_file, get_data_function):
         logger.error(f"Error getting incremental data: {str(e)}")
         return None
 
+# Function to append a frame to a CSV file in a single write
+def append_rows(output_file, df):
+    """Append the rows of a frame to a CSV file, in the file's column order.
+    
+    Args:
+        output_file (str): Existing CSV file with a header
+        df (pd.DataFrame): Rows to append, with the same columns as the file
+        
+    Returns:
+        tuple: (rows written, bytes written)
+        
+    Raises:
+        ValueError: If the frame's columns differ from the file's header
+    """
+    with open(output_file, 'r', newline='', encoding='utf-8') as csvfile:
+        header = next(csv.reader(csvfile))
+    if sorted(header) != sorted(df.columns):
+        missing = [col for col in header if col not in df.columns]
+        extra = [col for col in df.columns if col not in header]
+        raise ValueError(f"{output_file}: Columns do not match the file (missing {missing}, unexpected {extra})")
+    
+    size = os.path.getsize(output_file)
+    df[header].to_csv(output_file, mode='a', header=False, index=False)
+    written = os.path.getsize(output_file) - size
+    logger.info(f"{output_file}: Appended {len(df)} rows ({written} bytes)")
+    return len(df), written
+
 # Function to get and write the incremental data
 def update_incremental(input_file, output_file, get_data_function):
     
@@ -135,127 +468,243 @@ def update_incremental(input_file, output_file, get_data_function):
 
     # Write the incremental data to the output file
     if df_incremental is not None and not df_incremental.empty:
-        with open(output_file, 'a', newline='', encoding='utf-8') as csvfile:
-            writer = csv.writer(csvfile)
-            for _, row in df_incremental.iterrows():
-                writer.writerow(row)
+        append_rows(output_file, df_incremental)
         print(f"{output_file}: Data from {last_date} (re-)written")
 
 # Function to get and write the incremental data from API
 def update_incremental_api(client, output_file, get_data_function):
-    """Get and write incremental data from API, appending new data to existing file.
+    """Get and write incremental data from API, upserting new data into the existing file.
     
     Args:
         client: API client
         output_file: Path to output file
         get_data_function: Function to get data from API
     """
-    # Get the incremental data
-    df_incremental = get_incremental_data_api(client, output_file, get_data_function)
+    # Get the existing data merged with the new data
+    df = get_incremental_data_api(client, output_file, get_data_function)
     
-    # If we have new data, append it to the file
-    if df_incremental is not None and not df_incremental.empty:
-        if os.path.exists(output_file):
-            # Read existing data
-            df_existing = pd.read_csv(output_file)
-            # Combine with new data
-            df_combined = pd.concat([df_existing, df_incremental], ignore_index=True)
-            # Sort by date and remove duplicates, keeping latest version
-            df_combined['date'] = pd.to_datetime(df_combined['date'])
-            df_combined = df_combined.sort_values('date').drop_duplicates(subset=['date'], keep='last')
-            df_combined['date'] = df_combined['date'].dt.strftime('%Y-%m-%d')
-            # Save combined data
-            df_combined.to_csv(output_file, index=False)
-            logger.info(f"Appended new data to {output_file}")
+    if df is not None and not df.empty:
+        existed = os.path.exists(output_file)
+        df.to_csv(output_file, index=False)
+        if existed:
+            logger.info(f"Upserted new data into {output_file}")
         else:
-            # If file doesn't exist, just save the new data
-            df_incremental.to_csv(output_file, index=False)
             logger.info(f"Created new file {output_file} with data")
 
 
-def export_to_gsheets(df, sheet_name):
+# Sheets API service shared by every export and journal read of the process
+_sheets_service = None
+_sheets_service_lock = threading.Lock()
+
+def build_sheets_service(creds_file):
+    """Build a Sheets API service from a service account key file.
+    
+    Returns:
+        The service, or None if the credentials are missing or invalid
+    """
+    from googleapiclient.discovery import build
+    from google.oauth2 import service_account
+    
+    # Check if credentials file exists
+    if not os.path.exists(creds_file):
+        logger.error(f"Credentials file '{creds_file}' not found")
+        return None
+        
+    # Load and validate service account credentials
+    try:
+        creds = service_account.Credentials.from_service_account_file(creds_file)
+        scoped_credentials = creds.with_scopes(['https://www.googleapis.com/auth/spreadsheets'])
+    except json.JSONDecodeError:
+        logger.error(f"Invalid JSON in credentials file '{creds_file}'")
+        return None
+    except ValueError as e:
+        logger.error(f"Invalid credentials in '{creds_file}': {str(e)}")
+        return None
+        
+    try:
+        service = build('sheets', 'v4', credentials=scoped_credentials, cache_discovery=False)
+    except Exception as e:
+        logger.error(f"Failed to build Google Sheets service: {str(e)}")
+        return None
+    logger.info("Built Google Sheets service")
+    return service
+
+def get_sheets_service():
+    """Get the Sheets API service of the process, building it on first use.
+    
+    The scoped credentials, the discovery document and the HTTP connection
+    are reused by every caller. A failed build is not cached, so the next
+    call tries again. The service is not thread-safe, so calls through it
+    should not overlap.
+    
+    Returns:
+        The service, or None if it could not be built
+    """
+    global _sheets_service
+    with _sheets_service_lock:
+        if _sheets_service is None:
+            _sheets_service = build_sheets_service(config.GSHEETS_CREDENTIALS_FILE)
+        return _sheets_service
+
+def column_letter(n):
+    """Convert a 1-based column number to its spreadsheet letters (1 -> A, 27 -> AA)."""
+    letters = ''
+    while n > 0:
+        n, remainder = divmod(n - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+def get_sheet_values(df):
+    """Convert a DataFrame to the rows uploaded to a sheet, header first.
+    
+    Values go through JSON so they compare equal to a snapshot read back
+    from disk.
+    """
+    df_filled = df.astype(object).where(df.notna(), '')
+    rows = [df_filled.columns.tolist()] + df_filled.values.tolist()
+    return json.loads(json.dumps(rows, default=str))
+
+def get_snapshot_file(sheet_name, snapshot_dir=config.GSHEETS_SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, f"{sheet_name}.json")
+
+def load_sheet_snapshot(sheet_name, spreadsheet_id, snapshot_dir=config.GSHEETS_SNAPSHOT_DIR):
+    """Load the rows last uploaded to a sheet, or None if unknown."""
+    try:
+        with open(get_snapshot_file(sheet_name, snapshot_dir), 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get('spreadsheet_id') != spreadsheet_id:
+        return None
+    return snapshot.get('values')
+
+def save_sheet_snapshot(sheet_name, spreadsheet_id, values, snapshot_dir=config.GSHEETS_SNAPSHOT_DIR):
+    """Remember the rows uploaded to a sheet."""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    snapshot_file = get_snapshot_file(sheet_name, snapshot_dir)
+    with open(f"{snapshot_file}.tmp", 'w', encoding='utf-8') as f:
+        json.dump({'spreadsheet_id': spreadsheet_id, 'values': values}, f)
+    os.replace(f"{snapshot_file}.tmp", snapshot_file)
+
+def get_changed_ranges(sheet_name, old_values, new_values):
+    """Get the ranges of rows that differ between two uploads of a sheet.
+    
+    Consecutive changed rows are grouped into one range. Rows that only
+    exist in the old upload are overwritten with empty cells.
+    
+    Args:
+        sheet_name (str): Name of the sheet
+        old_values (list): Rows last uploaded, header first
+        new_values (list): Rows to upload, header first
+        
+    Returns:
+        list: Value ranges for a values().batchUpdate request
+    """
+    width = len(new_values[0])
+    last_column = column_letter(width)
+    empty_row = [''] * width
+    
+    # Row indexes that differ, header included
+    changed = [i for i in range(max(len(old_values), len(new_values)))
+               if i >= len(old_values) or i >= len(new_values) or old_values[i] != new_values[i]]
+    
+    ranges = []
+    for i in changed:
+        if ranges and ranges[-1]['end'] == i:
+            ranges[-1]['end'] = i + 1
+        else:
+            ranges.append({'start': i, 'end': i + 1})
+    return [{
+        'range': f"{sheet_name}!A{r['start'] + 1}:{last_column}{r['end']}",
+        'majorDimension': 'ROWS',
+        'values': [new_values[i] if i < len(new_values) else empty_row for i in range(r['start'], r['end'])]
+    } for r in ranges]
+
+def export_to_gsheets(df, sheet_name, service=None, spreadsheet_id=config.INTEGRATED_DATA_SPREADSHEET_ID,
+                      delta=None, snapshot_dir=config.GSHEETS_SNAPSHOT_DIR):
     """Export DataFrame to Google Sheets.
     
+    In delta mode the rows last uploaded to each sheet are kept in a local
+    snapshot, and only the rows that changed since are sent, in a single
+    batchUpdate call. Without a snapshot, or when the columns changed, the
+    sheet is cleared and fully uploaded.
+    
     Args:
         df (pd.DataFrame): DataFrame to export
         sheet_name (str): Name of the sheet to export to
+        service: Sheets API service, the shared one from get_sheets_service() if not given
+        spreadsheet_id (str): Spreadsheet to export to
+        delta (bool, optional): Upload only changed rows, config.GSHEETS_DELTA_SYNC by default
+        snapshot_dir (str): Directory of the snapshots of uploaded sheets
         
     Returns:
         bool: True if successful, False otherwise
     """
-    import pandas as pd
-    from googleapiclient.discovery import build
-    from google.oauth2 import service_account
-    from google.oauth2.service_account import Credentials
-    import logging
-    import json
-    import os
-
-    logger = logging.getLogger(__name__)
+    if delta is None:
+        delta = config.GSHEETS_DELTA_SYNC
     
     try:
-        # Check if credentials file exists
-        creds_file = 'gsheets key.json'
-        if not os.path.exists(creds_file):
-            logger.error(f"Credentials file '{creds_file}' not found")
-            return False
-            
-        # Load and validate service account credentials
-        try:
-            creds = service_account.Credentials.from_service_account_file(creds_file)
-            scoped_credentials = creds.with_scopes(['https://www.googleapis.com/auth/spreadsheets'])
-        except json.JSONDecodeError:
-            logger.error(f"Invalid JSON in credentials file '{creds_file}'")
-            return False
-        except ValueError as e:
-            logger.error(f"Invalid credentials in '{creds_file}': {str(e)}")
-            return False
-            
-        # Build service with retry
-        try:
-            service = build('sheets', 'v4', credentials=scoped_credentials, cache_discovery=False)
-        except Exception as e:
-            logger.error(f"Failed to build Google Sheets service: {str(e)}")
-            return False
-
-        # Spreadsheet ID and range
-        SPREADSHEET_ID = '197VfZCekvBev0m1vsi8kUHpuO0IoTRA90_bQRGBYYSM'
-        range_name = f"{sheet_name}!A1:ZA{len(df) + 1}"  # Dynamic range based on DataFrame size
-        
+        if service is None:
+            service = get_sheets_service()
+            if service is None:
+                return False
+
         # Prepare data
-        df_filled = df.fillna('')
-        headers = [df_filled.columns.tolist()]
-        values = df_filled.values.tolist()
-        data = headers + values
+        data = get_sheet_values(df)
+        old_data = load_sheet_snapshot(sheet_name, spreadsheet_id, snapshot_dir) if delta else None
         
-        # Clear existing content first
-        try:
-            service.spreadsheets().values().clear(
-                spreadsheetId=SPREADSHEET_ID,
-                range=range_name
-            ).execute()
-            logger.info(f"Cleared existing content in sheet '{sheet_name}'")
-        except Exception as e:
-            logger.error(f"Failed to clear sheet '{sheet_name}': {str(e)}")
-            return False
-        
-        # Update with new data
-        try:
-            response = service.spreadsheets().values().update(
-                spreadsheetId=SPREADSHEET_ID,
-                valueInputOption='RAW',
-                range=range_name,
-                body={'majorDimension': 'ROWS', 'values': data}
-            ).execute()
+        if old_data and old_data[0] == data[0]:
+            # Send only the rows that changed since the last upload
+            changed_ranges = get_changed_ranges(sheet_name, old_data, data)
+            if not changed_ranges:
+                logger.info(f"Sheet '{sheet_name}' is up to date, nothing to upload")
+                return True
+            try:
+                response = service.spreadsheets().values().batchUpdate(
+                    spreadsheetId=spreadsheet_id,
+                    body={'valueInputOption': 'RAW', 'data': changed_ranges}
+                ).execute()
+            except Exception as e:
+                logger.error(f"Failed to update sheet '{sheet_name}': {str(e)}")
+                return False
+            
+            updated_cells = response.get('totalUpdatedCells', 0)
+            logger.info(f"Successfully updated {updated_cells} cells in {len(changed_ranges)} ranges of sheet '{sheet_name}'")
+        else:
+            # Dynamic range based on DataFrame size, covering the previous upload too
+            last_row = max(len(data), len(old_data) if old_data else 0)
+            range_name = f"{sheet_name}!A1:ZA{last_row}"
+            
+            # Clear existing content first
+            try:
+                service.spreadsheets().values().clear(
+                    spreadsheetId=spreadsheet_id,
+                    range=range_name
+                ).execute()
+                logger.info(f"Cleared existing content in sheet '{sheet_name}'")
+            except Exception as e:
+                logger.error(f"Failed to clear sheet '{sheet_name}': {str(e)}")
+                return False
+            
+            # Update with new data
+            try:
+                response = service.spreadsheets().values().update(
+                    spreadsheetId=spreadsheet_id,
+                    valueInputOption='RAW',
+                    range=range_name,
+                    body={'majorDimension': 'ROWS', 'values': data}
+                ).execute()
+            except Exception as e:
+                logger.error(f"Failed to update sheet '{sheet_name}': {str(e)}")
+                return False
             
             updated_cells = response.get('updatedCells', 0)
             logger.info(f"Successfully updated {updated_cells} cells in sheet '{sheet_name}'")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Failed to update sheet '{sheet_name}': {str(e)}")
-            return False
+        
+        if delta:
+            save_sheet_snapshot(sheet_name, spreadsheet_id, data, snapshot_dir)
+        return True
             
     except Exception as e:
         logger.error(f"Unexpected error in export_to_gsheets: {str(e)}")
-        return False
\ No newline at end of file
+        return False
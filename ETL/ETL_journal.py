@@ -2,31 +2,18 @@ import pandas as pd
 import datetime
 import logging
 import os
-from .ETL_general import export_to_gsheets
+from . import config
+from .ETL_general import export_to_gsheets, get_sheets_service
+from .ETL_storage import write_dataset_changes
 
 logger = logging.getLogger(__name__)
 
 def get_form_data(spreadsheet_id):
     """Get journal data from Google Form responses."""
     try:
-        from googleapiclient.discovery import build
-        from google.oauth2 import service_account
-        
-        logger.info("Loading credentials...")
-        try:
-            creds = service_account.Credentials.from_service_account_file(
-                'gsheets key.json',
-                scopes=['https://www.googleapis.com/auth/spreadsheets.readonly']
-            )
-        except Exception as e:
-            logger.error(f"Error loading credentials: {str(e)}")
-            return None
-        
-        logger.info("Building service...")
-        try:
-            service = build('sheets', 'v4', credentials=creds, cache_discovery=False)
-        except Exception as e:
-            logger.error(f"Error building service: {str(e)}")
+        service = get_sheets_service()
+        if service is None:
+            logger.error("Error building service")
             return None
         
         logger.info("Getting form responses...")
@@ -196,10 +183,9 @@ def main():
         print("\nFirst few entries:")
         print(df.head())
         
-        # Save to CSV
-        output_file = 'Data/Cleaned/Journal.csv'
-        df.to_csv(output_file, index=False)
-        print(f"\nData saved to {output_file}")
+        # Write the rows from the first changed date
+        write_dataset_changes('journal', df)
+        print(f"\nData saved to {config.WHOOP_JOURNAL_FILE}")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
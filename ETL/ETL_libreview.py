@@ -1,86 +1,144 @@
 import pandas as pd
 import os
-from dotenv import load_dotenv
-from whoop import WhoopClient
+import datetime
+import json
+import logging
+from ETL import config
+from ETL.ETL_storage import DATASETS, get_storage, write_dataset_from
 
-# Apply timezone offset
-def apply_timezone_offset(row):
-    start_time = pd.to_datetime(row['end'])
-    hours, minutes = map(int, row['timezone_offset'].split(':'))
-    timezone_offset = pd.Timedelta(hours=hours, minutes=minutes)
-    return start_time + timezone_offset
+logger = logging.getLogger(__name__)
 
-# Function to extract and clean glucose data from a CSV file
-def get_glucose_time(file_path, start_date = '2024-03-23'):
-    # Read the glucose data file
-    df = pd.read_csv(file_path, skiprows=1)
-    
-    # Select necessary columns and rename them
-    df = df[['Sello de tiempo del dispositivo', 'Historial de glucosa mg/dL', 'Escaneo de glucosa mg/dL']]
+# Timestamp format of the LibreView export (day first)
+GLUCOSE_TIMESTAMP_FORMAT = '%d-%m-%Y %H:%M'
+GLUCOSE_COLUMNS = ['Sello de tiempo del dispositivo', 'Historial de glucosa mg/dL', 'Escaneo de glucosa mg/dL']
+
+def read_glucose_export(file_path, since=None):
+    """Read the glucose readings of a LibreView export.
+    
+    The export is grouped by device and record type rather than sorted by
+    time, so new readings are not simply appended at the end of the file.
+    With a since date, rows of earlier days are dropped by their timestamp
+    text before any date parsing, so only the new days are parsed.
+    
+    Args:
+        file_path (str): LibreView CSV export
+        since (datetime.date, optional): First day to keep
+        
+    Returns:
+        pd.DataFrame: date, time, glucose and datetime of each reading, sorted by datetime
+    """
+    # The first line holds export metadata, the second the header
+    df = pd.read_csv(file_path, skiprows=1, usecols=GLUCOSE_COLUMNS, dtype={GLUCOSE_COLUMNS[0]: str})
     df.columns = ['timestamp', 'glucose', 'scan_glucose']
     
-    # Combine glucose readings from two columns into one, prioritizing non-NaN values
-    df['glucose'] = df['glucose'].combine_first(df['scan_glucose'])
-    df = df.drop(columns=['scan_glucose'])
-    
-    # Convert timestamps into Python datetime format
-    df['timestamp'] = pd.to_datetime(df['timestamp'], dayfirst=True)
+    if since is not None:
+        # Timestamps start with the day as dd-mm-YYYY, so match the new days as text
+        days = pd.date_range(since, datetime.date.today() + datetime.timedelta(days=1))
+        df = df[df['timestamp'].str[:10].isin(days.strftime('%d-%m-%Y'))]
     
-    # Extract date and time from the timestamp
-    df['date'] = df['timestamp'].dt.date
-    df['time'] = df['timestamp'].dt.time
-    df = df.drop(columns=['timestamp'])
-    
-    # Reorder columns for clarity
-    df = df[['date', 'time', 'glucose']]
-    
-    # Remove rows where glucose data is missing
+    # Combine glucose readings from two columns into one, prioritizing non-NaN values
+    df = df.assign(glucose=df['glucose'].combine_first(df['scan_glucose']))
     df = df[df['glucose'].notna()]
     
-    # Create a full datetime column to enable filtering
-    df['datetime'] = pd.to_datetime(df['date'].astype(str) + ' ' + df['time'].astype(str))
+    df['datetime'] = pd.to_datetime(df['timestamp'], format=GLUCOSE_TIMESTAMP_FORMAT)
+    df['date'] = df['datetime'].dt.normalize()
+    df['time'] = df['datetime'].dt.time
+    df = df[['date', 'time', 'glucose', 'datetime']]
+    
+    return df.sort_values('datetime', kind='stable')
+
+# Function to extract and clean glucose data from a CSV file
+def get_glucose_time(file_path, start_date = '2024-03-23'):
+    df = read_glucose_export(file_path)
     
     # Filter the dataframe for entries on or after the start date
+    return df[df['datetime'] >= pd.to_datetime(start_date)]
+
+def load_glucose_state(state_file):
+    """Load the size, modification time and last day of the export last processed."""
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_glucose_state(state_file, file_path, last_date):
+    """Remember the processed export and the last day of readings written."""
+    state = {
+        'size': os.path.getsize(file_path),
+        'mtime': os.path.getmtime(file_path),
+        'last_date': last_date.strftime('%Y-%m-%d')
+    }
+    with open(state_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+
+def update_glucose_data(file_path, state_file, start_date = '2024-03-23'):
+    """Update the per-reading and daily glucose datasets from one parse of the export.
+    
+    Each dataset has its last day rewritten, and the export is parsed once
+    from the earliest of those days. An export that has not changed since
+    the last run is not read at all. Datasets without data are rebuilt from
+    a full parse.
+    
+    Args:
+        file_path (str): LibreView CSV export
+        state_file (str): JSON file remembering the last processed export
+        start_date (str): First day kept on a full rebuild
+    """
+    state = load_glucose_state(state_file)
+    storage = get_storage()
+    has_readings = os.path.exists(DATASETS['glucose']['path']) and storage.date_range('glucose')[1] is not None
+    daily_since = storage.date_range('glucose_daily')[1] if os.path.exists(DATASETS['glucose_daily']['path']) else None
+    if state is not None and daily_since is not None and has_readings:
+        if state['size'] == os.path.getsize(file_path) and state['mtime'] == os.path.getmtime(file_path):
+            logger.info(f"Glucose: '{file_path}' has not changed since the last run")
+            return
+        readings_since = pd.Timestamp(state['last_date'])
+        since = min(readings_since, daily_since)
+    else:
+        readings_since, daily_since, since = None, None, None
+    
+    df = read_glucose_export(file_path, since=since)
     df = df[df['datetime'] >= pd.to_datetime(start_date)]
-    df = df.sort_values('datetime')
     
-    # Ensure 'date' is in datetime format
-    df['date'] = pd.to_datetime(df['date'])
+    df_readings = df if readings_since is None else df[df['date'] >= readings_since]
+    write_dataset_from('glucose', df_readings, readings_since)
+    logger.info(f"Glucose: {len(df_readings)} readings from {readings_since or start_date} (re-)written")
+    
+    df_daily = aggregate_glucose_daily(df if daily_since is None else df[df['date'] >= daily_since])
+    write_dataset_from('glucose_daily', df_daily, daily_since)
+    logger.info(f"Glucose daily: {len(df_daily)} days from {daily_since or start_date} (re-)written")
     
-    return df
+    last_date = df['date'].max() if not df.empty else pd.Timestamp(readings_since or start_date)
+    save_glucose_state(state_file, file_path, last_date)
 
 # Function to aggregate daily glucose data and fetch wake-up times
 def get_glucose_daily(file_path, start_date):
-    df = get_glucose_time(file_path, start_date)
+    return aggregate_glucose_daily(get_glucose_time(file_path, start_date))
 
-    # Load environment variables for API credentials
-    load_dotenv("Credentials.env")
-    un = os.getenv("USERNAME_W")
-    pw = os.getenv("PASSWORD_W")
-    
-    # Authenticate with Whoop API
-    client = WhoopClient(un, pw)
+# Function to get wake-up times from the sleep data saved by the Whoop update
+def get_wake_up_times(sleep_file):
+    """Get the wake-up time of each day from the cleaned Whoop sleep file.
     
-    # Fetch sleep data from Whoop
-    sleep = client.get_sleep_collection(start_date="2024-01-01")
-    df_s = pd.json_normalize(sleep)
+    The file has the local sleep start time (dated the next day when after
+    20:00) and the time in bed, so waking up is their sum.
     
-    # Filter out nap entries
-    df_s = df_s[df_s['nap'] == False]
+    Returns:
+        pd.DataFrame: day and wakeuptime ('HH:MM:SS')
+    """
+    df_s = pd.read_csv(sleep_file, usecols=['date', 'sleep_time', 'sleep_duration'])
+    df_s = df_s.dropna()
     
-    # Adjust for timezone differences in the data
-    df_s['end'] = df_s.apply(apply_timezone_offset, axis=1)
-    df_s['end'] = pd.to_datetime(df_s['end'])
+    # Rebuild the sleep start from the assigned day and the start time
+    start_time = pd.to_timedelta(df_s['sleep_time'])
+    start_day = pd.to_datetime(df_s['date']) - pd.to_timedelta((start_time > pd.Timedelta(hours=20)).astype(int), unit='D')
+    end = (start_day + start_time + pd.to_timedelta(df_s['sleep_duration'], unit='h')).dt.floor('s')
     
-    # Extract date and wake-up time from the adjusted end time
-    df_s['day'], df_s['time'] = df_s['end'].dt.date, df_s['end'].dt.time
-    df_s = df_s[['day', 'time']]
-    df_s = df_s.rename(columns={'time': 'wakeuptime'})
-    df_s['wakeuptime'] = df_s['wakeuptime'].astype(str).str[:-7]
-    df_s['wakeuptime'] = df_s['wakeuptime'].replace('0', '07:00:00')
-    
-    # Ensure 'day' is in datetime format before merging
-    df_s['day'] = pd.to_datetime(df_s['day'])
+    return pd.DataFrame({'day': end.dt.normalize(), 'wakeuptime': end.dt.strftime('%H:%M:%S')})
+
+# Function to aggregate glucose readings per day, from the wake-up time onwards
+def aggregate_glucose_daily(df, sleep_file=config.WHOOP_SLEEP_RECOVERY_FILE):
+    df_s = get_wake_up_times(sleep_file)
     
     # Merge the glucose data with the wake-up times
     df = pd.merge(df, df_s, left_on='date', right_on='day', how='left')
@@ -118,7 +176,7 @@ def main():
     # Process time-specific glucose data
     df_time = get_glucose_time(file_path, start_date)
     # Aggregate daily data and integrate wake-up times
-    df_daily = get_glucose_daily(file_path, start_date)
+    df_daily = aggregate_glucose_daily(df_time)
 
     # Save the cleaned and processed data to CSV files
     df_time.to_csv('Data/Cleaned/Glucose.csv', index=False)
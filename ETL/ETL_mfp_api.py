@@ -1,10 +1,23 @@
 import myfitnesspal
+from myfitnesspal.exceptions import MyfitnesspalRequestFailed
+import requests
 import datetime
 import csv
 import os
-from ETL.ETL_general import get_most_recent_date, delete_data_from_date
+import queue
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from ETL.ETL_general import get_most_recent_date, delete_data_from_date, TokenBucket, rate_limited_call
+from ETL.ETL_cache import get_cache
+from ETL import config
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
+# Errors worth retrying when scraping a diary day
+MFP_TRANSIENT_ERRORS = (MyfitnesspalRequestFailed, requests.exceptions.RequestException, ConnectionError, TimeoutError)
+
 def init_mfp():
     """Initialize and return a MyFitnessPal client."""
     load_dotenv("Credentials.env")
@@ -25,94 +38,229 @@ def init_mfp():
     # Initialize client which will use the config file
     return myfitnesspal.Client()
 
+def fetch_diary(client, date):
+    """Scrape one diary day into a plain dict that can be cached.
+    
+    Returns:
+        dict: meals (name, entries with name/quantity/nutrition_information,
+            totals), diary totals and goals, and the exercise calories burned
+    """
+    diary = client.get_date(date.year, date.month, date.day)
+    exercises = diary.exercises[0].entries if diary.exercises else []
+    return {
+        'meals': [
+            {
+                'name': meal.name,
+                'entries': [
+                    {
+                        'name': food.name,
+                        'quantity': food.quantity,
+                        'nutrition_information': dict(food.nutrition_information)
+                    }
+                    for food in meal.entries
+                ],
+                'totals': dict(meal.totals)
+            }
+            for meal in diary.meals
+        ],
+        'totals': dict(diary.totals),
+        'goals': dict(diary.goals),
+        'calories_burned': sum(entry.get_as_dict()['nutrition_information'].get('calories burned', 0) for entry in exercises)
+    }
+
+def get_diary(client, date, bucket=None):
+    """Get one diary day through the response cache.
+    
+    Cache misses are fetched with retries and backoff on transient errors,
+    through the rate limiter when one is given.
+    """
+    fetch = lambda: rate_limited_call(bucket, fetch_diary, client, date,
+                                      retry_on=MFP_TRANSIENT_ERRORS, max_retries=config.MFP_MAX_RETRIES,
+                                      base_delay=config.MFP_RETRY_DELAY, pause_all=False)
+    return get_cache('mfp').get('diary', date, fetch)
+
+def iter_diaries(client, dates, client_factory=None, pool_size=None):
+    """Yield the diary of each date, in date order.
+    
+    With a client_factory and at least config.MFP_BACKFILL_MIN_DAYS dates
+    (a backfill), days are fetched concurrently by a pool of up to pool_size
+    clients (the given client plus new ones from the factory), sharing a rate
+    limiter. Shorter refreshes only use the given client, so no extra login
+    happens on daily runs. Results are still yielded in date order, so files
+    can be appended as they arrive.
+    
+    Args:
+        client: MyFitnessPal client
+        dates (list): Dates to fetch, in order
+        client_factory (callable, optional): Creates an additional client
+        pool_size (int, optional): Defaults to config.MFP_POOL_SIZE
+    """
+    pool_size = min(pool_size or config.MFP_POOL_SIZE, len(dates))
+    if client_factory is None or pool_size <= 1 or len(dates) < config.MFP_BACKFILL_MIN_DAYS:
+        for date in dates:
+            yield get_diary(client, date)
+        return
+
+    clients = queue.Queue()
+    clients.put(client)
+    for _ in range(pool_size - 1):
+        clients.put(client_factory())
+    bucket = TokenBucket(config.MFP_REQUESTS_PER_SECOND)
+
+    def fetch(date):
+        pooled_client = clients.get()
+        try:
+            return get_diary(pooled_client, date, bucket)
+        finally:
+            clients.put(pooled_client)
+
+    with ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='mfp') as executor:
+        yield from executor.map(fetch, dates)
+
+MEAL_FIELDNAMES = ['date', 'meal', 'food', 'quant', 'calories', 'carbs', 'fat', 'protein', 'sodium', 'sugar']
+DAILY_FIELDNAMES = ['date', 'calories_burned', 'carbs', 'fat', 'protein', 'sodium', 'sugar', 'calories_consumed', 'calories_goal', 'calories_net',
+                    'calories_consumed_breakfast', 'calories_consumed_lunch', 'calories_consumed_dinner', 'calories_consumed_snacks']
+
+def get_meal_rows(diary, date):
+    """Rows of 'MFP meals scrapped.csv' (one per food entry) for one diary day."""
+    rows = []
+    for meal in diary['meals']:
+        for food in meal['entries']:
+            rows.append({
+                'date': date.strftime('%Y-%m-%d'),
+                'meal': meal['name'],
+                'food': food['name'],
+                'quant': food['quantity'],
+                'calories': food['nutrition_information']['calories'],
+                'carbs': food['nutrition_information']['carbohydrates'],
+                'fat': food['nutrition_information']['fat'],
+                'protein': food['nutrition_information']['protein'],
+                'sodium': food['nutrition_information']['sodium'],
+                'sugar': food['nutrition_information']['sugar']
+            })
+    return rows
+
+def get_daily_row(diary, date):
+    """Row of 'MFP per day scrapped.csv' for one diary day."""
+    meals = diary['meals']
+    calories_meal = {name: meals[i]['totals']['calories'] if len(meals[i]['entries']) else 0 for i, name in enumerate(['breakfast', 'lunch', 'dinner', 'snacks'])}
+    return {
+        'date': date.strftime('%Y-%m-%d'),
+        'calories_burned': diary['calories_burned'],
+        'carbs': diary['totals']['carbohydrates'],
+        'fat': diary['totals']['fat'],
+        'protein': diary['totals']['protein'],
+        'sodium': diary['totals']['sodium'],
+        'sugar': diary['totals']['sugar'],
+        'calories_consumed': diary['totals']['calories'],
+        'calories_goal': diary['goals']['calories'],
+        'calories_net': diary['totals']['calories'] - diary['goals']['calories'],
+        'calories_consumed_breakfast': calories_meal['breakfast'],
+        'calories_consumed_lunch': calories_meal['lunch'],
+        'calories_consumed_dinner': calories_meal['dinner'],
+        'calories_consumed_snacks': calories_meal['snacks']
+    }
+
+def prepare_rewrite(filename):
+    """Delete the last day of a file so it is rewritten, and return that day.
+    
+    Files without data start from config.DATA_START_DATE.
+    """
+    most_recent_date = get_most_recent_date(filename)
+    if most_recent_date is None:
+        return config.DATA_START_DATE
+    delete_data_from_date(filename, most_recent_date)
+    return most_recent_date
+
+def open_writer(filename, fieldnames):
+    """Open a CSV file for appending, writing the header if it is new."""
+    mode = 'a' if os.path.exists(filename) else 'w'
+    csvfile = open(filename, mode, newline='', encoding='utf-8')
+    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    if mode == 'w':
+        writer.writeheader()
+    return csvfile, writer
+
 # Function to get meal data from MyFitnessPal and append to a CSV file
 def get_meal_data(client, filename):
     end_date = datetime.datetime.now().date()
-    most_recent_date = get_most_recent_date(filename)
 
     # Delete the last day to rewrite it
-    delete_data_from_date(filename, most_recent_date)
-    start_date = most_recent_date
+    start_date = prepare_rewrite(filename)
 
-    fieldnames = ['date', 'meal', 'food', 'quant', 'calories', 'carbs', 'fat', 'protein', 'sodium', 'sugar']
-    mode = 'a' if os.path.exists(filename) else 'w'
-    with open(filename, mode, newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        if mode == 'w':
-            writer.writeheader()
+    csvfile, writer = open_writer(filename, MEAL_FIELDNAMES)
+    with csvfile:
         current_date = start_date
         while current_date <= end_date:
-            diary = client.get_date(current_date.year, current_date.month, current_date.day)
-            for meal in diary.meals:
-                for food in meal.entries:
-                    row_data = {
-                        'date': current_date.strftime('%Y-%m-%d'),
-                        'meal': meal.name,
-                        'food': food.name,
-                        'quant': food.quantity,
-                        'calories': food.nutrition_information['calories'],
-                        'carbs': food.nutrition_information['carbohydrates'],
-                        'fat': food.nutrition_information['fat'],
-                        'protein': food.nutrition_information['protein'],
-                        'sodium': food.nutrition_information['sodium'],
-                        'sugar': food.nutrition_information['sugar']
-                    }
-                    writer.writerow(row_data)
+            diary = get_diary(client, current_date)
+            writer.writerows(get_meal_rows(diary, current_date))
             print(f'{filename}: Data per meal obtained and (re-)written for {current_date.strftime("%Y-%m-%d")}')
             current_date += datetime.timedelta(days=1)
 
 # Function to get daily summary data from MyFitnessPal and append to a CSV file
 def get_meal_daily(client, filename):
-
-    import datetime
     end_date = datetime.datetime.now().date() - datetime.timedelta(days=1)
 
-    most_recent_date = get_most_recent_date(filename)
-
     # Delete the last day to rewrite it
-    delete_data_from_date(filename, most_recent_date)
-    start_date = most_recent_date
+    start_date = prepare_rewrite(filename)
 
-    fieldnames = ['date', 'calories_burned', 'carbs', 'fat', 'protein', 'sodium', 'sugar', 'calories_consumed', 'calories_goal', 'calories_net',
-                  'calories_consumed_breakfast', 'calories_consumed_lunch', 'calories_consumed_dinner', 'calories_consumed_snacks']
-    mode = 'a' if os.path.exists(filename) else 'w'
-    with open(filename, mode, newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        if mode == 'w':
-            writer.writeheader()
+    csvfile, writer = open_writer(filename, DAILY_FIELDNAMES)
+    with csvfile:
         current_date = start_date
         while current_date <= end_date:
-            diary = client.get_date(current_date.year, current_date.month, current_date.day)
-            exercises = diary.exercises[0].entries if diary.exercises else []
-            calories_burned = sum(entry.get_as_dict()['nutrition_information'].get('calories burned', 0) for entry in exercises)
-            calories_meal = {name: diary.meals[i].totals['calories'] if len(diary.meals[i].entries) else 0 for i, name in enumerate(['breakfast', 'lunch', 'dinner', 'snacks'])}
-            writer.writerow({
-                'date': current_date.strftime('%Y-%m-%d'),
-                'calories_burned': calories_burned,
-                'carbs': diary.totals['carbohydrates'],
-                'fat': diary.totals['fat'],
-                'protein': diary.totals['protein'],
-                'sodium': diary.totals['sodium'],
-                'sugar': diary.totals['sugar'],
-                'calories_consumed': diary.totals['calories'],
-                'calories_goal': diary.goals['calories'],
-                'calories_net': diary.totals['calories'] - diary.goals['calories'],
-                'calories_consumed_breakfast': calories_meal['breakfast'],
-                'calories_consumed_lunch': calories_meal['lunch'],
-                'calories_consumed_dinner': calories_meal['dinner'],
-                'calories_consumed_snacks': calories_meal['snacks']
-            })
+            diary = get_diary(client, current_date)
+            writer.writerow(get_daily_row(diary, current_date))
             print(f'{filename}: Data per day obtained and (re-)written for {current_date.strftime("%Y-%m-%d")}')
             current_date += datetime.timedelta(days=1)
 
+# Function to get meal and daily summary data from MyFitnessPal in a single pass
+def get_mfp_data(client, meals_file, daily_file, client_factory=None, pool_size=None):
+    """Fetch each diary day once and append it to both MFP files.
+    
+    Meals are written up to today, daily summaries up to yesterday (today is
+    not complete yet). Each file restarts from its own last day.
+    
+    Args:
+        client: MyFitnessPal client
+        meals_file (str): Per-meal output file
+        daily_file (str): Per-day output file
+        client_factory (callable, optional): Creates extra clients to fetch
+            days concurrently on backfills (see iter_diaries)
+        pool_size (int, optional): Maximum number of concurrent clients
+        
+    Returns:
+        tuple: First day (re-)written in the meals file and in the daily file
+    """
+    today = datetime.datetime.now().date()
+    daily_end_date = today - datetime.timedelta(days=1)
+
+    # Delete the last day of each file to rewrite it
+    meals_start_date = prepare_rewrite(meals_file)
+    daily_start_date = prepare_rewrite(daily_file)
+
+    meals_csv, meals_writer = open_writer(meals_file, MEAL_FIELDNAMES)
+    daily_csv, daily_writer = open_writer(daily_file, DAILY_FIELDNAMES)
+    start_date = min(meals_start_date, daily_start_date)
+    dates = [start_date + datetime.timedelta(days=i) for i in range((today - start_date).days + 1)]
+    start = time.perf_counter()
+    with meals_csv, daily_csv:
+        for current_date, diary in zip(dates, iter_diaries(client, dates, client_factory, pool_size)):
+            if current_date >= meals_start_date:
+                meals_writer.writerows(get_meal_rows(diary, current_date))
+            if daily_start_date <= current_date <= daily_end_date:
+                daily_writer.writerow(get_daily_row(diary, current_date))
+            print(f'MyFitnessPal: Data per meal and per day obtained and (re-)written for {current_date.strftime("%Y-%m-%d")}')
+    elapsed = time.perf_counter() - start
+    logger.info(f"MyFitnessPal: {len(dates)} days in {elapsed:.1f}s ({len(dates) / elapsed:.1f} days/s)")
+    return meals_start_date, daily_start_date
+
 def main():
 
     meals_file = 'Data/Cleaned/MFP meals scrapped.csv'
     meals_daily_file = 'Data/Cleaned/MFP per day scrapped.csv'
 
     client = init_mfp()
-    get_meal_data(client, meals_file)
-    get_meal_daily(client, meals_daily_file)
+    get_mfp_data(client, meals_file, meals_daily_file, client_factory=init_mfp)
 
 if __name__ == "__main__":
     main()
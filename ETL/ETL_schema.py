@@ -0,0 +1,137 @@
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+def metric(source, unit, decimals=None, dtype=None):
+    """Describe a metric column.
+
+    Metrics rounded to whole numbers are stored as nullable 32-bit integers
+    unless a dtype is given; others keep float64, since float32 cannot hold
+    one or two decimal values exactly.
+
+    Args:
+        source (str): Dataset the metric comes from ('dashboard' for metrics derived there)
+        unit (str): Unit of the values
+        decimals (int, optional): Decimals kept, None to leave values unrounded
+        dtype (str, optional): Column dtype
+
+    Returns:
+        dict: Metric spec with source, unit, decimals and dtype
+    """
+    if dtype is None:
+        dtype = 'Int32' if decimals == 0 else 'float64'
+    return {'source': source, 'unit': unit, 'decimals': decimals, 'dtype': dtype}
+
+# Columns of the integrated and dashboard data
+METRICS = {
+    # TSS metrics
+    'TSS': metric('tss_metrics', 'TSS', 1),
+    'CTL': metric('tss_metrics', 'TSS/day', 1),
+    'ATL': metric('tss_metrics', 'TSS/day', 1),
+    'TSB': metric('tss_metrics', 'TSS/day', 1),
+
+    # Sleep metrics (2 decimals for durations, 0 for scores)
+    'sleep_time': metric('sleep_recovery', 'HH:MM:SS', dtype='string'),
+    'sleep_score_performance': metric('sleep_recovery', '%', 0),
+    'sleep_score_consistency': metric('sleep_recovery', '%', 0),
+    'sleep_score_efficiency': metric('sleep_recovery', '%', 0),
+    'sleep_duration': metric('sleep_recovery', 'h', 2),
+    'sleep_rem': metric('sleep_recovery', 'h', 2),
+    'sleep_deep': metric('sleep_recovery', 'h', 2),
+    'sleep_light': metric('sleep_recovery', 'h', 2),
+    'sleep_awake': metric('sleep_recovery', 'h', 2),
+
+    # Recovery metrics
+    'recovery_score': metric('sleep_recovery', '%', 0),
+    'resting_hr': metric('sleep_recovery', 'bpm', 0),
+    'hrv': metric('sleep_recovery', 'ms', 0),
+    'spo2': metric('sleep_recovery', '%', 1),
+    'skin_temp': metric('sleep_recovery', '°C', 1),
+
+    # Nutrition metrics (0 decimals for calories and macros)
+    'calories_burned': metric('mfp_daily', 'kcal', 0),
+    'carbs': metric('mfp_daily', 'g', 0),
+    'fat': metric('mfp_daily', 'g', 0),
+    'protein': metric('mfp_daily', 'g', 0),
+    'sodium': metric('mfp_daily', 'mg', 0),
+    'sugar': metric('mfp_daily', 'g', 0),
+    'calories_consumed': metric('mfp_daily', 'kcal', 0),
+    'calories_goal': metric('mfp_daily', 'kcal', 0),
+    'calories_net': metric('mfp_daily', 'kcal', 0),
+    'calories_consumed_breakfast': metric('mfp_daily', 'kcal', 0),
+    'calories_consumed_lunch': metric('mfp_daily', 'kcal', 0),
+    'calories_consumed_dinner': metric('mfp_daily', 'kcal', 0),
+    'calories_consumed_snacks': metric('mfp_daily', 'kcal', 0),
+
+    # Glucose metrics (0 decimals)
+    'mean_glucose': metric('glucose_daily', 'mg/dL', 0),
+    'std_glucose': metric('glucose_daily', 'mg/dL', 0),
+    'max_glucose': metric('glucose_daily', 'mg/dL', 0),
+    'wake_up_glucose': metric('glucose_daily', 'mg/dL', 0),
+
+    # Stress and body battery metrics (1 decimal for percentages)
+    'averageStressLevel': metric('garmin_daily', 'score', 0),
+    'restStressPercentage': metric('garmin_daily', '%', 1),
+    'lowStressPercentage': metric('garmin_daily', '%', 1),
+    'mediumStressPercentage': metric('garmin_daily', '%', 1),
+    'highStressPercentage': metric('garmin_daily', '%', 1),
+    'stressQualifier': metric('garmin_daily', 'label', dtype='string'),
+    'bodyBatteryHighestValue': metric('garmin_daily', 'score', 0),
+    'bodyBatteryLowestValue': metric('garmin_daily', 'score', 0),
+    'bodyBatteryDuringSleep': metric('garmin_daily', 'score', 0),
+
+    # Running and training metrics
+    'predicted_5k': metric('garmin_daily', 's', 0),
+    'predicted_10k': metric('garmin_daily', 's', 0),
+    'predicted_half': metric('garmin_daily', 's', 0),
+    'predicted_marathon': metric('garmin_daily', 's', 0),
+    'vo2max': metric('garmin_daily', 'mL/kg/min', 1),
+    'training_load': metric('garmin_daily', 'load', 0),
+    'duration': metric('garmin_daily', 's', 0),
+    'distance': metric('garmin_daily', 'm', 0),
+    'elevation_gain': metric('garmin_daily', 'm'),
+    'strength_minutes': metric('garmin_daily', 'min', 0),
+
+    # Body composition metrics (1 decimal)
+    'weight': metric('weight', 'kg', 1),
+    'body_fat': metric('weight', '%', 1),
+    'bmi': metric('dashboard', 'kg/m²', 1),
+    'fat_weight': metric('dashboard', 'kg', 1),
+}
+
+def get_metric_dtypes():
+    """Get the dtype of each metric, for the schemas of the datasets holding them."""
+    return {col: spec['dtype'] for col, spec in METRICS.items()}
+
+def apply_metrics_schema(df, source=None):
+    """Round the metric columns of a frame and cast them to their dtypes.
+
+    Columns sharing decimals and dtype are rounded and cast together, so the
+    frame is converted in one pass over a few column blocks. Columns that are
+    not metrics are left as they are.
+
+    Args:
+        df (pd.DataFrame): Frame to convert
+        source (str, optional): Only convert the metrics of this source
+
+    Returns:
+        pd.DataFrame: The frame with rounded and typed metric columns
+    """
+    groups = defaultdict(list)
+    for col in df.columns:
+        spec = METRICS.get(col)
+        if spec is not None and (source is None or spec['source'] == source):
+            groups[(spec['decimals'], spec['dtype'])].append(col)
+
+    memory_before = df.memory_usage(deep=True).sum()
+    converted = {}
+    for (decimals, dtype), cols in groups.items():
+        block = df[cols]
+        if decimals is not None:
+            block = block.round(decimals)
+        converted.update(block.astype(dtype).items())
+    df = df.assign(**converted)
+    logger.info(f"Applied metric schema to {len(converted)} columns, "
+                f"{memory_before / 1024:.0f} KB -> {df.memory_usage(deep=True).sum() / 1024:.0f} KB")
+    return df
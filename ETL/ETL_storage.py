@@ -0,0 +1,775 @@
+import os
+import glob
+import datetime
+import json
+import logging
+import threading
+import time
+import sqlite3
+from contextlib import closing
+import pandas as pd
+from . import config
+from .ETL_general import get_most_recent_date, load_date_index, delete_data_from_date, append_rows
+from .ETL_schema import get_metric_dtypes
+
+logger = logging.getLogger(__name__)
+
+# Column types of each cleaned dataset. 'date' columns are parsed as dates,
+# columns not listed are left to type inference.
+DATASETS = {
+    'tss_metrics': {
+        'path': config.TSS_METRICS_FILE,
+        'schema': {'date': 'date', 'TSS': 'float64', 'CTL': 'float64', 'ATL': 'float64', 'TSB': 'float64'},
+    },
+    'sleep_recovery': {
+        'path': config.WHOOP_SLEEP_RECOVERY_FILE,
+        'schema': {'date': 'date', 'sleep_time': 'string', 'sleep_score_performance': 'float64',
+                   'sleep_score_consistency': 'float64', 'sleep_score_efficiency': 'float64',
+                   'sleep_duration': 'float64', 'sleep_rem': 'float64', 'sleep_deep': 'float64',
+                   'sleep_light': 'float64', 'sleep_awake': 'float64', 'recovery_score': 'float64',
+                   'resting_hr': 'float64', 'hrv': 'float64', 'spo2': 'float64', 'skin_temp': 'float64',
+                   'sleep_id': 'string'},
+    },
+    'mfp_daily': {
+        'path': config.MFP_DAILY_FILE,
+        'schema': {'date': 'date', 'calories_burned': 'float64', 'carbs': 'float64', 'fat': 'float64',
+                   'protein': 'float64', 'sodium': 'float64', 'sugar': 'float64', 'calories_consumed': 'float64',
+                   'calories_goal': 'float64', 'calories_net': 'float64', 'calories_consumed_breakfast': 'float64',
+                   'calories_consumed_lunch': 'float64', 'calories_consumed_dinner': 'float64',
+                   'calories_consumed_snacks': 'float64'},
+    },
+    'mfp_meals': {
+        'path': config.MFP_MEALS_FILE,
+        'schema': {'date': 'date', 'meal': 'string', 'food': 'string', 'quant': 'float64', 'calories': 'float64',
+                   'carbs': 'float64', 'fat': 'float64', 'protein': 'float64', 'sodium': 'float64',
+                   'sugar': 'float64'},
+    },
+    'glucose': {
+        'path': config.GLUCOSE_FILE,
+        'schema': {'date': 'date', 'time': 'string', 'glucose': 'float64', 'datetime': 'date'},
+    },
+    'glucose_daily': {
+        'path': config.GLUCOSE_DAILY_FILE,
+        'schema': {'date': 'date', 'mean_glucose': 'float64', 'std_glucose': 'float64', 'max_glucose': 'float64',
+                   'wake_up_glucose': 'float64'},
+    },
+    'garmin_daily': {
+        'path': config.GARMIN_DAILY_FILE,
+        'schema': {'date': 'date', 'stressQualifier': 'string'},
+    },
+    'garmin_activities': {
+        'path': config.GARMIN_ACTIVITIES_FILE,
+        'schema': {'date': 'date', 'type': 'string'},
+    },
+    'journal': {
+        'path': config.WHOOP_JOURNAL_FILE,
+        'schema': {'date': 'date'},
+    },
+    'weight': {
+        'path': config.WEIGHT_FILE,
+        'schema': {'date': 'date', 'weight': 'float64', 'body_fat': 'float64'},
+    },
+    # Derived datasets are only written as CSV if config.STORAGE_CSV_EXPORT is set
+    'integrated': {
+        'path': config.INTEGRATED_DATA_PATH,
+        'schema': {'date': 'date', **get_metric_dtypes()},
+        'derived': True,
+    },
+    'dashboard': {
+        'path': config.DASHBOARD_DATA_PATH,
+        'schema': {'date': 'date', **get_metric_dtypes()},
+        'derived': True,
+    },
+}
+
+def apply_schema(df, name):
+    """Cast the columns of a frame to the types of its dataset schema."""
+    for col, dtype in DATASETS[name]['schema'].items():
+        if col not in df.columns:
+            continue
+        if dtype == 'date':
+            df[col] = pd.to_datetime(df[col])
+        elif dtype.startswith('Int'):
+            # Files written before a metric was rounded may still hold decimals
+            values = pd.to_numeric(df[col])
+            df[col] = values.astype(dtype) if (values.dropna() % 1 == 0).all() else values
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+def filter_dates(df, start_date=None, end_date=None):
+    """Keep the rows of a frame between two dates (both included)."""
+    if start_date is not None:
+        df = df[df['date'] >= pd.Timestamp(start_date)]
+    if end_date is not None:
+        df = df[df['date'] <= pd.Timestamp(end_date)]
+    return df
+
+def mirrors_csv(name):
+    """Check whether a dataset is also written to its CSV file by non-CSV backends."""
+    return config.STORAGE_CSV_EXPORT or not DATASETS[name].get('derived', False)
+
+def get_join_columns(storage, sources):
+    """Map the columns of each joined source to their output names.
+
+    Args:
+        storage (Storage): Backend the sources are read from
+        sources (list): (dataset name, columns to drop, columns to rename) tuples
+
+    Returns:
+        list: (dataset name, {column: output column}) pairs, without 'date'
+
+    Raises:
+        ValueError: If two sources would produce the same output column
+    """
+    owners = {}
+    join_columns = []
+    for name, drop, rename in sources:
+        columns = {col: rename.get(col, col) for col in storage.columns(name) if col != 'date' and col not in drop}
+        for col, out in columns.items():
+            if out in owners:
+                raise ValueError(f"Column '{out}' of {name} conflicts with {owners[out]}; drop or rename it in the join sources")
+            owners[out] = name
+        join_columns.append((name, columns))
+    return join_columns
+
+class Storage:
+    """Operations shared by the storage backends, built on read and write.
+
+    Backends override them when they can do better than a full read and
+    rewrite of the dataset.
+    """
+    def date_range(self, name):
+        """First and last date of a dataset, or (None, None) if it is empty."""
+        dates = self.read(name, ['date'])['date']
+        if dates.empty:
+            return None, None
+        return dates.min(), dates.max()
+
+    def columns(self, name):
+        """Column names of a stored dataset."""
+        return list(self.read(name).columns)
+
+    def exists(self, name):
+        """Check whether a dataset has been stored."""
+        return os.path.exists(DATASETS[name]['path'])
+
+    def delete_range(self, name, start_date, end_date=None):
+        """Delete the rows of a dataset between two dates (both included)."""
+        df = self.read(name)
+        keep = df['date'] < pd.Timestamp(start_date)
+        if end_date is not None:
+            keep |= df['date'] > pd.Timestamp(end_date)
+        self.write(name, df[keep])
+
+    def upsert(self, name, df):
+        """Replace the rows of a dataset on the dates present in a frame."""
+        df = apply_schema(df.copy(), name)
+        existing = self.read(name)
+        existing = existing[~existing['date'].isin(df['date'])]
+        combined = pd.concat([existing, df], ignore_index=True)
+        self.write(name, combined.sort_values('date', kind='stable'))
+
+    def read_joined(self, sources, start_date=None, end_date=None):
+        """Outer join several datasets on date.
+
+        Every source is aligned on one shared daily DatetimeIndex and the
+        combined frame is assembled by a single concat, instead of a chain
+        of pairwise merges that each copy the growing frame. Only the
+        joined columns are read, and the time spent on each source is
+        logged.
+
+        Args:
+            sources (list): (dataset name, columns to drop, columns to rename) tuples
+            start_date, end_date (optional): Date range to keep (both included)
+
+        Returns:
+            pd.DataFrame: One row per date of any source, sorted by date
+        """
+        frames = []
+        for name, columns in get_join_columns(self, sources):
+            start = time.perf_counter()
+            df_source = self.read(name, columns=list(columns), start_date=start_date, end_date=end_date)
+            df_source = df_source.rename(columns=columns).set_index('date')
+            if df_source.index.has_duplicates:
+                logger.warning(f"{name}: {df_source.index.duplicated().sum()} duplicated dates, keeping the last row of each")
+                df_source = df_source[~df_source.index.duplicated(keep='last')]
+            frames.append(df_source)
+            logger.info(f"Join: {name} read in {(time.perf_counter() - start) * 1000:.1f} ms ({len(df_source)} days)")
+
+        start = time.perf_counter()
+        index = frames[0].index.append([frame.index for frame in frames[1:]]).unique().sort_values()
+        df = pd.concat([frame.reindex(index) for frame in frames], axis=1)
+        df.index.name = 'date'
+        logger.info(f"Join: {len(frames)} sources aligned on {len(index)} days in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return df.reset_index()
+
+class CsvStorage(Storage):
+    """Cleaned datasets stored as the CSV files in config.CLEANED_DATA_DIR."""
+    name = 'csv'
+
+    def read(self, name, columns=None, start_date=None, end_date=None):
+        """Read a dataset with typed columns.
+
+        Args:
+            name (str): Dataset name, a key of DATASETS
+            columns (list, optional): Columns to read, 'date' is always included
+            start_date, end_date (optional): Date range to keep (both included)
+
+        Returns:
+            pd.DataFrame
+        """
+        schema = DATASETS[name]['schema']
+        usecols = None if columns is None else ['date'] + [col for col in columns if col != 'date']
+        dtype = {col: t for col, t in schema.items() if t != 'date' and not t.startswith('Int')}
+        df = pd.read_csv(DATASETS[name]['path'], usecols=usecols, dtype=dtype)
+        df = apply_schema(df, name)
+        return filter_dates(df, start_date, end_date)
+
+    def write(self, name, df):
+        """Write a whole dataset."""
+        write_csv(name, df)
+
+    def columns(self, name):
+        """Column names of a stored dataset, from the CSV header."""
+        return list(pd.read_csv(DATASETS[name]['path'], nrows=0).columns)
+
+    def date_range(self, name):
+        """First and last date of a dataset.
+
+        For files sorted by date (per their date index), the last date comes
+        from get_most_recent_date and the first from the first data row, so
+        the date column is not parsed.
+        """
+        path = DATASETS[name]['path']
+        last_date = get_most_recent_date(path)
+        index = load_date_index(path)
+        if last_date is None or index is None or not index['sorted']:
+            return super().date_range(name)
+        first_date = pd.read_csv(path, usecols=['date'], nrows=1)['date'].iloc[0]
+        return pd.Timestamp(first_date), pd.Timestamp(last_date)
+
+    def delete_range(self, name, start_date, end_date=None):
+        """Delete rows between two dates; open-ended ranges only truncate the file."""
+        if end_date is None:
+            delete_data_from_date(DATASETS[name]['path'], pd.Timestamp(start_date).date())
+        else:
+            super().delete_range(name, start_date, end_date)
+
+    def upsert(self, name, df):
+        """Replace rows on the dates of a frame; rows after the last date are appended."""
+        path = DATASETS[name]['path']
+        last_date = get_most_recent_date(path) if os.path.exists(path) else None
+        df = apply_schema(df.copy(), name)
+        if last_date is None:
+            write_csv(name, df)
+        elif df.empty or df['date'].min() > pd.Timestamp(last_date):
+            write_csv(name, df, append=True)
+        else:
+            super().upsert(name, df)
+
+def write_csv(name, df, append=False):
+    """Write (or append) a dataset to its CSV file, with dates as YYYY-MM-DD."""
+    df = df.copy()
+    if pd.api.types.is_datetime64_any_dtype(df['date']):
+        df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+    if append:
+        append_rows(DATASETS[name]['path'], df)
+    else:
+        df.to_csv(DATASETS[name]['path'], index=False)
+
+class ParquetStorage(Storage):
+    """Cleaned datasets stored as Parquet files, one per year of data.
+
+    Files are stored as <root>/<dataset>/<year>.parquet, so date-range reads
+    only open the years they need. Sources that still append to their CSV
+    file (MyFitnessPal, glucose) are re-imported when the CSV is newer than
+    the Parquet files. Source datasets are also written to CSV, as
+    MyFitnessPal appends to its CSV files directly and the CSV files are the
+    ones kept in the repository; derived datasets only when
+    config.STORAGE_CSV_EXPORT is set.
+
+    Args:
+        root (str): Directory of the Parquet files
+    """
+    name = 'parquet'
+
+    def __init__(self, root=config.PARQUET_DATA_DIR):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("The Parquet storage backend needs pyarrow: pip install pyarrow")
+        self.root = root
+        self.lock = threading.Lock()
+
+    def partitions(self, name):
+        """Paths of the Parquet files of a dataset, oldest year first."""
+        return sorted(glob.glob(os.path.join(self.root, name, '*.parquet')))
+
+    def exists(self, name):
+        """Check whether a dataset has been stored, as Parquet files or as a CSV file to import."""
+        return bool(self.partitions(name)) or os.path.exists(DATASETS[name]['path'])
+
+    def is_stale(self, name):
+        """Check whether the CSV file of a dataset was written after its Parquet files."""
+        csv_path = DATASETS[name]['path']
+        partitions = self.partitions(name)
+        if not partitions:
+            return os.path.exists(csv_path)
+        if not os.path.exists(csv_path):
+            return False
+        return os.path.getmtime(csv_path) > max(os.path.getmtime(path) for path in partitions)
+
+    def write_partitions(self, name, df):
+        """Replace the Parquet files of a dataset with one file per year."""
+        directory = os.path.join(self.root, name)
+        os.makedirs(directory, exist_ok=True)
+        for path in self.partitions(name):
+            os.remove(path)
+        for year, df_year in df.groupby(df['date'].dt.year):
+            df_year.to_parquet(os.path.join(directory, f'{year}.parquet'), index=False)
+
+    def read(self, name, columns=None, start_date=None, end_date=None):
+        """Read a dataset with typed columns (see CsvStorage.read)."""
+        with self.lock:
+            if self.is_stale(name):
+                logger.info(f"Importing {DATASETS[name]['path']} into Parquet")
+                self.write_partitions(name, CsvStorage().read(name))
+
+        paths = self.partitions(name)
+        if start_date is not None:
+            paths = [path for path in paths if int(os.path.basename(path)[:4]) >= pd.Timestamp(start_date).year]
+        if end_date is not None:
+            paths = [path for path in paths if int(os.path.basename(path)[:4]) <= pd.Timestamp(end_date).year]
+        read_columns = None if columns is None else ['date'] + [col for col in columns if col != 'date']
+        frames = [pd.read_parquet(path, columns=read_columns) for path in paths]
+        if not frames:
+            return pd.DataFrame(columns=read_columns or list(DATASETS[name]['schema']))
+        df = pd.concat(frames, ignore_index=True)
+        return filter_dates(df, start_date, end_date)
+
+    def write(self, name, df):
+        """Write a whole dataset, and its CSV file for sources or if exporting."""
+        df = apply_schema(df.copy(), name)
+        with self.lock:
+            # The CSV goes first, so the Parquet files are not seen as stale
+            if mirrors_csv(name):
+                write_csv(name, df)
+            self.write_partitions(name, df)
+
+# SQLite column types of the schema types
+SQLITE_TYPES = {'date': 'TEXT', 'string': 'TEXT', 'float64': 'REAL', 'Int32': 'INTEGER'}
+
+class SqliteStorage(Storage):
+    """Cleaned datasets stored as date-indexed tables of one SQLite database.
+
+    Deletes and upserts only touch the rows of the dates involved, and
+    read_joined is a single query over the date indexes. Dates are stored
+    as YYYY-MM-DD text. Like the Parquet backend, sources that still append
+    to their CSV file are re-imported when it changes, and source datasets
+    are also written to CSV, the files kept in the repository.
+
+    Args:
+        path (str): Database file
+    """
+    name = 'sqlite'
+
+    def __init__(self, path=config.SQLITE_DB_PATH):
+        self.path = path
+        self.lock = threading.RLock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self.connect() as con:
+            con.execute('CREATE TABLE IF NOT EXISTS _imports (dataset TEXT PRIMARY KEY, csv_mtime REAL)')
+
+    def connect(self):
+        """Open a connection; use it as a context manager to commit and close."""
+        return _Connection(self.path)
+
+    def table_columns(self, con, name):
+        """Columns of a table, empty if it does not exist."""
+        return [row[1] for row in con.execute(f'PRAGMA table_info("{name}")')]
+
+    def to_sql_frame(self, df):
+        """Format the datetime columns of a frame as text."""
+        df = df.copy()
+        for col in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[col]):
+                fmt = '%Y-%m-%d' if col == 'date' else '%Y-%m-%d %H:%M:%S'
+                df[col] = df[col].dt.strftime(fmt)
+            elif isinstance(df[col].dtype, pd.StringDtype):
+                df[col] = df[col].astype(object)
+        return df
+
+    def insert(self, con, name, df, replace=False):
+        """Insert the rows of a frame, creating the table or missing columns."""
+        schema = DATASETS[name]['schema']
+        existing = [] if replace else self.table_columns(con, name)
+        for col in df.columns:
+            if existing and col not in existing:
+                con.execute(f'ALTER TABLE "{name}" ADD COLUMN "{col}" {SQLITE_TYPES.get(schema.get(col), "")}')
+        dtype = {col: SQLITE_TYPES[schema[col]] for col in df.columns if col in schema}
+        self.to_sql_frame(df).to_sql(name, con, if_exists='replace' if replace else 'append', index=False, dtype=dtype)
+        con.execute(f'CREATE INDEX IF NOT EXISTS "idx_{name}_date" ON "{name}" (date)')
+
+    def mark_synced(self, con, name):
+        """Remember the modification time of the CSV file the table matches."""
+        path = DATASETS[name]['path']
+        mtime = os.path.getmtime(path) if os.path.exists(path) else 0
+        con.execute('INSERT OR REPLACE INTO _imports (dataset, csv_mtime) VALUES (?, ?)', (name, mtime))
+
+    def sync(self, name):
+        """Re-import a dataset whose CSV file changed outside the store."""
+        path = DATASETS[name]['path']
+        with self.lock, self.connect() as con:
+            row = con.execute('SELECT csv_mtime FROM _imports WHERE dataset = ?', (name,)).fetchone()
+            if not os.path.exists(path):
+                return
+            if row is None or not self.table_columns(con, name) or os.path.getmtime(path) > row[0]:
+                logger.info(f"Importing {path} into SQLite")
+                self.insert(con, name, CsvStorage().read(name), replace=True)
+                self.mark_synced(con, name)
+
+    def where(self, start_date=None, end_date=None):
+        """WHERE clause and parameters of a date range."""
+        clauses, params = [], []
+        if start_date is not None:
+            clauses.append('date >= ?')
+            params.append(pd.Timestamp(start_date).strftime('%Y-%m-%d'))
+        if end_date is not None:
+            clauses.append('date <= ?')
+            params.append(pd.Timestamp(end_date).strftime('%Y-%m-%d'))
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def read(self, name, columns=None, start_date=None, end_date=None):
+        """Read a dataset with typed columns (see CsvStorage.read)."""
+        self.sync(name)
+        select = '*' if columns is None else ', '.join(f'"{col}"' for col in ['date'] + [c for c in columns if c != 'date'])
+        where, params = self.where(start_date, end_date)
+        with self.connect() as con:
+            df = pd.read_sql_query(f'SELECT {select} FROM "{name}"{where} ORDER BY date, rowid', con, params=params)
+        return apply_schema(df, name)
+
+    def write(self, name, df):
+        """Replace a whole dataset, and its CSV file for sources or if exporting."""
+        df = apply_schema(df.copy(), name)
+        with self.lock, self.connect() as con:
+            if mirrors_csv(name):
+                write_csv(name, df)
+            self.insert(con, name, df, replace=True)
+            self.mark_synced(con, name)
+
+    def delete_range(self, name, start_date, end_date=None):
+        """Delete the rows between two dates (both included)."""
+        self.sync(name)
+        with self.lock, self.connect() as con:
+            if mirrors_csv(name):
+                CsvStorage().delete_range(name, start_date, end_date)
+            where, params = self.where(start_date, end_date)
+            con.execute(f'DELETE FROM "{name}"{where}', params)
+            self.mark_synced(con, name)
+
+    def upsert(self, name, df):
+        """Replace the rows on the dates present in a frame."""
+        self.sync(name)
+        df = apply_schema(df.copy(), name)
+        with self.lock, self.connect() as con:
+            if mirrors_csv(name):
+                CsvStorage().upsert(name, df)
+            dates = [(date,) for date in df['date'].dt.strftime('%Y-%m-%d').unique()]
+            con.executemany(f'DELETE FROM "{name}" WHERE date = ?', dates)
+            self.insert(con, name, df)
+            self.mark_synced(con, name)
+
+    def columns(self, name):
+        """Column names of a stored dataset."""
+        self.sync(name)
+        with self.connect() as con:
+            return self.table_columns(con, name)
+
+    def exists(self, name):
+        """Check whether a dataset has a table."""
+        return bool(self.columns(name))
+
+    def date_range(self, name):
+        """First and last date of a dataset, or (None, None) if it is empty."""
+        self.sync(name)
+        with self.connect() as con:
+            first, last = con.execute(f'SELECT MIN(date), MAX(date) FROM "{name}"').fetchone()
+        if first is None:
+            return None, None
+        return pd.Timestamp(first), pd.Timestamp(last)
+
+    def read_joined(self, sources, start_date=None, end_date=None):
+        """Outer join several datasets on date in a single query (see Storage.read_joined)."""
+        join_columns = get_join_columns(self, sources)
+        start = time.perf_counter()
+        where, params = self.where(start_date, end_date)
+        with self.connect() as con:
+            dates = ' UNION '.join(f'SELECT date FROM "{name}"{where}' for name, _ in join_columns)
+            select, joins = ['dates.date AS date'], []
+            for i, (name, columns) in enumerate(join_columns):
+                select.extend(f't{i}."{col}" AS "{out}"' for col, out in columns.items())
+                joins.append(f'LEFT JOIN "{name}" t{i} ON t{i}.date = dates.date')
+            query = f'WITH dates AS ({dates}) SELECT {", ".join(select)} FROM dates {" ".join(joins)} ORDER BY dates.date'
+            df = pd.read_sql_query(query, con, params=params * len(sources))
+        for name, columns in join_columns:
+            for col, dtype in DATASETS[name]['schema'].items():
+                if col in columns:
+                    df[columns[col]] = pd.to_datetime(df[columns[col]]) if dtype == 'date' else df[columns[col]].astype(dtype)
+        df['date'] = pd.to_datetime(df['date'])
+        logger.info(f"Join: {len(sources)} sources joined in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return df
+
+class _Connection:
+    """sqlite3 connection that commits (or rolls back) and closes on exit."""
+    def __init__(self, path):
+        self.con = sqlite3.connect(path)
+
+    def __enter__(self):
+        return self.con
+
+    def __exit__(self, exc_type, exc, tb):
+        with closing(self.con):
+            if exc_type is None:
+                self.con.commit()
+            else:
+                self.con.rollback()
+
+STORAGE_BACKENDS = {
+    'csv': CsvStorage,
+    'parquet': ParquetStorage,
+    'sqlite': SqliteStorage,
+}
+
+_storage = None
+_storage_lock = threading.Lock()
+
+def get_storage():
+    """Get the process-wide storage backend selected by config.STORAGE_BACKEND."""
+    global _storage
+    with _storage_lock:
+        if _storage is None or _storage.name != config.STORAGE_BACKEND:
+            if config.STORAGE_BACKEND not in STORAGE_BACKENDS:
+                raise ValueError(f"Unknown storage backend '{config.STORAGE_BACKEND}', use one of {list(STORAGE_BACKENDS)}")
+            _storage = STORAGE_BACKENDS[config.STORAGE_BACKEND]()
+        return _storage
+
+def load_dataset(name, columns=None, start_date=None, end_date=None):
+    """Read a cleaned dataset through the configured storage backend."""
+    return get_storage().read(name, columns, start_date, end_date)
+
+def save_dataset(name, df):
+    """Write a whole cleaned dataset through the configured storage backend."""
+    storage = get_storage()
+    if not DATASETS[name].get('derived', False):
+        record_changes(storage, name, df)
+    storage.write(name, df)
+
+def upsert_dataset(name, df):
+    """Replace the rows of a cleaned dataset on the dates present in a frame."""
+    if not df.empty:
+        dates = pd.to_datetime(df['date'])
+        mark_changed(name, dates.min(), dates.max())
+    get_storage().upsert(name, df)
+
+def delete_dataset_range(name, start_date, end_date=None):
+    """Delete the rows of a cleaned dataset between two dates (both included)."""
+    mark_changed(name, start_date, end_date)
+    get_storage().delete_range(name, start_date, end_date)
+
+def get_refresh_window(name, default_start=config.DATA_START_DATE, overlap_days=7):
+    """Find where to start pulling data for a source dataset.
+
+    If the dataset has data, start overlap_days before its last date, so that
+    late updates of the last days are picked up. Otherwise pull all data
+    since default_start.
+
+    Returns:
+        tuple: (start_date, since) where since is the date from which the
+        stored rows are replaced (the start date), or None if the dataset
+        is rebuilt
+    """
+    storage = get_storage()
+    last_date = storage.date_range(name)[1] if storage.exists(name) else None
+    if last_date is None:
+        logger.info(f"{name}: No existing data found, pulling all data since {default_start}")
+        return default_start, None
+    start_date = last_date.date() - datetime.timedelta(days=overlap_days)
+    logger.info(f"{name}: Found existing data, pulling from {start_date} onwards")
+    return start_date, start_date
+
+def write_dataset_from(name, df, since):
+    """Replace the rows of a source dataset from the since date with a frame.
+
+    Only the rows of the refreshed window are written: the stored rows from
+    since are deleted and the frame is upserted. Without a since date the
+    dataset is rewritten. A frame bringing columns the stored dataset does
+    not have also rewrites it, keeping the stored rows before since; columns
+    missing from the frame are left empty.
+
+    Args:
+        name (str): Dataset name, a key of DATASETS
+        df (pd.DataFrame): Rows from the since date
+        since (optional): First replaced date, None to rewrite the dataset
+    """
+    if since is None:
+        save_dataset(name, df)
+        return
+    storage = get_storage()
+    columns = storage.columns(name)
+    if not set(df.columns) <= set(columns):
+        logger.info(f"{name}: New columns {sorted(set(df.columns) - set(columns))}, rewriting the dataset")
+        existing = storage.read(name)
+        existing = existing[existing['date'] < pd.Timestamp(since)]
+        save_dataset(name, pd.concat([existing, apply_schema(df.copy(), name)], ignore_index=True))
+        return
+    delete_dataset_range(name, since)
+    upsert_dataset(name, df.reindex(columns=columns))
+
+def write_dataset_changes(name, df):
+    """Write a full version of a source dataset, replacing rows from its first changed date.
+
+    For sources whose API returns the whole history at once. The frame is
+    compared with the stored rows, and only the rows from the first date
+    that differs are rewritten (see write_dataset_from).
+    """
+    storage = get_storage()
+    if not storage.exists(name):
+        save_dataset(name, df)
+        return
+    changed = get_changed_range(storage.read(name), apply_schema(df.copy(), name))
+    if changed is None:
+        logger.info(f"{name}: No changed rows to write")
+        mark_unchanged(name)
+        return
+    since = changed[0]
+    if since is not None:
+        df = df[pd.to_datetime(df['date']) >= since]
+    write_dataset_from(name, df, since)
+
+# Date ranges of the source datasets changed since they were last integrated,
+# kept in config.INTEGRATION_STATE_FILE so that a failed run does not lose them
+_changes_lock = threading.Lock()
+
+def load_integration_state():
+    """Load the pending changes and the CSV files of the last integration."""
+    try:
+        with open(config.INTEGRATION_STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'changes': {}, 'sources': {}}
+
+def save_integration_state(state):
+    """Write the integration state atomically."""
+    tmp_file = f"{config.INTEGRATION_STATE_FILE}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_file, config.INTEGRATION_STATE_FILE)
+
+def get_csv_stat(name):
+    """Size and modification time of the CSV file of a dataset, None if missing."""
+    try:
+        stat = os.stat(DATASETS[name]['path'])
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+def mark_changed(name, start_date=None, end_date=None):
+    """Record that the rows of a source dataset between two dates changed.
+
+    Ranges recorded for the same dataset are merged into the range covering
+    them all. Derived datasets are not tracked.
+
+    Args:
+        name (str): Dataset name, a key of DATASETS
+        start_date, end_date (optional): Changed dates (both included), None for open ends
+    """
+    if DATASETS[name].get('derived', False):
+        return
+    start = None if start_date is None else pd.Timestamp(start_date).strftime('%Y-%m-%d')
+    end = None if end_date is None else pd.Timestamp(end_date).strftime('%Y-%m-%d')
+    with _changes_lock:
+        state = load_integration_state()
+        previous = state['changes'].get(name)
+        if previous is not None:
+            start = None if start is None or previous[0] is None else min(start, previous[0])
+            end = None if end is None or previous[1] is None else max(end, previous[1])
+        state['changes'][name] = [start, end]
+        save_integration_state(state)
+    logger.info(f"{name}: rows changed from {start or 'the start'} to {end or 'the end'}")
+
+def mark_unchanged(name):
+    """Record that a source dataset was rewritten without changing any row."""
+    with _changes_lock:
+        state = load_integration_state()
+        state['changes'].setdefault(name, None)
+        save_integration_state(state)
+
+def get_changed_range(df_old, df_new):
+    """First and last date whose rows differ between two versions of a dataset.
+
+    Rows are compared by a hash per date, with numbers compared as floats so
+    that integers read back from CSV match the floats that were written.
+
+    Returns:
+        tuple: (start, end) Timestamps, (None, None) if the columns differ,
+        or None if no row changed
+    """
+    if set(df_old.columns) != set(df_new.columns):
+        return None, None
+
+    def hash_by_date(df):
+        values = df[sorted(col for col in df.columns if col != 'date')]
+        values = values.apply(lambda col: col.astype('float64') if pd.api.types.is_numeric_dtype(col)
+                              else col.astype(object).where(col.notna(), None))
+        hashes = pd.util.hash_pandas_object(values, index=False)
+        return hashes.groupby(df['date'].to_numpy()).sum()
+
+    old, new = hash_by_date(df_old), hash_by_date(df_new)
+    old, new = old.align(new)
+    changed = old.index[old.ne(new)]
+    if changed.empty:
+        return None
+    return changed.min(), changed.max()
+
+def record_changes(storage, name, df):
+    """Record the dates a full rewrite of a source dataset changes."""
+    if not os.path.exists(DATASETS[name]['path']):
+        mark_changed(name)
+        return
+    changed = get_changed_range(storage.read(name), apply_schema(df.copy(), name))
+    if changed is None:
+        mark_unchanged(name)
+    else:
+        mark_changed(name, *changed)
+
+def get_pending_changes(names):
+    """Get the date ranges changed in source datasets since their last integration.
+
+    A dataset whose CSV file changed without a recorded range, as when it is
+    written outside the storage helpers, counts as changed on all dates.
+
+    Args:
+        names (list): Dataset names
+
+    Returns:
+        dict: (start, end) Timestamps of each changed dataset, None for open ends
+    """
+    state = load_integration_state()
+    changes = {}
+    for name in names:
+        if name in state['changes']:
+            if state['changes'][name] is not None:
+                changes[name] = tuple(None if date is None else pd.Timestamp(date) for date in state['changes'][name])
+        elif state['sources'].get(name) != get_csv_stat(name):
+            changes[name] = (None, None)
+    return changes
+
+def clear_pending_changes(names):
+    """Forget the changes of integrated source datasets and remember their CSV files."""
+    with _changes_lock:
+        state = load_integration_state()
+        for name in names:
+            state['changes'].pop(name, None)
+            state['sources'][name] = get_csv_stat(name)
+        save_integration_state(state)
@@ -2,7 +2,9 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 import logging
+import os
 import sys
+from . import config
 
 # Configure logging with a more visible format
 logging.basicConfig(
@@ -14,15 +16,62 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def categorize_activity(types):
-    """Categorize activity type for TSS calculation."""
-    types = set(types)
-    if any(t in types for t in ['running', 'trail_running']):
-        return 'running'
-    elif 'strength_training' in types:
-        return 'strength'
+# TSS formula coefficients per activity category, derived with analyze_tss.py.
+# A day is 'running' if it has any run, else 'strength' if it has any strength
+# session, else 'other'. Refitting the formulas only means replacing this table.
+TSS_FEATURES = ['intercept', 'training_load', 'duration', 'aerobic_te', 'anaerobic_te', 'avg_hr', 'is_trail']
+TSS_COEFFICIENTS = pd.DataFrame(
+    [
+        [-15.4521, 0.7234, 0.0012, -18.3421, 0.0, 0.2145, 5.8932],
+        [12.8932, 0.4567, 0.0008, -12.4532, 8.3421, 0.0, 0.0],
+        [8.2341, 0.8605, 0.0007, -24.0555, 0.0, 0.0, 0.0],
+    ],
+    index=['running', 'strength', 'other'],
+    columns=TSS_FEATURES
+)
+RUNNING_TYPES = ['running', 'trail_running']
+STRENGTH_TYPES = ['strength_training']
+
+def exponential_load(tss, time_constant, initial=None, block_size=128):
+    """Exponentially weighted training load (CTL/ATL) over a whole TSS series.
+    
+    Evaluates load[i] = load[i-1] * decay + tss[i] * (1 - decay), with
+    decay = exp(-1 / time_constant), without a Python loop over the days.
+    Within a block the recursion has the closed form
+    load[j] = decay^(j+1) * carry + (1 - decay) * decay^j * cumsum(tss[k] / decay^k),
+    and blocks are kept short so that decay^-k stays well inside float range.
+    
+    Args:
+        tss (array-like): Daily TSS values, in date order
+        time_constant (float): Time constant in days (42 for CTL, 7 for ATL)
+        initial (float, optional): Load on the day before the series starts.
+            If None, the first day is seeded with its own TSS.
+        block_size (int): Number of days evaluated per vectorized block
+    
+    Returns:
+        np.ndarray: Load value for each day
+    """
+    tss = np.asarray(tss, dtype=float)
+    load = np.empty_like(tss)
+    if len(tss) == 0:
+        return load
+    
+    decay = np.exp(-1 / time_constant)
+    if initial is None:
+        load[0] = tss[0]
     else:
-        return 'other'
+        load[0] = initial * decay + tss[0] * (1 - decay)
+    
+    powers = decay ** np.arange(block_size + 1)
+    carry = load[0]
+    for block_start in range(1, len(tss), block_size):
+        block = tss[block_start:block_start + block_size]
+        n = len(block)
+        scaled = np.cumsum(block / powers[:n])
+        load[block_start:block_start + n] = powers[1:n + 1] * carry + (1 - decay) * powers[:n] * scaled
+        carry = load[block_start + n - 1]
+    
+    return load
 
 def validate_tss_calculation(daily_data):
     """Validate TSS calculations and log any potential issues.
@@ -83,19 +132,19 @@ def validate_tss_calculation(daily_data):
     
     return validation_passed
 
-def calculate_tss(activity_data):
-    """Calculate TSS from Garmin data using derived formulas.
+def calculate_daily_tss(activity_data, start_date=None):
+    """Calculate daily TSS from Garmin data using derived formulas.
     
     Args:
         activity_data (pd.DataFrame): DataFrame containing Garmin activity data
             Required columns: type, training_load, duration, aerobic_te, 
             anaerobic_te (optional), avg_hr (optional)
+        start_date (str, optional): First day of the output (YYYY-MM-DD).
+            Defaults to the first activity date.
     
     Returns:
-        pd.DataFrame: Daily TSS values with date index
+        pd.DataFrame: One row per day up to today with columns date, TSS
     """
-    logger.info("Starting TSS calculation...")
-    
     # Ensure numeric columns
     numeric_cols = ['training_load', 'duration', 'aerobic_te', 'anaerobic_te', 'avg_hr']
     for col in numeric_cols:
@@ -105,9 +154,17 @@ def calculate_tss(activity_data):
     # Fill NaN values with 0
     activity_data = activity_data.fillna(0)
     
+    # Flag activity categories per activity, so they can be aggregated per day
+    types = activity_data['type'].astype(str)
+    activity_data['is_running'] = types.isin(RUNNING_TYPES).astype(int)
+    activity_data['is_strength'] = types.isin(STRENGTH_TYPES).astype(int)
+    activity_data['is_trail'] = types.str.contains('trail_running', regex=False).astype(int)
+    
     # Group by date and calculate daily metrics
     daily_data = activity_data.groupby('date').agg({
-        'type': list,
+        'is_running': 'max',
+        'is_strength': 'max',
+        'is_trail': 'max',
         'training_load': 'sum',
         'duration': 'sum',
         'aerobic_te': 'sum',
@@ -116,7 +173,8 @@ def calculate_tss(activity_data):
     }).reset_index()
     
     # Create a complete date range including today
-    start_date = daily_data['date'].min()
+    if start_date is None:
+        start_date = daily_data['date'].min()
     end_date = pd.Timestamp.today().normalize()  # Use today's date
     date_range = pd.date_range(start=start_date, end=end_date, freq='D')
     
@@ -129,89 +187,75 @@ def calculate_tss(activity_data):
         daily_data,
         on='date',
         how='left'
-    )
-    
-    # Fill missing values for calculations
-    daily_data['type'] = daily_data['type'].fillna('').apply(lambda x: [] if x == '' else x)
-    daily_data['training_load'] = daily_data['training_load'].fillna(0)
-    daily_data['duration'] = daily_data['duration'].fillna(0)
-    daily_data['aerobic_te'] = daily_data['aerobic_te'].fillna(0)
-    daily_data['anaerobic_te'] = daily_data['anaerobic_te'].fillna(0)
-    daily_data['avg_hr'] = daily_data['avg_hr'].fillna(0)
-    
-    # Add activity category and trail flag
-    daily_data['activity_category'] = daily_data['type'].apply(categorize_activity)
-    daily_data['is_trail'] = daily_data['type'].apply(
-        lambda x: 1 if any('trail_running' in t for t in x) else 0
-    )
+    ).fillna(0)
     
-    # Calculate TSS for each category using derived formulas
-    def calculate_running_tss(row):
-        if row['duration'] == 0:
-            return 0
-        return (-15.4521 +
-                (0.7234 * row['training_load']) +
-                (0.0012 * row['duration']) +
-                (-18.3421 * row['aerobic_te']) +
-                (0.2145 * row['avg_hr']) +
-                (5.8932 * row['is_trail']))
-    
-    def calculate_strength_tss(row):
-        if row['duration'] == 0:
-            return 0
-        return (12.8932 +
-                (0.4567 * row['training_load']) +
-                (0.0008 * row['duration']) +
-                (-12.4532 * row['aerobic_te']) +
-                (8.3421 * row['anaerobic_te']))
-    
-    def calculate_other_tss(row):
-        if row['duration'] == 0:
-            return 0
-        return (8.2341 +
-                (0.8605 * row['training_load']) +
-                (0.0007 * row['duration']) +
-                (-24.0555 * row['aerobic_te']))
-    
-    # Apply formulas based on activity category
-    daily_data['TSS'] = daily_data.apply(
-        lambda row: calculate_running_tss(row) if row['activity_category'] == 'running'
-        else calculate_strength_tss(row) if row['activity_category'] == 'strength'
-        else calculate_other_tss(row),
-        axis=1
-    )
+    daily_data['TSS'] = apply_tss_formulas(daily_data)
     
     # Ensure TSS is non-negative and round to 1 decimal
     daily_data['TSS'] = np.maximum(daily_data['TSS'], 0).round(1)
     
-    # Calculate CTL, ATL, and TSB
-    ctl_decay = np.exp(-1/42)  # 42-day time constant for CTL
-    atl_decay = np.exp(-1/7)   # 7-day time constant for ATL
+    return daily_data[['date', 'TSS']].sort_values('date').reset_index(drop=True)
+
+def apply_tss_formulas(daily_data, coefficients=TSS_COEFFICIENTS):
+    """Evaluate the category TSS formulas for all days at once.
     
-    daily_data = daily_data.sort_values('date')
-    daily_data['CTL'] = 0.0  # Initialize as float
-    daily_data['ATL'] = 0.0  # Initialize as float
+    Args:
+        daily_data (pd.DataFrame): Daily features (see TSS_FEATURES, without
+            intercept) plus is_running and is_strength category flags
+        coefficients (pd.DataFrame): Coefficients, one row per category
     
-    # Initialize with reasonable starting values
-    if len(daily_data) > 0:
-        daily_data.iloc[0, daily_data.columns.get_loc('CTL')] = float(daily_data['TSS'].iloc[0])
-        daily_data.iloc[0, daily_data.columns.get_loc('ATL')] = float(daily_data['TSS'].iloc[0])
+    Returns:
+        np.ndarray: Raw TSS per day (0 on days without activity duration)
+    """
+    features = daily_data.reindex(columns=coefficients.columns, fill_value=0).astype(float)
+    features['intercept'] = 1.0
+    
+    # One column per category, then pick the day's category
+    tss_by_category = features.to_numpy() @ coefficients.to_numpy().T
+    category = np.select(
+        [daily_data['is_running'] > 0, daily_data['is_strength'] > 0],
+        [coefficients.index.get_loc('running'), coefficients.index.get_loc('strength')],
+        default=coefficients.index.get_loc('other')
+    )
+    tss = tss_by_category[np.arange(len(daily_data)), category]
     
-    # Calculate rolling averages
-    for i in range(1, len(daily_data)):
-        prev_ctl = daily_data.iloc[i-1]['CTL']
-        prev_atl = daily_data.iloc[i-1]['ATL']
-        tss = daily_data.iloc[i]['TSS']
-        
-        daily_data.iloc[i, daily_data.columns.get_loc('CTL')] = (prev_ctl * ctl_decay) + (tss * (1 - ctl_decay))
-        daily_data.iloc[i, daily_data.columns.get_loc('ATL')] = (prev_atl * atl_decay) + (tss * (1 - atl_decay))
+    return np.where(daily_data['duration'].to_numpy() == 0, 0, tss)
+
+def calculate_training_load(daily_tss, initial_ctl=None, initial_atl=None):
+    """Add CTL, ATL and TSB to a daily TSS series.
+    
+    Args:
+        daily_tss (pd.DataFrame): Columns date, TSS, one row per day
+        initial_ctl (float, optional): CTL on the day before the first row
+        initial_atl (float, optional): ATL on the day before the first row
+    
+    Returns:
+        pd.DataFrame: Columns date, TSS, CTL, ATL, TSB (not rounded)
+    """
+    daily_data = daily_tss.sort_values('date').reset_index(drop=True)
+    tss = daily_data['TSS'].to_numpy(dtype=float)
+    daily_data['CTL'] = exponential_load(tss, 42, initial_ctl)  # 42-day time constant for CTL
+    daily_data['ATL'] = exponential_load(tss, 7, initial_atl)   # 7-day time constant for ATL
     
     # Calculate Training Stress Balance (TSB)
     daily_data['TSB'] = daily_data['CTL'] - daily_data['ATL']
     
-    # Return only the necessary columns
-    result = daily_data[['date', 'TSS', 'CTL', 'ATL', 'TSB']].copy()
-    result = result.round(1)
+    return daily_data[['date', 'TSS', 'CTL', 'ATL', 'TSB']]
+
+def calculate_tss(activity_data):
+    """Calculate TSS, CTL, ATL and TSB from Garmin data using derived formulas.
+    
+    Args:
+        activity_data (pd.DataFrame): DataFrame containing Garmin activity data
+            Required columns: type, training_load, duration, aerobic_te, 
+            anaerobic_te (optional), avg_hr (optional)
+    
+    Returns:
+        pd.DataFrame: Daily TSS values with date index
+    """
+    logger.info("Starting TSS calculation...")
+    
+    result = calculate_training_load(calculate_daily_tss(activity_data)).round(1)
     
     # Validate the calculations
     if not validate_tss_calculation(result):
@@ -221,18 +265,104 @@ def calculate_tss(activity_data):
     
     return result
 
-def get_tss_data(activity_data, start_date=None):
+def load_tss_state(state_file=config.TSS_STATE_FILE):
+    """Load the persisted (unrounded) CTL/ATL state, or None if unavailable."""
+    if not os.path.exists(state_file):
+        return None
+    state = pd.read_csv(state_file, dtype={'date': str})
+    return state if not state.empty else None
+
+def save_tss_state(load_data, state_file=config.TSS_STATE_FILE):
+    """Persist the last days of unrounded TSS/CTL/ATL to resume from on the next run."""
+    state = load_data[['date', 'TSS', 'CTL', 'ATL']].tail(config.TSS_STATE_DAYS)
+    state.to_csv(state_file, index=False)
+
+def update_tss_data(activity_data, metrics_file=config.TSS_METRICS_FILE, state_file=config.TSS_STATE_FILE):
+    """Update TSS metrics, recomputing CTL/ATL only from the earliest changed day.
+    
+    The state file keeps the exact TSS/CTL/ATL of the last config.TSS_STATE_DAYS
+    days. Daily TSS is recalculated for that window only and compared with the
+    state; the recursion resumes from the last unchanged day. Activities before
+    the window are assumed unchanged (Garmin only re-pulls the last week).
+    Falls back to a full recalculation when the state cannot be used.
+    
+    Args:
+        activity_data (pd.DataFrame): Garmin activity data (full history)
+        metrics_file (str): Existing TSS metrics file
+        state_file (str): CTL/ATL state file
+    
+    Returns:
+        tuple: (daily TSS metrics, since) with the recomputed days only and
+            their first date, or the full history and None after a full
+            recalculation
+    """
+    state = load_tss_state(state_file)
+    existing = pd.read_csv(metrics_file, dtype={'date': str}) if os.path.exists(metrics_file) else None
+    
+    if state is not None and existing is not None and not existing.empty:
+        window_start = state['date'].min()
+        window = calculate_daily_tss(activity_data[activity_data['date'] >= window_start].copy(), window_start)
+        
+        # First day whose TSS differs from the state (or is not in it yet)
+        compared = window.merge(state[['date', 'TSS']], on='date', how='left', suffixes=('', '_state'))
+        changed = ~np.isclose(compared['TSS'], compared['TSS_state'])
+        unchanged_state = state[state['date'] < compared.loc[changed, 'date'].min()] if changed.any() else state
+        
+        # Resume only if the metrics file agrees with the state up to the checkpoint
+        if not unchanged_state.empty:
+            checkpoint = unchanged_state.iloc[-1]
+            prefix = existing[existing['date'] <= checkpoint['date']]
+            overlap = prefix.merge(unchanged_state[['date', 'TSS']], on='date', suffixes=('', '_state'))
+            if (not prefix.empty and prefix['date'].iloc[-1] == checkpoint['date']
+                    and np.allclose(overlap['TSS'], overlap['TSS_state'])
+                    and existing['date'].min() <= activity_data['date'].min()):
+                logger.info(f"Resuming TSS calculation from {checkpoint['date']} "
+                            f"({len(window[window['date'] > checkpoint['date']])} days to recompute)")
+                
+                load_data = calculate_training_load(
+                    window[window['date'] > checkpoint['date']],
+                    initial_ctl=checkpoint['CTL'],
+                    initial_atl=checkpoint['ATL']
+                )
+                save_tss_state(pd.concat([unchanged_state, load_data], ignore_index=True), state_file)
+                
+                recomputed = load_data.round(1)
+                if not recomputed.empty and not validate_tss_calculation(recomputed):
+                    logger.warning("TSS calculations completed but validation found issues")
+                since = (pd.Timestamp(checkpoint['date']) + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+                return recomputed, since
+    
+    logger.info("No usable TSS state found, recalculating full history")
+    load_data = calculate_training_load(calculate_daily_tss(activity_data))
+    save_tss_state(load_data, state_file)
+    
+    result = load_data.round(1)
+    if not validate_tss_calculation(result):
+        logger.warning("TSS calculations completed but validation found issues")
+    else:
+        logger.info("TSS calculations completed and validated successfully")
+    return result, None
+
+def get_tss_data(activity_data, start_date=None, incremental=True):
     """Get TSS metrics from Garmin activity data.
     
     Args:
         activity_data (pd.DataFrame): DataFrame containing Garmin activity data
         start_date (datetime, optional): Start date for calculations
+        incremental (bool): Resume CTL/ATL from the persisted state instead of
+            recalculating the full history (ignored when start_date is given)
     
     Returns:
-        pd.DataFrame: Daily TSS metrics
+        tuple: (daily TSS metrics, since) where since is the first recomputed
+            date when only the days from it are returned, or None for the
+            full history
     """
     if start_date:
         activity_data = activity_data[activity_data['date'] >= start_date].copy()
+        return calculate_tss(activity_data), None
+    
+    if incremental:
+        return update_tss_data(activity_data)
     
     tss_data = calculate_tss(activity_data)
-    return tss_data 
\ No newline at end of file
+    return tss_data, None 
\ No newline at end of file
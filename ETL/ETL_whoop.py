@@ -6,6 +6,9 @@ import csv
 from datetime import datetime, timedelta
 import logging
 from . import config
+from .ETL_cache import get_cache
+from .ETL_general import parse_timezone_offsets
+from .ETL_storage import get_refresh_window, write_dataset_from, write_dataset_changes
 
 logger = logging.getLogger(__name__)
 
@@ -15,8 +18,8 @@ def init_whoop(un, pw):
     profile = client.get_profile()
     return client
 
-def get_journal_data(input_file, output_file):
-    
+def get_journal_data(input_file):
+    """Get the journal answers of a Whoop export, one row per day."""
     df = pd.read_csv(input_file)
 
     def set_date(row):
@@ -44,66 +47,41 @@ def get_journal_data(input_file, output_file):
                          'Spend time stretching?': 'stretch',
                          'Viewed a screen device in bed?': 'screen_bed'}, inplace=True)
     df_u.columns.name = None
-    df_u.to_csv(output_file, index=False)
-    print(f"{output_file}: Journal data obtained and rewritten'")
+    return df_u
 
 def get_sleep_recovery_data(client, start_date=None):
     """Get sleep and recovery data from Whoop.
     
     Args:
         client: Whoop client
-        start_date: Optional start date, defaults to config.DATA_START_DATE
+        start_date: First day pulled, the start of the refresh window from
+            get_refresh_window. Defaults to config.DATA_START_DATE
+    
+    Returns:
+        pd.DataFrame: One row per day from start_date
     """
     if start_date is None:
         start_date = config.DATA_START_DATE
     
     logger.info(f"Getting Whoop sleep and recovery data from {start_date}")
     
-    # Check existing data
-    if os.path.exists(config.WHOOP_SLEEP_RECOVERY_FILE):
-        existing_data = pd.read_csv(config.WHOOP_SLEEP_RECOVERY_FILE)
-        if len(existing_data) > 0:
-            # If we have data, start from the last date minus 7 days
-            last_date = pd.to_datetime(existing_data['date'].max()).date()
-            start_date = last_date - timedelta(days=7)
-            logger.info(f"Found existing data, pulling from {start_date} onwards")
-            
-            # Remove the last week of data from existing_data to avoid duplicates
-            cutoff_date = start_date.strftime('%Y-%m-%d')
-            existing_data = existing_data[existing_data['date'] < cutoff_date]
-        else:
-            logger.info(f"Existing data is empty, pulling all data since {config.DATA_START_DATE}")
-            start_date = config.DATA_START_DATE
-            existing_data = None
-    else:
-        logger.info(f"No existing data found, pulling all data since {config.DATA_START_DATE}")
-        start_date = config.DATA_START_DATE
-        existing_data = None
-    
-    # Get sleep data
-    sleep = client.get_sleep_collection(start_date.strftime('%Y-%m-%d'))
+    # Get sleep data (collections run up to today, so they are cached for the recent TTL)
+    today = datetime.now().date()
+    sleep = get_cache('whoop').get_range(
+        'sleep', start_date, today,
+        lambda: client.get_sleep_collection(start_date.strftime('%Y-%m-%d'))
+    )
     df_s = pd.json_normalize(sleep)
     
     # Get recovery data
-    recovery = client.get_recovery_collection(start_date.strftime('%Y-%m-%d'))
+    recovery = get_cache('whoop').get_range(
+        'recovery', start_date, today,
+        lambda: client.get_recovery_collection(start_date.strftime('%Y-%m-%d'))
+    )
     df_r = pd.json_normalize(recovery)
 
-    def apply_timezone_offset(row):
-        start_time = pd.to_datetime(row['start'])
-        offset = row['timezone_offset']
-
-        # If it's just "Z", treat as zero offset
-        if offset == "Z":
-            hours, minutes = (0, 0)
-        else:
-            # Otherwise split normally
-            hours, minutes = map(int, offset.split(':'))
-
-        timezone_offset = pd.Timedelta(hours=hours, minutes=minutes)
-        return start_time + timezone_offset
-
     # Process sleep data
-    df_s['start'] = df_s.apply(apply_timezone_offset, axis=1)
+    df_s['start'] = pd.to_datetime(df_s['start'], utc=True, format='ISO8601') + parse_timezone_offsets(df_s['timezone_offset'])
 
     for col in df_s.columns:
         if col.endswith('_milli'):
@@ -141,10 +119,6 @@ def get_sleep_recovery_data(client, start_date=None):
     # Merge sleep and recovery data
     df = pd.merge(df_s, df_r, on='sleep_id', how='left')
     
-    # If we have existing data, append the new data
-    if existing_data is not None:
-        df = pd.concat([existing_data, df], ignore_index=True)
-    
     # Convert date to datetime for proper sorting and deduplication
     df['date'] = pd.to_datetime(df['date'])
     df = df.sort_values('date').drop_duplicates(subset=['date'], keep='last')
@@ -164,15 +138,14 @@ def main():
     print("Logging in to Whoop")
     client = init_whoop(un, pw)
 
-    whoop_file = 'Data/Cleaned/Sleep_and_recovery.csv'
-    start_date = datetime(2024, 1, 1)
+    start_date, since = get_refresh_window('sleep_recovery')
     df = get_sleep_recovery_data(client, start_date)
-    df.to_csv(whoop_file, index=False)
-    print('Sleep and recovery data cleaned and saved to Data/Cleaned/Sleep_and_recovery.csv')
+    write_dataset_from('sleep_recovery', df, since)
+    print(f'Sleep and recovery data cleaned and saved to {config.WHOOP_SLEEP_RECOVERY_FILE}')
    
     journal_file_raw = 'Data/Whoop/journal_entries.csv'
-    journal_file = 'Data/Cleaned/Journal.csv'
-    get_journal_data(journal_file_raw, journal_file)
+    write_dataset_changes('journal', get_journal_data(journal_file_raw))
+    print(f'Journal data saved to {config.WHOOP_JOURNAL_FILE}')
 
 if __name__ == "__main__":
     main()
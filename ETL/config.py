@@ -8,6 +8,9 @@ DATA_START_DATE = datetime.date(2024, 3, 16)
 # File paths
 CLEANED_DATA_DIR = 'Data/Cleaned'
 RAW_DATA_DIR = 'Data'
+CACHE_DIR = 'Data/Cache'
+PARQUET_DATA_DIR = 'Data/Parquet'
+SQLITE_DB_PATH = 'Data/health.db'
 
 # File names
 GARMIN_DAILY_FILE = f'{CLEANED_DATA_DIR}/Garmin_daily.csv'
@@ -17,11 +20,55 @@ WHOOP_JOURNAL_FILE = f'{CLEANED_DATA_DIR}/Journal.csv'
 MFP_MEALS_FILE = f'{CLEANED_DATA_DIR}/MFP meals scrapped.csv'
 MFP_DAILY_FILE = f'{CLEANED_DATA_DIR}/MFP per day scrapped.csv'
 GLUCOSE_DAILY_FILE = f'{CLEANED_DATA_DIR}/Glucose_daily.csv'
+GLUCOSE_FILE = f'{CLEANED_DATA_DIR}/Glucose.csv'
+GLUCOSE_STATE_FILE = f'{CLEANED_DATA_DIR}/Glucose_state.json'
+LIBREVIEW_EXPORT_FILE = f'{RAW_DATA_DIR}/LibreLink/AlbertoRequena Izard_glucose.csv'
 WEIGHT_FILE = f'{CLEANED_DATA_DIR}/Weight.csv'
 TSS_METRICS_FILE = f'{CLEANED_DATA_DIR}/TSS metrics.csv'
+TSS_STATE_FILE = f'{CLEANED_DATA_DIR}/TSS_state.csv'
+INTEGRATION_STATE_FILE = f'{CLEANED_DATA_DIR}/Integration_state.json'
 INTEGRATED_DATA_PATH = f'{CLEANED_DATA_DIR}/Integrated_data.csv'
 DASHBOARD_DATA_PATH = f'{CLEANED_DATA_DIR}/daily_dashboard_data.csv'
 
 # Google Sheets settings
+GSHEETS_CREDENTIALS_FILE = 'gsheets key.json'  # Service account key shared by all Sheets calls
 JOURNAL_SPREADSHEET_ID = '1E0pWgt9Zifdx3S3iqpyAjTHijn-xZcXYLRXvqwgo-tg'
-INTEGRATED_DATA_SPREADSHEET_ID = '197VfZCekvBev0m1vsi8kUHpuO0IoTRA90_bQRGBYYSM' 
\ No newline at end of file
+INTEGRATED_DATA_SPREADSHEET_ID = '197VfZCekvBev0m1vsi8kUHpuO0IoTRA90_bQRGBYYSM' 
+GSHEETS_DELTA_SYNC = True                     # Upload only the rows changed since the last export
+GSHEETS_SNAPSHOT_DIR = f'{CACHE_DIR}/Sheets'  # Rows last uploaded to each sheet
+
+# Source refresh settings
+ETL_CONCURRENT_REFRESH = True  # Refresh independent sources in parallel
+ETL_MAX_WORKERS = 4            # Maximum number of sources refreshed at once
+
+# Integration settings
+INTEGRATION_INCREMENTAL = True  # Only rebuild the dates of the integrated data whose sources changed
+
+# TSS settings
+TSS_STATE_DAYS = 60  # Days of unrounded CTL/ATL kept to resume the calculation from
+
+# Garmin API settings
+GARMIN_MAX_WORKERS = 4            # Days fetched concurrently
+GARMIN_REQUESTS_PER_SECOND = 3    # Sustained request rate shared by all workers
+GARMIN_RANGE_DAYS = 364           # Longest date range requested in one range call
+
+# API response cache policies: responses for days older than
+# immutable_after_days are never refetched, newer ones after recent_ttl seconds
+CACHE_POLICIES = {
+    'default': {'immutable_after_days': 10, 'recent_ttl': 3600},
+    'garmin': {'immutable_after_days': 10, 'recent_ttl': 3600},
+    'whoop': {'immutable_after_days': 10, 'recent_ttl': 3600},
+    'mfp': {'immutable_after_days': 10, 'recent_ttl': 3600},
+    'fitbit': {'immutable_after_days': 10, 'recent_ttl': 3600},
+}
+
+# MyFitnessPal settings
+MFP_POOL_SIZE = 4                 # Clients scraping diary days concurrently
+MFP_BACKFILL_MIN_DAYS = 30        # Days to fetch before a pool is used; shorter refreshes use one client
+MFP_REQUESTS_PER_SECOND = 4       # Sustained diary requests per second for the pool
+MFP_MAX_RETRIES = 3               # Retries per day on transient errors
+MFP_RETRY_DELAY = 1.0             # Seconds before the first retry of a day, doubled each time
+
+# Storage settings
+STORAGE_BACKEND = 'csv'      # 'csv', 'parquet' (needs pyarrow) or 'sqlite'
+STORAGE_CSV_EXPORT = True    # Also write derived datasets (integrated, dashboard) as CSV with the Parquet backend
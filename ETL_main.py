@@ -1,19 +1,23 @@
 #!/usr/bin/env python3
 
 # Import necessary modules and functions
-import os, datetime
+import os, datetime, time
 import pandas as pd
 import logging
 import sys
-from ETL.ETL_general import update_incremental, update_incremental_api, get_most_recent_date, export_to_gsheets, get_incremental_data_api
-from ETL.ETL_garmin_api import init_garmin, get_garmin_data, get_garmin_activities
-from ETL.ETL_whoop import init_whoop, get_sleep_recovery_data, get_journal_data
-from ETL.ETL_mfp_api import init_mfp, get_meal_data, get_meal_daily
-from ETL.ETL_libreview import get_glucose_daily, get_glucose_time
+from concurrent.futures import ThreadPoolExecutor
+from ETL.ETL_general import export_to_gsheets
+from ETL.ETL_garmin_api import init_garmin, get_garmin_daily_and_activities
+from ETL.ETL_whoop import init_whoop, get_sleep_recovery_data
+from ETL.ETL_mfp_api import init_mfp, get_mfp_data
+from ETL.ETL_libreview import update_glucose_data
 from ETL.ETL_tss_calculation import get_tss_data
 from ETL.ETL_fitbit import init_fitbit, get_body_measurements
 from ETL.ETL_journal import get_journal_data
 from ETL.ETL_dashboard import create_dashboard_data
+from ETL.ETL_cache import log_cache_stats, prune_caches
+from ETL.ETL_storage import get_storage, load_dataset, save_dataset, upsert_dataset, delete_dataset_range, mark_changed, get_pending_changes, clear_pending_changes, get_refresh_window, write_dataset_from, write_dataset_changes
+from ETL.ETL_schema import apply_metrics_schema
 from ETL import config
 
 # Configure logging with a more visible format
@@ -26,162 +30,219 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def update_clean_files():
-    """Update data of intermediate clean files"""
-    
-    logger.info("Starting to update clean files...")
-    
-    # Load environment variables
-    email_g = os.getenv("USERNAME_G")
-    password_g = os.getenv("PASSWORD_G")
-    
-    # Weight data update from Fitbit
-    try:
-        logger.info("Initializing Fitbit connection...")
-        tokens = init_fitbit()
-        df_weight = get_body_measurements(tokens)
-        if not df_weight.empty:
-            df_weight.to_csv(config.WEIGHT_FILE, index=False)
-            logger.info(f"{config.WEIGHT_FILE}: Data obtained from Fitbit and saved")
-        else:
-            logger.warning("No Fitbit weight data found")
-    except Exception as e:
-        logger.error(f"Error getting Fitbit weight data: {str(e)}")
+def update_weight():
+    """Weight data update from Fitbit"""
+    logger.info("Initializing Fitbit connection...")
+    tokens = init_fitbit()
+    start_date, since = get_refresh_window('weight')
+    df_weight = get_body_measurements(tokens, start_date)
+    if not df_weight.empty:
+        write_dataset_from('weight', df_weight, since)
+        logger.info(f"{config.WEIGHT_FILE}: Data obtained from Fitbit and saved")
+    else:
+        logger.warning("No Fitbit weight data found")
 
-    # MyFitnessPal API update
+def update_mfp():
+    """MyFitnessPal API update"""
     logger.info("Starting MyFitnessPal update...")
-    try:
-        mfp_client = init_mfp()
-        get_meal_data(mfp_client, config.MFP_MEALS_FILE)
-        get_meal_daily(mfp_client, config.MFP_DAILY_FILE)
-    except Exception as e:
-        logger.error(f"Error in MyFitnessPal update: {str(e)}")
+    mfp_client = init_mfp()
+    meals_start_date, daily_start_date = get_mfp_data(mfp_client, config.MFP_MEALS_FILE, config.MFP_DAILY_FILE, client_factory=init_mfp)
+    mark_changed('mfp_meals', meals_start_date)
+    mark_changed('mfp_daily', daily_start_date)
 
-    # Garmin update
+def update_garmin():
+    """Garmin daily data, activities and the TSS metrics derived from them"""
     logger.info("Starting Garmin update...")
     logger.info("Initializing Garmin connection...")
+    email_g = os.getenv("USERNAME_G")
+    password_g = os.getenv("PASSWORD_G")
     garmin_client = init_garmin(email_g, password_g)
-    
-    if garmin_client:
-        logger.info("Getting Garmin daily data...")
-        df_garmin = get_garmin_data(garmin_client)
-        if df_garmin is not None and not df_garmin.empty:
-            df_garmin.to_csv(config.GARMIN_DAILY_FILE, index=False)
-            logger.info(f"{config.GARMIN_DAILY_FILE}: Data obtained and saved")
-        else:
-            logger.info("No new Garmin daily data to update")
-        
-        logger.info("Getting Garmin activities...")
-        df_activities = get_garmin_activities(garmin_client)
-        if df_activities is not None and not df_activities.empty:
-            df_activities.to_csv(config.GARMIN_ACTIVITIES_FILE, index=False)
-            logger.info(f"{config.GARMIN_ACTIVITIES_FILE}: Data obtained and saved")
-            
-            # Calculate TSS metrics only if we have new activities
-            logger.info("Calculating TSS metrics...")
-            df_tss = get_tss_data(df_activities)
-            if df_tss is not None and not df_tss.empty:
-                df_tss.to_csv(config.TSS_METRICS_FILE, index=False)
-                logger.info(f"{config.TSS_METRICS_FILE}: TSS metrics calculated from Garmin data")
-        else:
-            logger.info("No new Garmin activities to update")
+    if not garmin_client:
+        raise RuntimeError("Failed to initialize Garmin client")
+
+    logger.info("Getting Garmin daily data and activities...")
+    daily_start, daily_since = get_refresh_window('garmin_daily')
+    activities_start, activities_since = get_refresh_window('garmin_activities')
+    df_garmin, df_activities = get_garmin_daily_and_activities(garmin_client, daily_start, activities_start)
+    if df_garmin is not None and not df_garmin.empty:
+        write_dataset_from('garmin_daily', df_garmin, daily_since)
+        logger.info(f"{config.GARMIN_DAILY_FILE}: Data obtained and saved")
+    else:
+        logger.info("No new Garmin daily data to update")
 
-    # Glucose update
+    if df_activities is not None and not df_activities.empty:
+        write_dataset_from('garmin_activities', df_activities, activities_since)
+        logger.info(f"{config.GARMIN_ACTIVITIES_FILE}: Data obtained and saved")
+
+        # Calculate TSS metrics only if we have new activities, over the full history
+        logger.info("Calculating TSS metrics...")
+        df_all_activities = load_dataset('garmin_activities')
+        df_all_activities['date'] = df_all_activities['date'].dt.strftime('%Y-%m-%d')
+        df_tss, tss_since = get_tss_data(df_all_activities)
+        if df_tss is not None and not df_tss.empty:
+            write_dataset_from('tss_metrics', df_tss, tss_since)
+            logger.info(f"{config.TSS_METRICS_FILE}: TSS metrics calculated from Garmin data")
+    else:
+        logger.info("No new Garmin activities to update")
+
+def update_glucose():
+    """Glucose update from the LibreView export"""
     logger.info("Starting Glucose update...")
-    try:
-        libreview_file_raw = 'Data/LibreLink/AlbertoRequena Izard_glucose.csv'
-        update_incremental(libreview_file_raw, config.GLUCOSE_DAILY_FILE, get_glucose_daily)
-        get_glucose_time(libreview_file_raw).to_csv('Data/Cleaned/Glucose.csv', index=False)
-    except Exception as e:
-        logger.error(f"Error in Glucose update: {str(e)}")
+    update_glucose_data(config.LIBREVIEW_EXPORT_FILE, config.GLUCOSE_STATE_FILE)
 
-    # Replace Whoop journal update with Google Form journal update
+def update_journal():
+    """Journal update from the Google Form (and historical Whoop journal)"""
     logger.info("Starting Journal update...")
-    try:
-        df_journal = get_journal_data(config.JOURNAL_SPREADSHEET_ID)
-        if df_journal is not None:
-            df_journal.to_csv(config.WHOOP_JOURNAL_FILE, index=False)
-            logger.info(f"{config.WHOOP_JOURNAL_FILE}: Journal data obtained and saved")
-        else:
-            logger.warning("No new journal data found")
-    except Exception as e:
-        logger.error(f"Error in Journal update: {str(e)}")
+    df_journal = get_journal_data(config.JOURNAL_SPREADSHEET_ID)
+    if df_journal is not None:
+        write_dataset_changes('journal', df_journal)
+        logger.info(f"{config.WHOOP_JOURNAL_FILE}: Journal data obtained and saved")
+    else:
+        logger.warning("No new journal data found")
 
-    # Update Whoop sleep and recovery data
+def update_whoop():
+    """Whoop sleep and recovery update"""
     logger.info("Starting Whoop sleep and recovery update...")
+    un = os.getenv("USERNAME_W")
+    pw = os.getenv("PASSWORD_W")
+    if not un or not pw:
+        raise RuntimeError("Whoop credentials not found in environment variables")
+
+    client = init_whoop(un, pw)
+    if not client:
+        raise RuntimeError("Failed to initialize Whoop client")
+
+    start_date, since = get_refresh_window('sleep_recovery')
+    df = get_sleep_recovery_data(client, start_date)
+    if df is not None and not df.empty:
+        write_dataset_from('sleep_recovery', df, since)
+        logger.info(f"{config.WHOOP_SLEEP_RECOVERY_FILE}: Sleep and recovery data obtained and saved")
+    else:
+        logger.warning("No new sleep and recovery data found")
+
+# Source stages in submission order, with the stages each one must wait for.
+# Garmin -> TSS is chained inside update_garmin. Glucose reads the wake-up
+# times from the sleep file written by Whoop.
+SOURCE_STAGES = [
+    ('Fitbit', update_weight, []),
+    ('MyFitnessPal', update_mfp, []),
+    ('Garmin', update_garmin, []),
+    ('Whoop', update_whoop, []),
+    ('Glucose', update_glucose, ['Whoop']),
+    ('Journal', update_journal, []),
+]
+
+def run_stage(name, func, dependencies=None):
+    """Run one source stage, keeping failures local to the stage.
+
+    Args:
+        name (str): Stage name used in logs and in the summary
+        func (callable): Stage function, takes no arguments
+        dependencies (dict, optional): Futures of the stages this one waits for
+
+    Returns:
+        tuple: (name, success, elapsed seconds, error message or None)
+    """
+    for dep_name, dep_future in (dependencies or {}).items():
+        _, dep_ok, _, _ = dep_future.result()
+        if not dep_ok:
+            logger.warning(f"{name}: Dependency '{dep_name}' failed, running with existing data")
+
+    start = time.perf_counter()
     try:
-        # Initialize Whoop client
-        un = os.getenv("USERNAME_W")
-        pw = os.getenv("PASSWORD_W")
-        if not un or not pw:
-            logger.error("Whoop credentials not found in environment variables")
-            return
-            
-        client = init_whoop(un, pw)
-        if client:
-            df = get_sleep_recovery_data(client)
-            if df is not None:
-                df.to_csv(config.WHOOP_SLEEP_RECOVERY_FILE, index=False)
-                logger.info(f"{config.WHOOP_SLEEP_RECOVERY_FILE}: Sleep and recovery data obtained and saved")
-            else:
-                logger.warning("No new sleep and recovery data found")
-        else:
-            logger.error("Failed to initialize Whoop client")
+        func()
+        return name, True, time.perf_counter() - start, None
     except Exception as e:
-        logger.error(f"Error in Whoop sleep and recovery update: {str(e)}")
+        logger.error(f"Error in {name} update: {str(e)}")
+        return name, False, time.perf_counter() - start, str(e)
 
-    logger.info('Clean data files update completed')
+def update_clean_files(concurrent=None, max_workers=None):
+    """Update data of intermediate clean files
 
-def integrate_data():
-    """Integrate all data sources into a single file and upload to Google Sheets"""
-    
-    # Get all key dfs from Cleaned Data
-    df_t = pd.read_csv(config.TSS_METRICS_FILE)
-    df_s = pd.read_csv(config.WHOOP_SLEEP_RECOVERY_FILE)
-    df_f = pd.read_csv(config.MFP_DAILY_FILE)
-    df_g = pd.read_csv(config.GLUCOSE_DAILY_FILE)
-    df_gar = pd.read_csv(config.GARMIN_DAILY_FILE)
-    df_j = pd.read_csv(config.WHOOP_JOURNAL_FILE)
-    df_w = pd.read_csv(config.WEIGHT_FILE)
+    Args:
+        concurrent (bool, optional): Run independent sources in a thread pool.
+            Defaults to config.ETL_CONCURRENT_REFRESH.
+        max_workers (int, optional): Maximum number of sources refreshed at once.
+            Defaults to config.ETL_MAX_WORKERS.
 
-    # Filter out today from MFP per day scrapped
-    today = datetime.datetime.today().strftime('%Y-%m-%d')
-    df_f = df_f[df_f['date']!=today]
+    Returns:
+        list: (name, success, elapsed seconds, error message or None) per source
+    """
+    if concurrent is None:
+        concurrent = config.ETL_CONCURRENT_REFRESH
+    if max_workers is None:
+        max_workers = config.ETL_MAX_WORKERS
+
+    logger.info(f"Starting to update clean files ({'concurrent, ' + str(max_workers) + ' workers' if concurrent else 'sequential'})...")
+    start = time.perf_counter()
+
+    results = []
+    if concurrent:
+        # Stages are submitted in order, so a stage only ever waits on stages
+        # that were queued before it and the pool cannot deadlock
+        futures = {}
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='etl') as executor:
+            for name, func, depends_on in SOURCE_STAGES:
+                dependencies = {dep: futures[dep] for dep in depends_on}
+                futures[name] = executor.submit(run_stage, name, func, dependencies)
+            results = [future.result() for future in futures.values()]
+    else:
+        for name, func, _ in SOURCE_STAGES:
+            results.append(run_stage(name, func))
 
-    # Convert all dates to datetime for consistent filtering
-    for df in [df_t, df_s, df_f, df_g, df_gar, df_j, df_w]:
-        df['date'] = pd.to_datetime(df['date'])
+    # Report wall time per source
+    logger.info("Source refresh summary:")
+    for name, success, elapsed, error in results:
+        status = 'OK' if success else f'FAILED ({error})'
+        logger.info(f"- {name}: {elapsed:.1f}s {status}")
+    log_cache_stats()
+    prune_caches()
+    logger.info(f'Clean data files update completed in {time.perf_counter() - start:.1f}s')
+
+    return results
+
+# Sources of the integrated data, in column order: (dataset, columns to drop, columns to rename)
+INTEGRATION_SOURCES = [
+    ('tss_metrics', [], {}),
+    ('sleep_recovery', ['sleep_id'], {}),
+    ('mfp_daily', [], {}),
+    ('glucose_daily', [], {}),
+    ('garmin_daily', ['tss'], {}),
+    ('journal', [], {}),
+    ('weight', [], {'fat': 'body_fat'}),
+]
+INTEGRATION_LABELS = {
+    'tss_metrics': 'TSS metrics',
+    'sleep_recovery': 'Sleep and recovery',
+    'mfp_daily': 'MFP per day scrapped',
+    'glucose_daily': 'Glucose daily',
+    'garmin_daily': 'Garmin daily',
+    'journal': 'Journal',
+    'weight': 'Weight',
+}
+
+def build_integrated_data(storage, start_date, end_date=None):
+    """Join and clean the integrated data between two dates.
     
-    # Filter all data to start from config start date
-    start_date = pd.to_datetime(config.DATA_START_DATE)
-    df_t = df_t[df_t['date'] >= start_date]
-    df_s = df_s[df_s['date'] >= start_date]
-    df_f = df_f[df_f['date'] >= start_date]
-    df_g = df_g[df_g['date'] >= start_date]
-    df_gar = df_gar[df_gar['date'] >= start_date]
-    df_j = df_j[df_j['date'] >= start_date]
-    df_w = df_w[df_w['date'] >= start_date]
-
-    # Print the min and the max date of each df
-    print('\nData ranges:')
-    print('TSS metrics: ', df_t['date'].min().strftime('%Y-%m-%d'),' to ',df_t['date'].max().strftime('%Y-%m-%d'))
-    print('Sleep and recovery: ',df_s['date'].min().strftime('%Y-%m-%d'),' to ',df_s['date'].max().strftime('%Y-%m-%d'))
-    print('MFP per day scrapped: ',df_f['date'].min().strftime('%Y-%m-%d'),' to ',df_f['date'].max().strftime('%Y-%m-%d'))
-    print('Glucose daily: ',df_g['date'].min().strftime('%Y-%m-%d'),' to ',df_g['date'].max().strftime('%Y-%m-%d'))
-    print('Garmin daily: ',df_gar['date'].min().strftime('%Y-%m-%d'),' to ',df_gar['date'].max().strftime('%Y-%m-%d'))
-    print('Journal: ',df_j['date'].min().strftime('%Y-%m-%d'),' to ',df_j['date'].max().strftime('%Y-%m-%d'))
-    print('Weight: ',df_w['date'].min().strftime('%Y-%m-%d'),' to ',df_w['date'].max().strftime('%Y-%m-%d'))
-
-    # Clean up column names and remove duplicates
-    # Rename fat to body_fat in weight data if not already renamed
-    if 'fat' in df_w.columns:
-        df_w = df_w.rename(columns={'fat': 'body_fat'})
+    Every step only looks at the row of its own date, so a date range can be
+    rebuilt on its own.
     
-    # Remove redundant columns
-    if 'tss' in df_gar.columns:
-        df_gar = df_gar.drop(columns=['tss'])
-    if 'sleep_id' in df_s.columns:
-        df_s = df_s.drop(columns=['sleep_id'])
+    Args:
+        storage (Storage): Backend the sources are read from
+        start_date: First date to build
+        end_date (optional): Last date to build, None for the last date of any source
+        
+    Returns:
+        pd.DataFrame: Integrated data with dates as YYYY-MM-DD
+    """
+    # Outer join all sources on date in one read.
+    # The redundant Garmin TSS and the Whoop sleep id are left out.
+    df = storage.read_joined(INTEGRATION_SOURCES, start_date=start_date, end_date=end_date)
+
+    # Filter out today from MFP per day scrapped
+    today = pd.Timestamp(datetime.date.today())
+    mfp_cols = [col for col in storage.columns('mfp_daily') if col != 'date']
+    df.loc[df['date'] == today, mfp_cols] = None
 
     # Standardize journal responses
     def standardize_response(x):
@@ -194,113 +255,109 @@ def integrate_data():
             return 'No'
         return ''
 
-    for col in df_j.columns:
+    for col in storage.columns('journal'):
         if col not in ['date', 'Timestamp', 'drinks']:
-            df_j[col] = df_j[col].apply(standardize_response)
-
-    # Perform an outer join on all dfs
-    df = df_t.merge(df_s, on='date', how='outer')
-    df = df.merge(df_f, on='date', how='outer')
-    df = df.merge(df_g, on='date', how='outer')
-    df = df.merge(df_gar, on='date', how='outer')
-    df = df.merge(df_j, on='date', how='outer')
-    df = df.merge(df_w, on='date', how='outer')
+            df[col] = df[col].where(df[col].isna(), df[col].apply(standardize_response))
 
     # Sort by date
     df = df.sort_values('date')
     
-    # Format decimal places for different metric types
-    
-    # Sleep metrics (2 decimals for durations, 0 for scores)
-    sleep_duration_cols = ['sleep_duration', 'sleep_rem', 'sleep_deep', 'sleep_light', 'sleep_awake']
-    sleep_score_cols = ['sleep_score_performance', 'sleep_score_consistency', 'sleep_score_efficiency']
-    
-    for col in sleep_duration_cols:
-        if col in df.columns:
-            df[col] = df[col].round(2)
-    
-    for col in sleep_score_cols:
-        if col in df.columns:
-            df[col] = df[col].round(0)
-    
-    # Recovery metrics
-    if 'recovery_score' in df.columns:
-        df['recovery_score'] = df['recovery_score'].round(0)
-    if 'resting_hr' in df.columns:
-        df['resting_hr'] = df['resting_hr'].round(0)
-    if 'hrv' in df.columns:
-        df['hrv'] = df['hrv'].round(0)
-    if 'spo2' in df.columns:
-        df['spo2'] = df['spo2'].round(1)
-    if 'skin_temp' in df.columns:
-        df['skin_temp'] = df['skin_temp'].round(1)
-    
-    # Training metrics
-    if 'training_load' in df.columns:
-        df['training_load'] = df['training_load'].round(0)
-    if 'intensity' in df.columns:
-        df['intensity'] = df['intensity'].round(2)
-    if 'duration' in df.columns:
-        df['duration'] = df['duration'].round(0)
-    if 'strength_minutes' in df.columns:
-        df['strength_minutes'] = df['strength_minutes'].round(0)
-    
-    # Weight and nutrition metrics (1 decimal for weight and body fat, 0 for calories/macros)
-    if 'weight' in df.columns:
-        df['weight'] = df['weight'].round(1)
-    if 'bmi' in df.columns:
-        df['bmi'] = df['bmi'].round(1)
-    if 'body_fat' in df.columns:
-        df['body_fat'] = df['body_fat'].round(1)
-    
-    nutrition_cols = ['calories', 'protein', 'carbs', 'fat', 'sodium', 'sugar', 
-                     'calories_consumed', 'calories_goal', 'calories_net',
-                     'calories_consumed_breakfast', 'calories_consumed_lunch',
-                     'calories_consumed_dinner', 'calories_consumed_snacks']
-    for col in nutrition_cols:
-        if col in df.columns:
-            df[col] = df[col].round(0)
-    
-    # Glucose metrics (0 decimals for glucose values, 1 decimal for percentages)
-    glucose_cols = ['mean_glucose', 'std_glucose', 'max_glucose', 'wake_up_glucose']
-    glucose_pct_cols = ['time_in_range', 'time_above_range', 'time_below_range']
-    
-    for col in glucose_cols:
-        if col in df.columns:
-            df[col] = df[col].round(0)
-    
-    for col in glucose_pct_cols:
-        if col in df.columns:
-            df[col] = df[col].round(1)
-            
-    # Stress metrics (1 decimal for percentages)
-    stress_pct_cols = ['restStressPercentage', 'lowStressPercentage', 
-                      'mediumStressPercentage', 'highStressPercentage']
-    for col in stress_pct_cols:
-        if col in df.columns:
-            df[col] = df[col].round(1)
-            
-    # Body battery metrics (0 decimals)
-    battery_cols = ['bodyBatteryHighestValue', 'bodyBatteryLowestValue', 'bodyBatteryDuringSleep']
-    for col in battery_cols:
-        if col in df.columns:
-            df[col] = df[col].round(0)
-            
-    # TSS metrics (1 decimal)
-    tss_cols = ['TSS', 'CTL', 'ATL', 'TSB']
-    for col in tss_cols:
-        if col in df.columns:
-            df[col] = df[col].round(1)
+    # Round the metrics and cast them to their dtypes
+    df = apply_metrics_schema(df)
     
     # Convert back to string format for date
     df['date'] = df['date'].dt.strftime('%Y-%m-%d')
     
     # Remove any empty rows (where all columns except date are NaN)
-    df = df.dropna(how='all', subset=df.columns.difference(['date']))
+    return df.dropna(how='all', subset=df.columns.difference(['date']))
+
+def get_dirty_ranges(storage, names):
+    """Get the date ranges of the integrated data to rebuild after its sources changed.
+    
+    The ranges changed in each source are merged where they overlap or touch.
+    The last integrated day is always rebuilt, as its MFP data was left out
+    while it was today.
+    
+    Args:
+        storage (Storage): Backend the data is stored in
+        names (list): Source dataset names
+        
+    Returns:
+        list: (start, end) Timestamps sorted by date, end None for the last
+        range if it is open, or None if every date must be rebuilt
+    """
+    if not storage.exists('integrated'):
+        return None
+    _, last_date = storage.date_range('integrated')
+    if last_date is None:
+        return None
+
+    changes = get_pending_changes(names)
+    for name, (start, end) in changes.items():
+        if start is None:
+            print(f"{INTEGRATION_LABELS[name]} changed: all dates")
+        else:
+            print(f"{INTEGRATION_LABELS[name]} changed: ", start.strftime('%Y-%m-%d'), ' to ', end.strftime('%Y-%m-%d') if end is not None else 'the end')
+    ranges = list(changes.values()) + [(last_date, None)]
+    if any(start is None for start, _ in ranges):
+        return None
+
+    # Merge the ranges, an end of None being open
+    first_date = pd.Timestamp(config.DATA_START_DATE)
+    merged = []
+    for start, end in sorted(ranges, key=lambda r: r[0]):
+        start = max(start, first_date)
+        if end is not None and end < start:
+            continue
+        if merged and (merged[-1][1] is None or start <= merged[-1][1] + pd.Timedelta(days=1)):
+            previous_start, previous_end = merged[-1]
+            merged[-1] = (previous_start, None if previous_end is None or end is None else max(previous_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def integrate_data(incremental=None):
+    """Integrate all data sources into a single file and upload to Google Sheets
+    
+    Args:
+        incremental (bool, optional): Only rebuild the dates whose sources changed
+            since the last integration. Defaults to config.INTEGRATION_INCREMENTAL.
+    """
+    if incremental is None:
+        incremental = config.INTEGRATION_INCREMENTAL
+    storage = get_storage()
+    names = [name for name, _, _ in INTEGRATION_SOURCES]
 
-    # Save to CSV
-    df.to_csv('Data/Cleaned/Integrated_data.csv', index=False)
-    print('\nIntegrated data file created: ',df['date'].min(),' to ',df['date'].max())
+    # Print the min and the max date of each source
+    print('\nData ranges:')
+    for name in names:
+        first, last = storage.date_range(name)
+        if first is not None:
+            first = max(first, pd.Timestamp(config.DATA_START_DATE))
+            print(f"{INTEGRATION_LABELS[name]}: ", first.strftime('%Y-%m-%d'), ' to ', last.strftime('%Y-%m-%d'))
+
+    dirty_ranges = get_dirty_ranges(storage, names) if incremental else None
+    if dirty_ranges is not None:
+        slices = [(start, end, build_integrated_data(storage, start, end)) for start, end in dirty_ranges]
+        if any(list(df_slice.columns) != storage.columns('integrated') for _, _, df_slice in slices):
+            logger.info("Integrated data columns changed, rebuilding all dates")
+            dirty_ranges = None
+
+    if dirty_ranges is None:
+        df = build_integrated_data(storage, config.DATA_START_DATE)
+        save_dataset('integrated', df)
+        print('\nIntegrated data file created: ',df['date'].min(),' to ',df['date'].max())
+    else:
+        # Replace the rebuilt ranges, including dates no longer in the data
+        for start, end, df_slice in slices:
+            delete_dataset_range('integrated', start, end)
+            if not df_slice.empty:
+                upsert_dataset('integrated', df_slice)
+            print('\nIntegrated data rebuilt: ', start.strftime('%Y-%m-%d'), ' to ',
+                  end.strftime('%Y-%m-%d') if end is not None else df_slice['date'].max())
+        df = load_dataset('integrated')
+        df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+    clear_pending_changes(names)
 
     # Export DataFrame to Google Sheets
     print('\nUploading to Google Sheets...')
@@ -317,7 +374,7 @@ if __name__ == "__main__":
     print("\nCreating dashboard data...")
     dashboard_df = create_dashboard_data()
     if dashboard_df is not None:
-        dashboard_df.to_csv(config.DASHBOARD_DATA_PATH, index=False)
+        save_dataset('dashboard', dashboard_df)
         print(f"Dashboard data saved to {config.DASHBOARD_DATA_PATH}")
 
         # Export DataFrame to Google Sheets
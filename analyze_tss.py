@@ -6,6 +6,7 @@ from datetime import datetime
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import r2_score
 import shap
+from ETL.ETL_tss_calculation import TSS_FEATURES
 
 # Load the data
 df_garmin = pd.read_csv('Data/Cleaned/garmin_activities.csv')
@@ -129,6 +130,16 @@ for category, result in results.items():
         print(result['feature_importance'].sort_values('shap_importance', ascending=False))
         print("\n" + "="*50)
 
+# Print the fitted formulas as a coefficient table, ready to replace
+# TSS_COEFFICIENTS in ETL/ETL_tss_calculation.py
+coefficients = pd.DataFrame({
+    category: {'intercept': result['model'].intercept_,
+               **dict(zip(result['feature_importance']['feature'], result['model'].coef_))}
+    for category, result in results.items() if result
+}).T.reindex(columns=TSS_FEATURES).fillna(0)
+print("\nTSS coefficient table:")
+print(coefficients.round(4).to_string())
+
 # Plot actual vs predicted values for each category
 plt.figure(figsize=(15, 5))
 for i, (category, result) in enumerate(results.items()):
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import random
+import logging
+import datetime
+import tempfile
+from ETL import config
+from ETL.ETL_mfp_api import get_mfp_data
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+DAYS = 120          # Backfill length
+LATENCY = 0.05      # Seconds per diary page
+FAILURE_RATE = 0.05 # Share of requests failing with a transient error
+
+class FakeEntry:
+    def __init__(self, name, calories):
+        self.name = name
+        self.quantity = 1
+        self.nutrition_information = {'calories': calories, 'carbohydrates': calories / 10, 'fat': calories / 30,
+                                      'protein': calories / 20, 'sodium': 100, 'sugar': calories / 40}
+
+class FakeMeal:
+    def __init__(self, name, entries):
+        self.name = name
+        self.entries = entries
+        self.totals = {'calories': sum(e.nutrition_information['calories'] for e in entries)}
+
+class FakeDay:
+    def __init__(self, date):
+        rng = random.Random(date.toordinal())
+        self.meals = [
+            FakeMeal(name, [FakeEntry(f'{name} food {i}', rng.randint(50, 600)) for i in range(rng.randint(0, 4))])
+            for name in ['breakfast', 'lunch', 'dinner', 'snacks']
+        ]
+        entries = [e for meal in self.meals for e in meal.entries]
+        self.totals = {key: sum(e.nutrition_information[key] for e in entries)
+                       for key in ['calories', 'carbohydrates', 'fat', 'protein', 'sodium', 'sugar']}
+        self.goals = {'calories': 2500}
+        self.exercises = []
+
+class FakeMFPClient:
+    """Offline stand-in for myfitnesspal.Client with fixed latency and random transient failures."""
+    def __init__(self, latency=LATENCY, failure_rate=FAILURE_RATE):
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+    def get_date(self, year, month, day):
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise ConnectionError('Simulated transient failure')
+        return FakeDay(datetime.date(year, month, day))
+
+def run(pool_size):
+    """Backfill DAYS days into empty files in a scratch directory; return (seconds, meals file content)."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        # The response cache lives under the working directory, so each run starts cold
+        os.chdir(tmp)
+        try:
+            meals_file = os.path.join(tmp, 'meals.csv')
+            daily_file = os.path.join(tmp, 'daily.csv')
+            config.DATA_START_DATE = datetime.date.today() - datetime.timedelta(days=DAYS - 1)
+            start = time.perf_counter()
+            client_factory = FakeMFPClient
+            get_mfp_data(client_factory(), meals_file, daily_file,
+                         client_factory=client_factory, pool_size=pool_size)
+            elapsed = time.perf_counter() - start
+            with open(meals_file, encoding='utf-8') as f:
+                return elapsed, f.read()
+        finally:
+            os.chdir(cwd)
+
+def main():
+    """Compare sequential and pooled MFP backfills against the fake client."""
+    config.MFP_REQUESTS_PER_SECOND = 100
+    config.MFP_MAX_RETRIES = 5
+    config.MFP_RETRY_DELAY = 0.1
+    logger.info(f"Backfilling {DAYS} days, {LATENCY * 1000:.0f}ms per page, {FAILURE_RATE:.0%} transient failures")
+
+    sequential_time, sequential_meals = None, None
+    for pool_size in [1, 4, 8]:
+        elapsed, meals = run(pool_size)
+        if pool_size == 1:
+            sequential_time, sequential_meals = elapsed, meals
+        same = 'identical' if meals == sequential_meals else 'DIFFERENT'
+        logger.info(f"Pool size {pool_size}: {elapsed:.2f}s ({sequential_time / elapsed:.1f}x), output {same}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import time
+import logging
+import numpy as np
+import pandas as pd
+from ETL.ETL_tss_calculation import exponential_load
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+YEARS = 10
+
+def make_synthetic_tss(years=YEARS, seed=42):
+    """Daily TSS for `years` years: ~30% rest days, the rest spread around 80."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2015-01-01', periods=int(365.25 * years), freq='D')
+    tss = rng.gamma(shape=4, scale=20, size=len(dates))
+    tss[rng.random(len(dates)) < 0.3] = 0
+    return pd.DataFrame({'date': dates.strftime('%Y-%m-%d'), 'TSS': np.round(tss, 1)})
+
+def legacy_ctl_atl(daily_data):
+    """CTL/ATL loop as it was in calculate_tss, cell by cell with iloc."""
+    ctl_decay = np.exp(-1/42)
+    atl_decay = np.exp(-1/7)
+
+    daily_data = daily_data.sort_values('date')
+    daily_data['CTL'] = 0.0
+    daily_data['ATL'] = 0.0
+
+    if len(daily_data) > 0:
+        daily_data.iloc[0, daily_data.columns.get_loc('CTL')] = float(daily_data['TSS'].iloc[0])
+        daily_data.iloc[0, daily_data.columns.get_loc('ATL')] = float(daily_data['TSS'].iloc[0])
+
+    for i in range(1, len(daily_data)):
+        prev_ctl = daily_data.iloc[i-1]['CTL']
+        prev_atl = daily_data.iloc[i-1]['ATL']
+        tss = daily_data.iloc[i]['TSS']
+
+        daily_data.iloc[i, daily_data.columns.get_loc('CTL')] = (prev_ctl * ctl_decay) + (tss * (1 - ctl_decay))
+        daily_data.iloc[i, daily_data.columns.get_loc('ATL')] = (prev_atl * atl_decay) + (tss * (1 - atl_decay))
+
+    return daily_data
+
+def vectorized_ctl_atl(daily_data):
+    """CTL/ATL as computed by calculate_tss now."""
+    daily_data = daily_data.sort_values('date')
+    tss = daily_data['TSS'].to_numpy(dtype=float)
+    daily_data['CTL'] = exponential_load(tss, 42)
+    daily_data['ATL'] = exponential_load(tss, 7)
+    return daily_data
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    """Compare the legacy and vectorized CTL/ATL paths on synthetic data."""
+    daily_data = make_synthetic_tss()
+    logger.info(f"Synthetic data: {len(daily_data)} days ({YEARS} years)")
+
+    legacy, legacy_time = timed(legacy_ctl_atl, daily_data.copy())
+    vectorized, vectorized_time = timed(vectorized_ctl_atl, daily_data.copy())
+
+    # Output is rounded to 1 decimal in calculate_tss, so that is what must match
+    for col in ['CTL', 'ATL']:
+        max_diff = (legacy[col] - vectorized[col]).abs().max()
+        mismatches = (legacy[col].round(1) != vectorized[col].round(1)).sum()
+        logger.info(f"{col}: max abs difference {max_diff:.2e}, {mismatches} days differ at 1 decimal")
+
+    logger.info(f"Legacy iloc loop: {legacy_time:.3f}s")
+    logger.info(f"Vectorized:       {vectorized_time:.4f}s ({legacy_time / vectorized_time:.0f}x faster)")
+
+if __name__ == "__main__":
+    main()
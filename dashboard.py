@@ -6,6 +6,7 @@ from Dashboard.helpers import get_status_color, format_value, format_trend
 from Dashboard.metrics import calculate_summary
 from Dashboard.charts import create_performance_chart, create_recovery_charts, create_nutrition_chart, create_daily_view_chart
 from Dashboard.llm import load_model, generate_insights
+from ETL.ETL_storage import load_dataset
 
 
 # Custom CSS to make the entire dashboard wider, increase the font size, and enlarge the colored dots
@@ -40,12 +41,9 @@ st.markdown(
 )
 
 # Load data
-data = pd.read_csv('Data/Cleaned/Integrated_data.csv')
-data['date'] = pd.to_datetime(data['date'])
-glucose_data = pd.read_csv('Data/Cleaned/Glucose.csv')
-glucose_data['date'] = pd.to_datetime(glucose_data['date'])
-meals = pd.read_csv('Data/Cleaned/MFP meals scrapped.csv')
-meals['date'] = pd.to_datetime(meals['date'])
+data = load_dataset('integrated')
+glucose_data = load_dataset('glucose')
+meals = load_dataset('mfp_meals')
 
 # Map column names to human-readable names
 data.rename(columns=column_name_mapping, inplace=True)
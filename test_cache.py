@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import logging
+import datetime
+import tempfile
+from ETL.ETL_cache import ResponseCache
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+POLICY = {'immutable_after_days': 10, 'recent_ttl': 3600}
+
+class FakeAPI:
+    """Counts calls and returns a numbered response."""
+    def __init__(self):
+        self.calls = 0
+
+    def fetch(self):
+        self.calls += 1
+        return {'call': self.calls}
+
+def set_written(path, written):
+    """Backdate the modification time of a cache entry."""
+    timestamp = time.mktime(written.timetuple())
+    os.utime(path, (timestamp, timestamp))
+
+def test_recent_entry_expires_after_ttl():
+    """Entries for recent days are reused within recent_ttl and refetched after it."""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache, api = ResponseCache('test', cache_dir=tmp, policy=POLICY), FakeAPI()
+        today = datetime.date.today()
+        cache.get('stats', today, api.fetch)
+        assert cache.get('stats', today, api.fetch) == {'call': 1}
+        path = os.path.join(tmp, 'test', 'stats', f"{today:%Y-%m-%d}.json")
+        set_written(path, datetime.datetime.now() - datetime.timedelta(hours=2))
+        assert cache.get('stats', today, api.fetch) == {'call': 2}
+
+def test_settled_entry_is_immutable():
+    """An entry written immutable_after_days after its day is never refetched."""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache, api = ResponseCache('test', cache_dir=tmp, policy=POLICY), FakeAPI()
+        day = datetime.date.today() - datetime.timedelta(days=30)
+        cache.get('stats', day, api.fetch)
+        path = os.path.join(tmp, 'test', 'stats', f"{day:%Y-%m-%d}.json")
+        set_written(path, datetime.datetime.combine(day + datetime.timedelta(days=10), datetime.time()))
+        assert cache.get('stats', day, api.fetch) == {'call': 1}
+
+def test_partial_day_entry_is_refetched():
+    """An entry written while its day was in progress is refetched, however old the day gets."""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache, api = ResponseCache('test', cache_dir=tmp, policy=POLICY), FakeAPI()
+        day = datetime.date.today() - datetime.timedelta(days=30)
+        cache.get('stats', day, api.fetch)
+        path = os.path.join(tmp, 'test', 'stats', f"{day:%Y-%m-%d}.json")
+        set_written(path, datetime.datetime.combine(day, datetime.time(12)))
+        assert cache.get('stats', day, api.fetch) == {'call': 2}
+        # The refetched entry was written long after the day, so it is now immutable
+        assert cache.get('stats', day, api.fetch) == {'call': 2}
+
+def test_recent_range_expires_after_ttl():
+    """Ranges ending recently are reused within recent_ttl and refetched after it."""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache, api = ResponseCache('test', cache_dir=tmp, policy=POLICY), FakeAPI()
+        today = datetime.date.today()
+        start = today - datetime.timedelta(days=30)
+        assert cache.get_range('sleep', start, today, api.fetch) == {'call': 1}
+        assert cache.get_range('sleep', start, today, api.fetch) == {'call': 1}
+        path = os.path.join(tmp, 'test', 'sleep', f"{start}_{today}.json")
+        set_written(path, datetime.datetime.now() - datetime.timedelta(hours=2))
+        assert cache.get_range('sleep', start, today, api.fetch) == {'call': 2}
+
+def test_settled_range_is_cached():
+    """Ranges ending before immutable_after_days are cached under a start_end key."""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache, api = ResponseCache('test', cache_dir=tmp, policy=POLICY), FakeAPI()
+        end = datetime.date.today() - datetime.timedelta(days=30)
+        start = end - datetime.timedelta(days=30)
+        cache.get_range('activities', start, end, api.fetch)
+        assert cache.get_range('activities', start, end, api.fetch) == {'call': 1}
+        assert os.path.exists(os.path.join(tmp, 'test', 'activities', f"{start}_{end}.json"))
+
+def test_prune_removes_stale_entries():
+    """Pruning deletes entries that would be refetched and keeps fresh and immutable ones."""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache, api = ResponseCache('test', cache_dir=tmp, policy=POLICY), FakeAPI()
+        today = datetime.date.today()
+        old_day = today - datetime.timedelta(days=30)
+        cache.get('stats', today, api.fetch)
+        cache.get('stats', old_day, api.fetch)
+        cache.get('stats', old_day - datetime.timedelta(days=1), api.fetch)
+        stats_dir = os.path.join(tmp, 'test', 'stats')
+        set_written(os.path.join(stats_dir, f"{old_day}.json"), datetime.datetime.combine(old_day, datetime.time(12)))
+        # A range entry of the previous day, whose key the next run no longer uses
+        stale_range = os.path.join(tmp, 'test', 'sleep', f"{old_day}_{today - datetime.timedelta(days=1)}.json")
+        cache.get_range('sleep', old_day, today - datetime.timedelta(days=1), api.fetch)
+        set_written(stale_range, datetime.datetime.now() - datetime.timedelta(days=1))
+        assert cache.prune() == 2
+        assert sorted(os.listdir(stats_dir)) == sorted([f"{today}.json", f"{old_day - datetime.timedelta(days=1)}.json"])
+        assert not os.path.exists(stale_range)
+
+def main():
+    """Run the response cache tests."""
+    tests = [value for name, value in globals().items() if name.startswith('test_')]
+    for test in tests:
+        test()
+        logger.info(f"{test.__name__}: OK")
+    logger.info(f"All {len(tests)} tests passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import os
+import logging
+import datetime
+import tempfile
+import pandas as pd
+from ETL import ETL_general, ETL_storage
+from ETL.ETL_general import get_most_recent_date, delete_data_from_date, load_date_index, append_rows, find_tail_offset
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class DateColumnScans:
+    """Count the full reads of the date column made by get_most_recent_date."""
+    def __enter__(self):
+        self.count = 0
+        self.read_csv = ETL_general.pd.read_csv
+        def counting_read_csv(*args, **kwargs):
+            if kwargs.get('usecols') is not None and kwargs.get('nrows') is None:
+                self.count += 1
+            return self.read_csv(*args, **kwargs)
+        ETL_general.pd.read_csv = counting_read_csv
+        return self
+
+    def __exit__(self, *exc):
+        ETL_general.pd.read_csv = self.read_csv
+
+def make_data(start, days):
+    return pd.DataFrame({
+        'date': pd.date_range(start, periods=days).strftime('%Y-%m-%d'),
+        'value': range(days),
+    })
+
+def write_file(tmp, df):
+    path = os.path.join(tmp, 'data.csv')
+    df.to_csv(path, index=False)
+    return path
+
+def test_unchanged_file_uses_index():
+    """The first lookup scans the file; later lookups of the same file read nothing."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_file(tmp, make_data('2024-01-01', 100))
+        with DateColumnScans() as scans:
+            assert get_most_recent_date(path) == datetime.date(2024, 4, 9)
+            assert get_most_recent_date(path) == datetime.date(2024, 4, 9)
+        assert scans.count == 1
+        assert load_date_index(path)['sorted']
+
+def test_daily_cycle_never_scans():
+    """Truncating the last day and re-appending it, as the MFP stage does, keeps the index usable."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_file(tmp, make_data('2024-01-01', 100))
+        get_most_recent_date(path)
+        with DateColumnScans() as scans:
+            for day in range(3):
+                last_date = get_most_recent_date(path)
+                delete_data_from_date(path, last_date)
+                assert get_most_recent_date(path) == last_date - datetime.timedelta(days=1)
+                append_rows(path, make_data(last_date, 2 + day))
+                assert get_most_recent_date(path) == last_date + datetime.timedelta(days=1 + day)
+        assert scans.count == 0
+        df = pd.read_csv(path)
+        assert df['date'].is_monotonic_increasing and not df['date'].duplicated().any()
+
+def test_rewritten_file_is_scanned():
+    """A file rewritten out of order, even if it grew, is scanned again and flagged unsorted."""
+    with tempfile.TemporaryDirectory() as tmp:
+        df = make_data('2024-01-01', 100)
+        path = write_file(tmp, df)
+        get_most_recent_date(path)
+        df.loc[10, 'date'] = '2025-01-01'
+        pd.concat([df, make_data('2024-04-10', 1)]).to_csv(path, index=False)
+        with DateColumnScans() as scans:
+            assert get_most_recent_date(path) == datetime.date(2025, 1, 1)
+        assert scans.count == 1
+        assert not load_date_index(path)['sorted']
+
+def test_shrunk_file_is_scanned():
+    """A file that got shorter without a truncation through delete_data_from_date is scanned again."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_file(tmp, make_data('2024-01-01', 100))
+        get_most_recent_date(path)
+        write_file(tmp, make_data('2024-01-01', 50))
+        with DateColumnScans() as scans:
+            assert get_most_recent_date(path) == datetime.date(2024, 2, 19)
+        assert scans.count == 1
+
+def test_csv_date_range_uses_index():
+    """CsvStorage.date_range reads the first row and the date index of sorted files."""
+    original_path = ETL_storage.DATASETS['weight']['path']
+    with tempfile.TemporaryDirectory() as tmp:
+        ETL_storage.DATASETS['weight']['path'] = write_file(tmp, make_data('2024-01-01', 100).rename(columns={'value': 'weight'}))
+        try:
+            storage = ETL_storage.CsvStorage()
+            with DateColumnScans() as scans:
+                assert storage.date_range('weight') == (pd.Timestamp('2024-01-01'), pd.Timestamp('2024-04-09'))
+                assert storage.date_range('weight') == (pd.Timestamp('2024-01-01'), pd.Timestamp('2024-04-09'))
+            assert scans.count == 1
+        finally:
+            ETL_storage.DATASETS['weight']['path'] = original_path
+
+def write_rows(tmp, dates, newline='\n'):
+    path = os.path.join(tmp, 'rows.csv')
+    with open(path, 'w', newline='') as f:
+        f.write(newline.join(['date,value'] + [f"{date},{i}" for i, date in enumerate(dates)]) + newline)
+    return path
+
+def test_tail_offset_small_chunks():
+    """With chunks smaller than a row, the offset is the start of the first row on or after the date."""
+    with tempfile.TemporaryDirectory() as tmp:
+        for newline in ['\n', '\r\n']:
+            dates = pd.date_range('2024-01-01', periods=40).strftime('%Y-%m-%d').tolist()
+            path = write_rows(tmp, dates, newline)
+            with open(path, 'rb') as f:
+                content = f.read()
+            expected = content.index(b'2024-01-29')
+            for chunk_size in [5, 13, 30, 1024]:
+                assert find_tail_offset(path, '2024-01-29', chunk_size=chunk_size) == expected
+            assert find_tail_offset(path, '2024-03-01', chunk_size=7) == len(content)
+            assert find_tail_offset(path, '2023-12-01', chunk_size=7) == len(b'date,value' + newline.encode())
+
+def test_tail_offset_checks_row_before_boundary():
+    """The row preceding the first row before the date is part of the order check."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_rows(tmp, ['2024-01-29', '2024-01-28', '2024-01-31'])
+        assert find_tail_offset(path, '2024-01-29', chunk_size=30) is None
+
+def test_unsorted_file_is_rewritten():
+    """A file unsorted far from its end is not truncated in place: every row from the date is deleted."""
+    with tempfile.TemporaryDirectory() as tmp:
+        for newline in ['\n', '\r\n']:
+            # Ten rows a day, with a misplaced row near the top, far from the rows deleted
+            dates = pd.date_range('2018-01-01', '2024-02-04').strftime('%Y-%m-%d').repeat(10).tolist()
+            dates = dates[:5] + ['2024-01-29'] + dates[5:]
+            path = write_rows(tmp, dates, newline)
+            assert os.path.getsize(path) > 300 * 1024
+            delete_data_from_date(path, '2024-01-20')
+            df = pd.read_csv(path)
+            assert len(df) == len([date for date in dates if date < '2024-01-20'])
+            assert (df['date'] < '2024-01-20').all()
+
+def test_sorted_file_is_truncated_in_place():
+    """A sorted file keeps its rows before the date byte for byte, including CRLF line endings."""
+    with tempfile.TemporaryDirectory() as tmp:
+        dates = pd.date_range('2024-01-01', periods=40).strftime('%Y-%m-%d').tolist()
+        path = write_rows(tmp, dates, '\r\n')
+        with open(path, 'rb') as f:
+            content = f.read()
+        delete_data_from_date(path, '2024-01-29')
+        with open(path, 'rb') as f:
+            assert f.read() == content[:content.index(b'2024-01-29')]
+        assert get_most_recent_date(path) == datetime.date(2024, 1, 28)
+
+def main():
+    """Run the date index tests."""
+    tests = [value for name, value in globals().items() if name.startswith('test_')]
+    for test in tests:
+        test()
+        logger.info(f"{test.__name__}: OK")
+    logger.info(f"All {len(tests)} tests passed")
+
+if __name__ == "__main__":
+    main()
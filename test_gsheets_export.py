@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import logging
+import tempfile
+import pandas as pd
+from ETL import ETL_general
+from ETL.ETL_general import export_to_gsheets, get_sheets_service
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+SHEET = 'Integrated_data'
+
+class StubRequest:
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+class StubSheetsService:
+    """Local stand-in for the Sheets API service, holding the sheet cells and recording calls."""
+    def __init__(self):
+        self.cells = {}
+        self.calls = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def write(self, range_name, values):
+        # Ranges look like 'Sheet!A5:ZA9'; only the first row number is needed
+        first_row = int(''.join(c for c in range_name.split('!')[1].split(':')[0] if c.isdigit()))
+        for i, row in enumerate(values):
+            for j, value in enumerate(row):
+                self.cells[(first_row + i, j + 1)] = value
+        return sum(len(row) for row in values)
+
+    def clear(self, spreadsheetId, range):
+        self.calls.append(('clear', range))
+        self.cells = {}
+        return StubRequest({})
+
+    def update(self, spreadsheetId, valueInputOption, range, body):
+        self.calls.append(('update', range))
+        return StubRequest({'updatedCells': self.write(range, body['values'])})
+
+    def batchUpdate(self, spreadsheetId, body):
+        self.calls.append(('batchUpdate', [data['range'] for data in body['data']]))
+        return StubRequest({'totalUpdatedCells': sum(self.write(data['range'], data['values']) for data in body['data'])})
+
+    def table(self):
+        """Return the non-empty rows of the sheet."""
+        rows = max(row for row, _ in self.cells)
+        columns = max(column for _, column in self.cells)
+        table = [[self.cells.get((row, column), '') for column in range(1, columns + 1)] for row in range(1, rows + 1)]
+        return [row for row in table if any(value != '' for value in row)]
+
+def make_data(days):
+    return pd.DataFrame({
+        'date': pd.date_range('2024-03-16', periods=days).strftime('%Y-%m-%d'),
+        'weight': [80.0 + i / 10 for i in range(days)],
+        'steps': [None if i % 7 == 0 else 8000 + i for i in range(days)],
+    })
+
+def expected_table(df):
+    return [df.columns.tolist()] + df.fillna('').values.tolist()
+
+def test_first_export_uploads_everything():
+    """Without a snapshot, the sheet is cleared and fully uploaded."""
+    service = StubSheetsService()
+    with tempfile.TemporaryDirectory() as tmp:
+        df = make_data(30)
+        assert export_to_gsheets(df, SHEET, service=service, snapshot_dir=tmp)
+        assert [call[0] for call in service.calls] == ['clear', 'update']
+        assert service.table() == expected_table(df)
+
+def test_unchanged_export_sends_nothing():
+    """Exporting the same data again makes no API calls."""
+    service = StubSheetsService()
+    with tempfile.TemporaryDirectory() as tmp:
+        df = make_data(30)
+        export_to_gsheets(df, SHEET, service=service, snapshot_dir=tmp)
+        service.calls = []
+        assert export_to_gsheets(df, SHEET, service=service, snapshot_dir=tmp)
+        assert service.calls == []
+
+def test_changed_rows_sent_in_one_batch():
+    """Changed and new rows are sent as grouped ranges in one batchUpdate call."""
+    service = StubSheetsService()
+    with tempfile.TemporaryDirectory() as tmp:
+        export_to_gsheets(make_data(30), SHEET, service=service, snapshot_dir=tmp)
+        service.calls = []
+        df = make_data(32)
+        df.loc[5, 'weight'] = 70.0
+        df.loc[28, 'steps'] = 1
+        assert export_to_gsheets(df, SHEET, service=service, snapshot_dir=tmp)
+        assert service.calls == [('batchUpdate', [f'{SHEET}!A7:C7', f'{SHEET}!A30:C30', f'{SHEET}!A32:C33'])]
+        assert service.table() == expected_table(df)
+
+def test_removed_rows_are_emptied():
+    """Rows no longer in the data are overwritten with empty cells."""
+    service = StubSheetsService()
+    with tempfile.TemporaryDirectory() as tmp:
+        export_to_gsheets(make_data(30), SHEET, service=service, snapshot_dir=tmp)
+        df = make_data(25)
+        assert export_to_gsheets(df, SHEET, service=service, snapshot_dir=tmp)
+        assert service.calls[-1] == ('batchUpdate', [f'{SHEET}!A27:C31'])
+        assert service.table() == expected_table(df)
+
+def test_new_columns_upload_everything():
+    """A change of columns falls back to a full upload."""
+    service = StubSheetsService()
+    with tempfile.TemporaryDirectory() as tmp:
+        export_to_gsheets(make_data(30), SHEET, service=service, snapshot_dir=tmp)
+        service.calls = []
+        df = make_data(30).assign(body_fat=20.0)
+        assert export_to_gsheets(df, SHEET, service=service, snapshot_dir=tmp)
+        assert [call[0] for call in service.calls] == ['clear', 'update']
+        assert service.table() == expected_table(df)
+
+def test_full_mode_always_uploads_everything():
+    """With delta mode off, every export clears and uploads the whole sheet."""
+    service = StubSheetsService()
+    with tempfile.TemporaryDirectory() as tmp:
+        export_to_gsheets(make_data(30), SHEET, service=service, snapshot_dir=tmp, delta=False)
+        export_to_gsheets(make_data(30), SHEET, service=service, snapshot_dir=tmp, delta=False)
+        assert [call[0] for call in service.calls] == ['clear', 'update', 'clear', 'update']
+
+def test_shared_service_built_once():
+    """The Sheets service is built on first use and reused afterwards; failed builds are retried."""
+    builds = []
+    def build_stub(creds_file):
+        builds.append(creds_file)
+        return None if len(builds) == 1 else StubSheetsService()
+    original_build = ETL_general.build_sheets_service
+    ETL_general.build_sheets_service = build_stub
+    ETL_general._sheets_service = None
+    try:
+        assert get_sheets_service() is None
+        service = get_sheets_service()
+        assert service is not None and get_sheets_service() is service
+        with tempfile.TemporaryDirectory() as tmp:
+            assert export_to_gsheets(make_data(3), SHEET, snapshot_dir=tmp)
+        assert len(builds) == 2 and service.calls
+    finally:
+        ETL_general.build_sheets_service = original_build
+        ETL_general._sheets_service = None
+
+def main():
+    """Run the Google Sheets export tests against the stub service."""
+    tests = [value for name, value in globals().items() if name.startswith('test_')]
+    for test in tests:
+        test()
+        logger.info(f"{test.__name__}: OK")
+    logger.info(f"All {len(tests)} tests passed")
+
+if __name__ == "__main__":
+    main()
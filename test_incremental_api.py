@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import os
+import logging
+import tempfile
+import pandas as pd
+from ETL.ETL_general import upsert_by_date, update_incremental_api
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+EXISTING = pd.DataFrame({
+    'date': ['2024-03-16', '2024-03-17', '2024-03-18'],
+    'weight': [80.0, 79.8, 79.9],
+})
+
+def test_upsert_appends_new_dates():
+    """New dates after the existing ones are appended in order."""
+    df_new = pd.DataFrame({'date': ['2024-03-20', '2024-03-19'], 'weight': [79.5, 79.6]})
+    df = upsert_by_date(EXISTING, df_new)
+    assert df['date'].tolist() == ['2024-03-16', '2024-03-17', '2024-03-18', '2024-03-19', '2024-03-20']
+    assert df['weight'].tolist() == [80.0, 79.8, 79.9, 79.6, 79.5]
+
+def test_upsert_replaces_existing_dates():
+    """New rows win over existing rows of the same date, wherever they fall."""
+    df_new = pd.DataFrame({'date': ['2024-03-17', '2024-03-19'], 'weight': [70.0, 79.6]})
+    df = upsert_by_date(EXISTING, df_new)
+    assert df['date'].tolist() == ['2024-03-16', '2024-03-17', '2024-03-18', '2024-03-19']
+    assert df['weight'].tolist() == [80.0, 70.0, 79.9, 79.6]
+
+def test_upsert_keeps_last_duplicate_of_new_data():
+    """If the new data repeats a date, its last row is kept."""
+    df_new = pd.DataFrame({'date': ['2024-03-18', '2024-03-18'], 'weight': [1.0, 2.0]})
+    df = upsert_by_date(EXISTING, df_new)
+    assert df['weight'].tolist() == [80.0, 79.8, 2.0]
+
+def test_upsert_adds_new_columns():
+    """Columns only present in the new data are empty for older rows."""
+    df_new = pd.DataFrame({'date': ['2024-03-19'], 'weight': [79.6], 'body_fat': [20.1]})
+    df = upsert_by_date(EXISTING, df_new)
+    assert df['body_fat'].isna().sum() == 3
+    assert df['body_fat'].iloc[-1] == 20.1
+
+def test_update_incremental_api_writes_merged_file():
+    """The file holds the existing data upserted with the API data, written once."""
+    with tempfile.TemporaryDirectory() as tmp:
+        output_file = os.path.join(tmp, 'Weight.csv')
+        EXISTING.to_csv(output_file, index=False)
+        get_data = lambda client: pd.DataFrame({'date': ['2024-03-18', '2024-03-19'], 'weight': [79.0, 79.1]})
+        update_incremental_api(None, output_file, get_data)
+        df = pd.read_csv(output_file)
+        assert df['date'].tolist() == ['2024-03-16', '2024-03-17', '2024-03-18', '2024-03-19']
+        assert df['weight'].tolist() == [80.0, 79.8, 79.0, 79.1]
+
+def test_update_incremental_api_creates_file():
+    """Without an existing file, the API data is written as is."""
+    with tempfile.TemporaryDirectory() as tmp:
+        output_file = os.path.join(tmp, 'Weight.csv')
+        update_incremental_api(None, output_file, lambda client: EXISTING)
+        assert pd.read_csv(output_file).equals(EXISTING)
+
+def main():
+    """Run the incremental API upsert tests."""
+    tests = [value for name, value in globals().items() if name.startswith('test_')]
+    for test in tests:
+        test()
+        logger.info(f"{test.__name__}: OK")
+    logger.info(f"All {len(tests)} tests passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import os
+import logging
+import tempfile
+import pandas as pd
+from ETL import config
+from ETL import ETL_storage
+from ETL.ETL_storage import get_refresh_window, write_dataset_from, write_dataset_changes, load_dataset, get_pending_changes
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+NAME = 'weight'
+
+def make_data(start, days, offset=0.0):
+    return pd.DataFrame({
+        'date': pd.date_range(start, periods=days).strftime('%Y-%m-%d'),
+        'weight': [80.0 + offset + i / 10 for i in range(days)],
+        'body_fat': [20.0 + i / 100 for i in range(days)],
+    })
+
+def run_in_tmp(test):
+    """Run a test with the weight dataset and integration state in a scratch directory (CSV backend)."""
+    def wrapper():
+        path, state_file, backend = ETL_storage.DATASETS[NAME]['path'], config.INTEGRATION_STATE_FILE, config.STORAGE_BACKEND
+        with tempfile.TemporaryDirectory() as tmp:
+            ETL_storage.DATASETS[NAME]['path'] = os.path.join(tmp, 'Weight.csv')
+            config.INTEGRATION_STATE_FILE = os.path.join(tmp, 'Integration_state.json')
+            config.STORAGE_BACKEND = 'csv'
+            try:
+                test()
+            finally:
+                ETL_storage.DATASETS[NAME]['path'], config.INTEGRATION_STATE_FILE, config.STORAGE_BACKEND = path, state_file, backend
+    wrapper.__name__ = test.__name__
+    wrapper.__doc__ = test.__doc__
+    return wrapper
+
+@run_in_tmp
+def test_refresh_window_overlaps_last_week():
+    """The window starts 7 days before the last stored date, or at the default start without data."""
+    assert get_refresh_window(NAME, pd.Timestamp('2024-03-16').date()) == (pd.Timestamp('2024-03-16').date(), None)
+    write_dataset_from(NAME, make_data('2024-03-16', 30), None)
+    start, since = get_refresh_window(NAME)
+    assert start == since == pd.Timestamp('2024-04-07').date()
+
+@run_in_tmp
+def test_window_replaces_rows_from_since():
+    """Rows from since are replaced by the window, including days the window no longer has."""
+    write_dataset_from(NAME, make_data('2024-03-16', 30), None)
+    with open(ETL_storage.DATASETS[NAME]['path']) as f:
+        head = f.read().splitlines()[:20]
+    ETL_storage.clear_pending_changes([NAME])
+    window = make_data('2024-04-07', 10, offset=1.0)
+    window = window[window['date'] != '2024-04-10']
+    write_dataset_from(NAME, window, '2024-04-07')
+    df = load_dataset(NAME)
+    assert len(df) == 22 + 9 and df['date'].is_monotonic_increasing
+    assert df.loc[df['date'] == '2024-04-07', 'weight'].iloc[0] == 81.0
+    assert not (df['date'] == '2024-04-10').any()
+    with open(ETL_storage.DATASETS[NAME]['path']) as f:
+        assert f.read().splitlines()[:20] == head
+    assert get_pending_changes([NAME])[NAME] == (pd.Timestamp('2024-04-07'), None)
+
+@run_in_tmp
+def test_window_with_new_column_rewrites():
+    """A window bringing a new column rewrites the dataset, keeping the rows before since."""
+    write_dataset_from(NAME, make_data('2024-03-16', 30), None)
+    write_dataset_from(NAME, make_data('2024-04-07', 10).assign(bmi=24.0), '2024-04-07')
+    df = load_dataset(NAME)
+    assert len(df) == 32 and df['bmi'].notna().sum() == 10
+
+@run_in_tmp
+def test_changes_written_from_first_changed_date():
+    """A full version of a dataset only rewrites from its first changed date; an identical one writes nothing."""
+    write_dataset_from(NAME, make_data('2024-03-16', 30), None)
+    ETL_storage.clear_pending_changes([NAME])
+    df = make_data('2024-03-16', 30)
+    df.loc[20, 'weight'] = 70.0
+    write_dataset_changes(NAME, df)
+    assert get_pending_changes([NAME])[NAME][0] == pd.Timestamp('2024-04-05')
+    assert load_dataset(NAME)['weight'].tolist() == df['weight'].tolist()
+    ETL_storage.clear_pending_changes([NAME])
+    mtime = os.path.getmtime(ETL_storage.DATASETS[NAME]['path'])
+    write_dataset_changes(NAME, df)
+    assert os.path.getmtime(ETL_storage.DATASETS[NAME]['path']) == mtime
+    assert NAME not in get_pending_changes([NAME])
+
+def main():
+    """Run the refresh window write tests."""
+    tests = [value for name, value in globals().items() if name.startswith('test_')]
+    for test in tests:
+        test()
+        logger.info(f"{test.__name__}: OK")
+    logger.info(f"All {len(tests)} tests passed")
+
+if __name__ == "__main__":
+    main()